@@ -1,15 +1,78 @@
 from __future__ import annotations  # support list and dict types in Python < 3.9
+import argparse
 import boto3
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from contextlib import ExitStack
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import gzip
+from hashlib import blake2b
+from itertools import repeat
 import json
 from math import ceil, isclose
-from typing import Any, Dict
-from uuid import uuid4
+import os
+import random
+import sys
+from tempfile import TemporaryDirectory
+from threading import Lock
+import time
+from typing import Any, Dict, Iterable, Iterator, TextIO
+from uuid import UUID, uuid4, uuid5
 
 # Constants
 TABLE_NAME = "AWS-Shop-Store-Service-AWSServiceTable-EIXHOC4KO39Y"
 JSON_FILE_NAME = "aws-services.json"
+# Files with one service per line
+JSON_LINES_EXTENSIONS = (".jsonl", ".ndjson")
+# Number of characters to read at a time when streaming a JSON array
+JSON_READ_SIZE = 64 * 1024
+JSON_WHITESPACE = " \t\r\n"
+TRANSACT_WRITE_ITEMS = "transact-write-items"
 TRANSACT_WRITE_LIMIT = 100
+BATCH_WRITE_ITEM = "batch-write-item"
+BATCH_WRITE_LIMIT = 25
+# Max number of chunks written at the same time
+MAX_WORKERS = 8
+# Retry transient errors with exponential backoff (in seconds)
+MAX_ATTEMPTS = 5
+BASE_BACKOFF_DELAY = 0.1
+MAX_BACKOFF_DELAY = 5.0
+RETRYABLE_ERRORS = [
+    "InternalServerError",
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+    "ThrottlingException",
+    "TransactionInProgressException",
+]
+# Cancellation reasons for items in a transaction, "None" = the item itself was fine:
+# https://docs.aws.amazon.com/amazondynamodb/latest/APIReference/API_TransactWriteItems.html
+RETRYABLE_REASONS = [
+    "None",
+    "ProvisionedThroughputExceeded",
+    "ThrottlingError",
+    "TransactionConflict",
+]
+# Format of the files saved by --plan
+PLAN_VERSION = 1
+# Item that tells the store Lambda to invalidate its cache (must match src/app.py)
+CATALOG_VERSION_ID = "CatalogVersion"
+# Namespace of the IDs derived from service names (must match src/app.py)
+SERVICE_ID_NAMESPACE = UUID("aeb00cd9-0918-4805-931a-b982fba0689b")
+# Hash of the attributes from the JSON file, so unchanged services can be skipped
+CONTENT_HASH_KEY = "ContentHash"
+# Attributes that are only in DynamoDB, so they aren't compared with the JSON file
+DERIVED_ATTRIBUTES = ["Id", "NameLower", "DescriptionLower", CONTENT_HASH_KEY]
+# Attributes needed to find changed services
+HASH_PROJECTION = ["Id", "Name", CONTENT_HASH_KEY]
+BATCH_GET_LIMIT = 100
 # Reserved words in DynamoDB that can't be used in update expressions:
 # https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/ReservedWords.html
 RESERVED_WORDS = ["Name", "Unit"]
@@ -18,77 +81,357 @@ RESERVED_WORDS = ["Name", "Unit"]
 LocalService = Dict[str, Any]
 RemoteService = Dict[str, Dict[str, Any]]
 Transaction = Dict[str, Dict[str, Any]]
+WriteRequest = Dict[str, Dict[str, Any]]
 AttributeNames = Dict[str, str]
 AttributeValues = Dict[str, Dict[str, Any]]
+# Service name -> service
+LocalIndex = Dict[str, LocalService]
+RemoteIndex = Dict[str, RemoteService]
 
 
-def get_json_file() -> list[LocalService]:
+class ScanProgress:
+    """Print how many items have been scanned so far, across all segments"""
+
+    def __init__(self):
+        self.scanned_count = 0
+        self.lock = Lock()
+
+    def add(self, scanned_count: int):
+        with self.lock:
+            self.scanned_count += scanned_count
+            print(f"\rScanned {self.scanned_count} items...", end="", flush=True)
+
+    def finish(self):
+        if self.scanned_count:
+            print()
+
+
+@dataclass
+class ChunkResult:
+    """The outcome of writing one chunk of items"""
+
+    chunk_i: int
+    # Every item on success, or the items that weren't written on failure
+    items: list[Any]
+    attempts: int
+    latency: float
+    write_capacity_units: float = 0.0
+    # Why the chunk failed, or None if it succeeded
+    error: str | None = None
+
+
+@dataclass
+class ShardReport:
+    """The changes planned or written by one shard"""
+
+    shard_i: int
+    # Number of puts, updates, and deletes
+    counts: dict[str, int]
+    failed_items: list[Any]
+    elapsed: float
+
+
+def is_json_lines(file_name: str) -> bool:
+    return file_name.endswith(JSON_LINES_EXTENSIONS)
+
+
+def get_json_file(file_name: str = JSON_FILE_NAME) -> list[LocalService]:
     """Parse the AWS services from the JSON file"""
-    with open(JSON_FILE_NAME, "r") as aws_services_file:
+    if is_json_lines(file_name):
+        return list(iter_json_file(file_name))
+
+    with open(file_name, "r") as aws_services_file:
         return json.load(aws_services_file)
 
 
-def get_all_services(client) -> list[RemoteService] | None:
+def iter_json_array(file: TextIO) -> Iterator[Any]:
+    """
+    Parse each item of a JSON array one at a time, without reading the whole file. The array is
+    parsed strictly, so a truncated or corrupted file is never mistaken for a smaller catalog.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    is_eof = False
+    # What's allowed next: "[" (start), an item or "]" (first), an item (item),
+    # "," or "]" (separator), or nothing but whitespace (end)
+    state = "start"
+
+    while True:
+        while position < len(buffer) and buffer[position] in JSON_WHITESPACE:
+            position += 1
+
+        if position == len(buffer):
+            if is_eof:
+                if state == "end":
+                    return
+
+                raise ValueError("Unexpected end of JSON array")
+
+            buffer = file.read(JSON_READ_SIZE)
+            position = 0
+            is_eof = not buffer
+            continue
+
+        char = buffer[position]
+
+        if state == "start":
+            if char != "[":
+                raise ValueError("Expected the JSON file to contain an array")
+
+            state = "first"
+            position += 1
+            continue
+        if state == "end":
+            raise ValueError("Unexpected data after the JSON array")
+        if char == "]" and state in ("first", "separator"):
+            state = "end"
+            position += 1
+            continue
+        if state == "separator":
+            if char != ",":
+                raise ValueError(f"Expected ',' or ']' but found {char!r}")
+
+            state = "item"
+            position += 1
+            continue
+
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            item, end = None, None
+
+        # The item may be cut off at the end of the buffer, so read more and try again
+        if end is None or (end == len(buffer) and not is_eof):
+            if is_eof:
+                raise ValueError(f"Invalid JSON at position {position} of the buffer")
+
+            more = file.read(JSON_READ_SIZE)
+            is_eof = not more
+            buffer = buffer[position:] + more
+            position = 0
+            continue
+
+        yield item
+        state = "separator"
+        position = end
+
+
+def iter_json_file(file_name: str = JSON_FILE_NAME) -> Iterator[LocalService]:
+    """
+    Parse the AWS services from a JSON array or JSON Lines file one at a time, so that memory
+    doesn't grow with the size of the file.
+    """
+    with open(file_name, "r") as aws_services_file:
+        if is_json_lines(file_name):
+            for line in aws_services_file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from iter_json_array(aws_services_file)
+
+
+def get_content_hash(service: LocalService) -> str:
+    """
+    Hash the attributes of a service in the JSON file that are synced to DynamoDB. Numbers are
+    hashed as floats, so that 3, 3.0, and 3e0 have the same hash.
+    """
+    canonical_service = {
+        key: float(value) if isinstance(value, (int, float)) else value
+        for key, value in service.items()
+        if key not in DERIVED_ATTRIBUTES
+    }
+    canonical_json = json.dumps(
+        canonical_service, sort_keys=True, separators=(",", ":")
+    )
+    return blake2b(canonical_json.encode(), digest_size=16).hexdigest()
+
+
+def get_remote_content_hash(service: RemoteService) -> str | None:
+    return service.get(CONTENT_HASH_KEY, {}).get("S")
+
+
+def get_full_services(client, remote_services: list[RemoteService]) -> RemoteIndex:
+    """Read every attribute of the given services with batch-get-item, keyed by name"""
+    full_index: RemoteIndex = {}
+
+    for chunk_start in range(0, len(remote_services), BATCH_GET_LIMIT):
+        keys = [
+            {"Id": service["Id"], "Name": service["Name"]}
+            for service in remote_services[chunk_start : chunk_start + BATCH_GET_LIMIT]
+        ]
+
+        for attempt in range(MAX_ATTEMPTS):
+            batch_get_response = client.batch_get_item(
+                RequestItems={TABLE_NAME: {"Keys": keys}}
+            )
+
+            for item in batch_get_response["Responses"].get(TABLE_NAME, []):
+                full_index[item["Name"]["S"]] = item
+
+            # Keys that weren't read (usually due to throttling) must be sent again
+            keys = (
+                batch_get_response.get("UnprocessedKeys", {})
+                .get(TABLE_NAME, {})
+                .get("Keys", [])
+            )
+
+            if not keys:
+                break
+
+            time.sleep(get_backoff_delay(attempt))
+        else:
+            raise RuntimeError(
+                f"Couldn't read {len(keys)} services after {MAX_ATTEMPTS} attempts"
+            )
+
+    return full_index
+
+
+def scan_segment(
+    client,
+    scan_kwargs: dict[str, Any],
+    progress: ScanProgress,
+    segment: int | None = None,
+    total_segments: int | None = None,
+) -> tuple[list[RemoteService], float]:
+    """
+    Scan one segment of the table, following LastEvaluatedKey until every page is read.
+
+    Returns the items and the read capacity units consumed.
+    """
+    scan_kwargs = {**scan_kwargs}
+
+    if segment is not None:
+        scan_kwargs["Segment"] = segment
+        scan_kwargs["TotalSegments"] = total_segments
+
+    items: list[RemoteService] = []
+    read_capacity_units = 0.0
+
+    # Each page is capped at 1 MB, so keep scanning until there's no LastEvaluatedKey
+    while True:
+        scan_response = client.scan(**scan_kwargs)
+        items.extend(scan_response["Items"])
+        read_capacity_units += scan_response["ConsumedCapacity"]["CapacityUnits"]
+        progress.add(scan_response["ScannedCount"])
+
+        if "LastEvaluatedKey" not in scan_response:
+            return items, read_capacity_units
+
+        scan_kwargs["ExclusiveStartKey"] = scan_response["LastEvaluatedKey"]
+
+
+def get_all_services(
+    client, attributes: list[str] | None = None, total_segments: int = 1
+) -> list[RemoteService] | None:
     """
-    Get all the AWS services currently in the DynamoDB table.
+    Get all the AWS services currently in the DynamoDB table. If attributes are given, only those
+    are read. Segments of the table are scanned in parallel if total_segments > 1.
 
     Returns None if the API call fails.
     """
+    scan_kwargs: dict[str, Any] = {
+        "TableName": TABLE_NAME,
+        "ReturnConsumedCapacity": "TOTAL",
+    }
+
+    if attributes is not None:
+        # Use placeholders for every attribute, since some are reserved words
+        attribute_names = {f"#attr{i}": key for i, key in enumerate(attributes)}
+        scan_kwargs["ProjectionExpression"] = ", ".join(attribute_names)
+        scan_kwargs["ExpressionAttributeNames"] = attribute_names
+
+    progress = ScanProgress()
+
     try:
-        scan_response = client.scan(
-            TableName=TABLE_NAME,
-            ReturnConsumedCapacity="INDEXES",
-        )
-        num_items = scan_response["ScannedCount"]
-        read_capacity_units = scan_response["ConsumedCapacity"]["CapacityUnits"]
-        print(
-            f"Successfully scanned {num_items} items and used {read_capacity_units} read capacity units (RCU)"
-        )
-        return scan_response["Items"]
+        if total_segments > 1:
+            with ThreadPoolExecutor(max_workers=total_segments) as executor:
+                segment_results = list(
+                    executor.map(
+                        lambda segment: scan_segment(
+                            client, scan_kwargs, progress, segment, total_segments
+                        ),
+                        range(total_segments),
+                    )
+                )
+        else:
+            segment_results = [scan_segment(client, scan_kwargs, progress)]
     except ClientError as error:
+        progress.finish()
         print(f"scan client error: {error}")
         return None
 
+    progress.finish()
+    items = [item for segment_items, _ in segment_results for item in segment_items]
+    read_capacity_units = sum(segment_rcu for _, segment_rcu in segment_results)
+    print(
+        f"Successfully scanned {len(items)} items across {total_segments} segment(s) and used {read_capacity_units} read capacity units (RCU)"
+    )
+    # The catalog version isn't a service
+    return [item for item in items if item["Id"]["S"] != CATALOG_VERSION_ID]
+
+
+def index_local_services(local_services: list[LocalService]) -> LocalIndex:
+    """Key the services in the JSON file by name, keeping the first service with each name"""
+    local_index: LocalIndex = {}
+
+    for service in local_services:
+        if local_index.setdefault(service["Name"], service) is not service:
+            print(f"Skipping duplicate service: {service['Name']}")
+
+    return local_index
+
+
+def index_remote_services(remote_services: list[RemoteService]) -> RemoteIndex:
+    """Key the services in DynamoDB by name"""
+    return {service["Name"]["S"]: service for service in remote_services}
+
+
+def get_service_id(name: str) -> str:
+    """Derive the partition key from the service name, so the store can look it up directly"""
+    return str(uuid5(SERVICE_ID_NAMESPACE, name))
+
+
+def create_put_request(service: LocalService) -> Transaction:
+    """Transform a service in the JSON file to a supported format for the transact-write-items API"""
+    # Add a UUID derived from the name to each item as the partition key
+    service["Id"] = get_service_id(service["Name"])
+    # Add the name and description in lowercase to help with case insensitive querying
+    service["NameLower"] = service["Name"].lower()
+    service["DescriptionLower"] = service["Description"].lower()
+    # Let future syncs skip the service if it hasn't changed
+    service[CONTENT_HASH_KEY] = get_content_hash(service)
+
+    service_with_types: RemoteService = {}
+
+    for key, value in service.items():
+        # Set the type of each service property, according to:
+        # https://docs.aws.amazon.com/amazondynamodb/latest/APIReference/API_AttributeValue.html
+        if value is None:
+            service_with_types[key] = {"NULL": True}
+        elif type(value) is str:
+            service_with_types[key] = {"S": value}
+        else:
+            service_with_types[key] = {"N": str(value)}
+
+    return {
+        "Put": {
+            "Item": service_with_types,
+            "TableName": TABLE_NAME,
+            "ReturnValuesOnConditionCheckFailure": "ALL_OLD",
+        }
+    }
+
 
 def add_services(
-    local_services: list[LocalService], services_to_create: set[str]
+    local_index: LocalIndex, services_to_create: set[str]
 ) -> list[Transaction]:
     """Add all AWS services present in the JSON file, but not in DynamoDB"""
-    # Transform the JSON file to a supported format for the transact-write-items API
-    put_requests: list[Transaction] = []
-    filtered_services = [
-        service for service in local_services if service["Name"] in services_to_create
+    put_requests = [
+        create_put_request(local_index[service_name])
+        for service_name in services_to_create
     ]
-
-    for service in filtered_services:
-        # Add a random UUID to each item as the partition key
-        service["Id"] = str(uuid4())
-        # Add the name and description in lowercase to help with case insensitive querying
-        service["NameLower"] = service["Name"].lower()
-        service["DescriptionLower"] = service["Description"].lower()
-
-        service_with_types: RemoteService = {}
-
-        for key, value in service.items():
-            # Set the type of each service property, according to:
-            # https://docs.aws.amazon.com/amazondynamodb/latest/APIReference/API_AttributeValue.html
-            if value is None:
-                service_with_types[key] = {"NULL": True}
-            elif type(value) is str:
-                service_with_types[key] = {"S": value}
-            else:
-                service_with_types[key] = {"N": str(value)}
-
-        put_requests.append(
-            {
-                "Put": {
-                    "Item": service_with_types,
-                    "TableName": TABLE_NAME,
-                    "ReturnValuesOnConditionCheckFailure": "ALL_OLD",
-                }
-            }
-        )
-
     print(f"Adding the following services: {services_to_create}")
     return put_requests
 
@@ -125,11 +468,10 @@ def is_equal(
             keys_to_update.append(key)
 
     # All keys that are only defined in DynamoDB should be deleted (except reserved fields)
-    reserved_fields = ["Id", "NameLower", "DescriptionLower"]
     keys_to_delete = [
         key
         for key in remote_service
-        if key not in local_service and key not in reserved_fields
+        if key not in local_service and key not in DERIVED_ATTRIBUTES
     ]
     is_eq = not (keys_to_update or keys_to_delete)
     return is_eq, keys_to_update, keys_to_delete
@@ -203,122 +545,912 @@ def create_update_expression(
     return update_expression, expression_names, expression_values
 
 
-def update_services(
-    local_services: list[LocalService],
-    remote_services: list[RemoteService],
-    common_services: set[str],
-) -> list[Transaction]:
-    """Update all AWS services changed in the JSON file"""
-    update_requests: list[Transaction] = []
-    filtered_services = []
-    update_expressions: dict[str, tuple[str, AttributeNames, AttributeValues]] = {}
+def create_update_request(
+    local_service: LocalService,
+    remote_service: RemoteService,
+    keys_to_update: list[str],
+    keys_to_delete: list[str],
+) -> Transaction:
+    """
+    Create a request to update the keys of a service that differ from the JSON file, along with
+    its content hash
+    """
+    # The primary key is a composite key containing the service's ID and name
+    # (the ID only appears in DynamoDB)
+    primary_key = {"Id": remote_service["Id"], "Name": {"S": local_service["Name"]}}
+    update_expression, expression_name, expression_value = create_update_expression(
+        {**local_service, CONTENT_HASH_KEY: get_content_hash(local_service)},
+        [*keys_to_update, CONTENT_HASH_KEY],
+        keys_to_delete,
+    )
+    update_request = {
+        "Update": {
+            "Key": primary_key,
+            "UpdateExpression": update_expression,
+            "TableName": TABLE_NAME,
+            "ReturnValuesOnConditionCheckFailure": "ALL_OLD",
+        }
+    }
 
-    for common_service in common_services:
-        local_service = next(
-            service for service in local_services if service["Name"] == common_service
-        )
-        remote_service = next(
-            service
-            for service in remote_services
-            if service["Name"]["S"] == common_service
+    # ExpressionAttributeValues and ExpressionAttributeNames must not be empty
+    if expression_value:
+        update_request["Update"]["ExpressionAttributeValues"] = expression_value
+    if expression_name:
+        update_request["Update"]["ExpressionAttributeNames"] = expression_name
+
+    return update_request
+
+
+def diff_changed_services(
+    changed_services: list[tuple[LocalService, RemoteService]], client=None
+) -> Iterator[Transaction]:
+    """
+    Compare every attribute of services whose content hash doesn't match DynamoDB.
+
+    If a client is given, the remote services only need their keys, and their full items are
+    read in batches. Yields an update request for each service, which at least stores the new
+    content hash.
+    """
+    if client is not None:
+        full_index = get_full_services(
+            client, [remote_service for _, remote_service in changed_services]
         )
 
+    for local_service, remote_service in changed_services:
+        if client is not None:
+            remote_service = full_index.get(local_service["Name"])
+
+            # Skip services deleted since the table was scanned
+            if remote_service is None:
+                continue
+
         # Gather all the differences between the JSON file and DynamoDB table into an update expression
-        is_eq, keys_to_update, keys_to_delete = is_equal(local_service, remote_service)
+        _, keys_to_update, keys_to_delete = is_equal(local_service, remote_service)
+        yield create_update_request(
+            local_service, remote_service, keys_to_update, keys_to_delete
+        )
 
-        if not is_eq:
-            # The ID only appears in DynamoDB
-            filtered_services.append({**local_service, "Id": remote_service["Id"]})
-            update_expressions[local_service["Name"]] = create_update_expression(
-                local_service, keys_to_update, keys_to_delete
-            )
 
-    for service in filtered_services:
-        # The primary key is a composite key containing the service's ID and name
-        primary_key = {"Id": service["Id"], "Name": {"S": service["Name"]}}
-        update_expression, expression_name, expression_value = update_expressions[
-            service["Name"]
-        ]
-        update_request = {
-            "Update": {
-                "Key": primary_key,
-                "UpdateExpression": update_expression,
-                "TableName": TABLE_NAME,
-                "ReturnValuesOnConditionCheckFailure": "ALL_OLD",
-            }
-        }
+def update_services(
+    local_index: LocalIndex,
+    remote_index: RemoteIndex,
+    common_services: set[str],
+    client=None,
+) -> list[Transaction]:
+    """
+    Update all AWS services changed in the JSON file. Only services whose content hash differs
+    are compared attribute by attribute (see diff_changed_services).
+    """
+    changed_services = []
 
-        # ExpressionAttributeValues and ExpressionAttributeNames must not be empty
-        if expression_value:
-            update_request["Update"]["ExpressionAttributeValues"] = expression_value
-        if expression_name:
-            update_request["Update"]["ExpressionAttributeNames"] = expression_name
+    for common_service in common_services:
+        local_service = local_index[common_service]
+        remote_service = remote_index[common_service]
 
-        update_requests.append(update_request)
+        if get_remote_content_hash(remote_service) != get_content_hash(local_service):
+            changed_services.append((local_service, remote_service))
 
-    updated_services = {service["Name"] for service in filtered_services}
+    update_requests = list(diff_changed_services(changed_services, client))
+    updated_services = {get_transaction_name(request) for request in update_requests}
     print(f"Updating the following services: {updated_services}")
     return update_requests
 
 
+def create_delete_request(service: RemoteService) -> Transaction:
+    """Create a request to delete a service from DynamoDB"""
+    primary_key = {"Id": service["Id"], "Name": service["Name"]}
+    return {
+        "Delete": {
+            "Key": primary_key,
+            "TableName": TABLE_NAME,
+            "ReturnValuesOnConditionCheckFailure": "ALL_OLD",
+        }
+    }
+
+
 def remove_services(
-    remote_services: list[RemoteService], services_to_delete: set[str]
+    remote_index: RemoteIndex, services_to_delete: set[str]
 ) -> list[Transaction]:
     """Remove all AWS services present in DynamoDB, but no longer present in the JSON file"""
-    delete_requests: list[Transaction] = []
-    filtered_services = [
-        service
-        for service in remote_services
-        if service["Name"]["S"] in services_to_delete
+    delete_requests = [
+        create_delete_request(remote_index[service_name])
+        for service_name in services_to_delete
     ]
-
-    for service in filtered_services:
-        primary_key = {"Id": service["Id"], "Name": service["Name"]}
-        delete_requests.append(
-            {
-                "Delete": {
-                    "Key": primary_key,
-                    "TableName": TABLE_NAME,
-                    "ReturnValuesOnConditionCheckFailure": "ALL_OLD",
-                }
-            }
-        )
-
     print(f"Deleting the following services: {services_to_delete}")
     return delete_requests
 
 
+def plan_changes(
+    local_services: list[LocalService],
+    remote_services: list[RemoteService],
+    client=None,
+) -> tuple[list[Transaction], list[Transaction], list[Transaction]]:
+    """
+    Compare the services in the JSON file and DynamoDB. If a client is given, the remote
+    services only need the attributes in HASH_PROJECTION.
+
+    Returns the put, update, and delete requests needed to make DynamoDB match the JSON file.
+    """
+    # Index both catalogs by name once, so that each lookup is O(1)
+    local_index = index_local_services(local_services)
+    remote_index = index_remote_services(remote_services)
+
+    # Compare which service names are only present locally/remotely
+    local_services_set = local_index.keys()
+    remote_services_set = remote_index.keys()
+    services_to_create = local_services_set - remote_services_set
+    services_to_delete = remote_services_set - local_services_set
+    common_services = local_services_set & remote_services_set
+
+    # Gather all the create, update, and delete operations
+    put_items = add_services(local_index, services_to_create)
+    update_items = update_services(local_index, remote_index, common_services, client)
+    delete_items = remove_services(remote_index, services_to_delete)
+    return put_items, update_items, delete_items
+
+
+def iter_changes(
+    local_services: Iterable[LocalService], remote_index: RemoteIndex, client=None
+) -> Iterator[Transaction]:
+    """
+    Compare a stream of services from the JSON file with DynamoDB, one service at a time. If a
+    client is given, the remote services only need the attributes in HASH_PROJECTION.
+
+    Yields the put, update, and delete requests needed to make DynamoDB match the JSON file.
+    Only the names of the local services (and one batch of changed services) are kept in memory.
+    """
+    seen_names: set[str] = set()
+    changed_services: list[tuple[LocalService, RemoteService]] = []
+
+    for local_service in local_services:
+        name = local_service["Name"]
+
+        # Keep the first service with each name
+        if name in seen_names:
+            print(f"Skipping duplicate service: {name}")
+            continue
+
+        seen_names.add(name)
+        remote_service = remote_index.get(name)
+
+        if remote_service is None:
+            yield create_put_request(local_service)
+            continue
+
+        if get_remote_content_hash(remote_service) != get_content_hash(local_service):
+            changed_services.append((local_service, remote_service))
+
+        # Read the full items of changed services in batches
+        if len(changed_services) == BATCH_GET_LIMIT:
+            yield from diff_changed_services(changed_services, client)
+            changed_services = []
+
+    yield from diff_changed_services(changed_services, client)
+
+    for name, remote_service in remote_index.items():
+        if name not in seen_names:
+            yield create_delete_request(remote_service)
+
+
+def iter_counted(
+    transactions: Iterable[Transaction], counts: dict[str, int]
+) -> Iterator[Transaction]:
+    """Pass the transactions through, counting the number of each type of change"""
+    for transaction in transactions:
+        counts[next(iter(transaction))] += 1
+        yield transaction
+
+
+def save_changes(
+    changes_file: TextIO, transactions: Iterable[Transaction]
+) -> dict[str, int]:
+    """
+    Write the changes to a JSON Lines file as they're planned, so they can be written later
+    without keeping them in memory or comparing the services again.
+
+    Returns the number of each type of change.
+    """
+    counts = {"Put": 0, "Update": 0, "Delete": 0}
+
+    for transaction in iter_counted(transactions, counts):
+        changes_file.write(json.dumps(transaction, separators=(",", ":")) + "\n")
+
+    return counts
+
+
+def read_changes(changes_file: TextIO) -> Iterator[Transaction]:
+    """Read the changes saved by save_changes one at a time"""
+    for line in changes_file:
+        yield json.loads(line)
+
+
+def get_transaction_name(transaction: Transaction | WriteRequest) -> str:
+    """Get the name of the service that a transaction or batch write request writes to"""
+    action = next(iter(transaction.values()))
+
+    if "Item" in action:
+        return action["Item"]["Name"]["S"]
+
+    return action["Key"]["Name"]["S"]
+
+
+def get_error_code(error: ClientError | BotoCoreError) -> str:
+    """Get the error code of an API error, or the name of a network error"""
+    if isinstance(error, ClientError):
+        return error.response["Error"]["Code"]
+
+    return type(error).__name__
+
+
+def is_retryable(error: ClientError | BotoCoreError) -> bool:
+    """Check if a failed write may succeed if it's tried again"""
+    # Connection errors and timeouts never reached DynamoDB (or the response was lost)
+    if isinstance(error, BotoCoreError):
+        return True
+
+    error_code = error.response["Error"]["Code"]
+
+    if error_code == "TransactionCanceledException":
+        # Only retry if every item was canceled due to conflicts or throttling (not validation)
+        reasons = error.response.get("CancellationReasons", [])
+        return all(reason.get("Code") in RETRYABLE_REASONS for reason in reasons)
+
+    return error_code in RETRYABLE_ERRORS
+
+
+def get_backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter, so that workers don't retry in lockstep"""
+    return random.uniform(0, min(MAX_BACKOFF_DELAY, BASE_BACKOFF_DELAY * 2**attempt))
+
+
+def write_transaction_chunk(
+    client, chunk_i: int, transact_items_chunk: list[Transaction]
+) -> ChunkResult:
+    """Write one chunk of items in a transaction, retrying transient errors"""
+    # Reusing the token makes retries idempotent if a previous attempt actually succeeded
+    client_request_token = str(uuid4())
+    start = time.perf_counter()
+
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            transact_write_response = client.transact_write_items(
+                TransactItems=transact_items_chunk,
+                ClientRequestToken=client_request_token,
+                ReturnConsumedCapacity="INDEXES",
+                ReturnItemCollectionMetrics="SIZE",
+            )
+            write_capacity_units = sum(
+                capacity["WriteCapacityUnits"]
+                for capacity in transact_write_response["ConsumedCapacity"]
+            )
+            return ChunkResult(
+                chunk_i,
+                transact_items_chunk,
+                attempt + 1,
+                time.perf_counter() - start,
+                write_capacity_units,
+            )
+        except (ClientError, BotoCoreError) as error:
+            if attempt == MAX_ATTEMPTS - 1 or not is_retryable(error):
+                return ChunkResult(
+                    chunk_i,
+                    transact_items_chunk,
+                    attempt + 1,
+                    time.perf_counter() - start,
+                    error=str(error),
+                )
+
+            delay = get_backoff_delay(attempt)
+            print(
+                f"Transaction chunk #{chunk_i + 1} failed ({get_error_code(error)}), retrying in {delay:.2f}s"
+            )
+            time.sleep(delay)
+
+
+def chunk_writes(
+    transactions: Iterable[Transaction], bulk: bool = False
+) -> Iterator[tuple[str, list[Any]]]:
+    """
+    Group transactions into chunks as they arrive, so that they don't all need to be in memory.
+
+    If bulk is True, puts and deletes are grouped into batch-write-item requests instead of
+    transactions. Yields the operation to write each chunk with and the chunk.
+    """
+    limits = {
+        TRANSACT_WRITE_ITEMS: TRANSACT_WRITE_LIMIT,
+        BATCH_WRITE_ITEM: BATCH_WRITE_LIMIT,
+    }
+    chunks: dict[str, list[Any]] = {TRANSACT_WRITE_ITEMS: [], BATCH_WRITE_ITEM: []}
+
+    for transaction in transactions:
+        if bulk and "Update" not in transaction:
+            operation = BATCH_WRITE_ITEM
+            chunks[operation].append(to_write_request(transaction))
+        else:
+            operation = TRANSACT_WRITE_ITEMS
+            chunks[operation].append(transaction)
+
+        if len(chunks[operation]) == limits[operation]:
+            yield operation, chunks[operation]
+            chunks[operation] = []
+
+    for operation, chunk in chunks.items():
+        if chunk:
+            yield operation, chunk
+
+
+def write_chunks(
+    client, chunks: Iterable[tuple[str, list[Any]]], max_workers: int
+) -> tuple[int, list[Any], float]:
+    """
+    Write each chunk in parallel, printing the outcome of each one. Only a few chunks are
+    submitted ahead of the workers, so chunks can be generated lazily.
+
+    Returns the number of items, the items that failed to be written (in the same order they
+    were given), and the total write capacity units consumed.
+    """
+    num_items = 0
+    failed_chunks: list[ChunkResult] = []
+    total_write_capacity_units = 0.0
+    # Future -> operation, chunk index, and chunk
+    pending_futures: dict[Future, tuple[str, int, list[Any]]] = {}
+
+    def collect_results(futures: Iterable[Future]):
+        nonlocal total_write_capacity_units
+
+        for future in futures:
+            operation, chunk_i, chunk = pending_futures.pop(future)
+
+            try:
+                result = future.result()
+            except Exception as error:
+                # Report the chunk as failed instead of aborting the other chunks
+                result = ChunkResult(chunk_i, chunk, 1, 0.0, error=repr(error))
+
+            if result.error is None:
+                total_write_capacity_units += result.write_capacity_units
+                print(
+                    f"Success! {operation} chunk #{result.chunk_i + 1} consumed {result.write_capacity_units} write capacity units (WCU) across the table and all GSIs (Global Secondary Indexes) in {result.latency * 1000:.0f}ms ({result.attempts} attempt(s))"
+                )
+            else:
+                failed_chunks.append(result)
+                print(
+                    f"{operation} error in chunk #{result.chunk_i + 1} after {result.attempts} attempt(s): {result.error}"
+                )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for chunk_i, (operation, chunk) in enumerate(chunks):
+            # Wait for a worker to free up before generating more chunks
+            if len(pending_futures) >= 2 * max_workers:
+                done_futures, _ = wait(pending_futures, return_when=FIRST_COMPLETED)
+                collect_results(done_futures)
+
+            write_chunk = (
+                write_batch
+                if operation == BATCH_WRITE_ITEM
+                else write_transaction_chunk
+            )
+            future = executor.submit(write_chunk, client, chunk_i, chunk)
+            pending_futures[future] = (operation, chunk_i, chunk)
+            num_items += len(chunk)
+
+        collect_results(as_completed(list(pending_futures)))
+
+    failed_chunks.sort(key=lambda result: result.chunk_i)
+    failed_items = [item for result in failed_chunks for item in result.items]
+    return num_items, failed_items, total_write_capacity_units
+
+
+def perform_writes(
+    client,
+    transactions: Iterable[Transaction],
+    bulk: bool = False,
+    max_workers: int = MAX_WORKERS,
+) -> list[Any]:
+    """
+    Write a stream of put, update, and delete requests, printing a summary at the end.
+
+    Returns the items that failed to be written.
+    """
+    start = time.perf_counter()
+    num_items, failed_items, write_capacity_units = write_chunks(
+        client, chunk_writes(transactions, bulk), max_workers
+    )
+    print(
+        f"Wrote {num_items - len(failed_items)}/{num_items} items in {time.perf_counter() - start:.2f}s and consumed {write_capacity_units} WCU"
+    )
+
+    if failed_items:
+        failed_services = sorted(get_transaction_name(item) for item in failed_items)
+        print(f"Failed to write the following services: {failed_services}")
+
+    return failed_items
+
+
 def perform_transaction(
     client,
     put_items: list[Transaction],
     update_items: list[Transaction],
     delete_items: list[Transaction],
-):
-    """Run all create, update, and delete actions in one API call"""
+    max_workers: int = MAX_WORKERS,
+) -> list[Transaction]:
+    """
+    Run all create, update, and delete actions in transactions. Each service is only written
+    once, so the chunks are independent and run in parallel.
+
+    Returns the items that failed to be written.
+    """
     transact_items = put_items + update_items + delete_items
     # Split request items into chunks to satisfy transact-write-items's constraint
     num_chunks = ceil(len(transact_items) / TRANSACT_WRITE_LIMIT)
     print(f"Splitting transact-write-items into {num_chunks} chunk(s)")
+    return perform_writes(client, transact_items, max_workers=max_workers)
 
-    for chunk_i in range(num_chunks):
-        transact_items_chunk = transact_items[
-            (chunk_i * TRANSACT_WRITE_LIMIT) : ((chunk_i + 1) * TRANSACT_WRITE_LIMIT)
-        ]
 
+def to_write_request(transaction: Transaction) -> WriteRequest:
+    """Convert a put or delete transaction to a batch-write-item request"""
+    if "Put" in transaction:
+        return {"PutRequest": {"Item": transaction["Put"]["Item"]}}
+
+    return {"DeleteRequest": {"Key": transaction["Delete"]["Key"]}}
+
+
+def write_batch(
+    client, batch_i: int, write_requests: list[WriteRequest]
+) -> ChunkResult:
+    """Write one batch of items, re-sending unprocessed items until they're all written"""
+    pending_requests = write_requests
+    write_capacity_units = 0.0
+    start = time.perf_counter()
+
+    for attempt in range(MAX_ATTEMPTS):
         try:
-            transact_write_response = client.transact_write_items(
-                TransactItems=transact_items_chunk,
+            batch_write_response = client.batch_write_item(
+                RequestItems={TABLE_NAME: pending_requests},
                 ReturnConsumedCapacity="INDEXES",
-                ReturnItemCollectionMetrics="SIZE",
             )
-            write_capacity_units = transact_write_response["ConsumedCapacity"][0][
-                "WriteCapacityUnits"
-            ]
+        except (ClientError, BotoCoreError) as error:
+            if attempt == MAX_ATTEMPTS - 1 or not is_retryable(error):
+                return ChunkResult(
+                    batch_i,
+                    pending_requests,
+                    attempt + 1,
+                    time.perf_counter() - start,
+                    write_capacity_units,
+                    str(error),
+                )
+
+            error_message = get_error_code(error)
+        else:
+            write_capacity_units += sum(
+                capacity["CapacityUnits"]
+                for capacity in batch_write_response.get("ConsumedCapacity", [])
+            )
+            # Items that weren't written (usually due to throttling) must be sent again
+            pending_requests = batch_write_response.get("UnprocessedItems", {}).get(
+                TABLE_NAME, []
+            )
+
+            if not pending_requests:
+                return ChunkResult(
+                    batch_i,
+                    write_requests,
+                    attempt + 1,
+                    time.perf_counter() - start,
+                    write_capacity_units,
+                )
+            elif attempt == MAX_ATTEMPTS - 1:
+                return ChunkResult(
+                    batch_i,
+                    pending_requests,
+                    attempt + 1,
+                    time.perf_counter() - start,
+                    write_capacity_units,
+                    f"{len(pending_requests)} unprocessed item(s)",
+                )
+
+            error_message = f"{len(pending_requests)} unprocessed item(s)"
+
+        delay = get_backoff_delay(attempt)
+        print(
+            f"Batch #{batch_i + 1} failed ({error_message}), retrying in {delay:.2f}s"
+        )
+        time.sleep(delay)
+
+
+def perform_batch_write(
+    client,
+    put_items: list[Transaction],
+    delete_items: list[Transaction],
+    max_workers: int = MAX_WORKERS,
+) -> list[WriteRequest]:
+    """
+    Run all create and delete actions with batch-write-item, which costs half as many WCUs as a
+    transaction. Batches aren't atomic, but puts and deletes don't depend on each other.
+
+    Returns the items that failed to be written.
+    """
+    write_items = put_items + delete_items
+    # Split request items into batches to satisfy batch-write-item's constraint
+    num_batches = ceil(len(write_items) / BATCH_WRITE_LIMIT)
+    print(f"Splitting batch-write-item into {num_batches} batch(es)")
+    return perform_writes(client, write_items, bulk=True, max_workers=max_workers)
+
+
+def update_catalog_version(client) -> bool:
+    """
+    Stamp the table with a new catalog version so the store Lambda refreshes its cache.
+
+    Returns whether the version was updated.
+    """
+    version = datetime.now(timezone.utc).isoformat()
+
+    try:
+        client.put_item(
+            TableName=TABLE_NAME,
+            Item={
+                "Id": {"S": CATALOG_VERSION_ID},
+                "Name": {"S": CATALOG_VERSION_ID},
+                "Version": {"S": version},
+            },
+        )
+        print(f"Updated the catalog version to {version}")
+        return True
+    except (ClientError, BotoCoreError) as error:
+        print(f"put-item client error: {error}")
+        print(
+            "The store may serve stale services until the catalog version is updated, so run the sync again"
+        )
+        return False
+
+
+def get_catalog_version(client) -> str | None:
+    """Get the version stamped by the last sync, or None if the table has never been synced"""
+    get_response = client.get_item(
+        TableName=TABLE_NAME,
+        Key={"Id": {"S": CATALOG_VERSION_ID}, "Name": {"S": CATALOG_VERSION_ID}},
+        ConsistentRead=True,
+    )
+    return get_response.get("Item", {}).get("Version", {}).get("S")
+
+
+def get_snapshot_hash(remote_services: Iterable[RemoteService]) -> str:
+    """Hash the keys and content hashes of the services in DynamoDB, in a stable order"""
+    snapshot = sorted(
+        (
+            service["Name"]["S"],
+            service["Id"]["S"],
+            get_remote_content_hash(service) or "",
+        )
+        for service in remote_services
+    )
+    return blake2b(
+        json.dumps(snapshot, separators=(",", ":")).encode(), digest_size=16
+    ).hexdigest()
+
+
+def write_plan(
+    plan_file_name: str,
+    transactions: Iterable[Transaction],
+    catalog_version: str | None,
+    snapshot_hash: str,
+) -> dict[str, int]:
+    """
+    Save the changes to a gzipped JSON Lines file: a header describing the table the changes
+    were planned against, followed by one put, update, or delete request per line.
+
+    The plan is written to a temporary file and only renamed once it's complete, so a failure
+    (like a truncated JSON file) doesn't leave a partial plan that could be applied.
+
+    Returns the number of each type of change.
+    """
+    header = {
+        "version": PLAN_VERSION,
+        "table": TABLE_NAME,
+        "createdAt": datetime.now(timezone.utc).isoformat(),
+        "catalogVersion": catalog_version,
+        "snapshotHash": snapshot_hash,
+    }
+
+    partial_file_name = f"{plan_file_name}.partial"
+
+    try:
+        with gzip.open(partial_file_name, "wt") as plan_file:
+            plan_file.write(json.dumps(header, separators=(",", ":")) + "\n")
+            counts = save_changes(plan_file, transactions)
+
+        os.replace(partial_file_name, plan_file_name)
+    except BaseException:
+        if os.path.exists(partial_file_name):
+            os.remove(partial_file_name)
+        raise
+
+    print(
+        f"Saved a plan to add {counts['Put']} services, update {counts['Update']} services, and delete {counts['Delete']} services to {plan_file_name}"
+    )
+    return counts
+
+
+def read_plan_header(plan_file: TextIO) -> dict[str, Any]:
+    """Read the header of a plan, checking that it can be applied to this table"""
+    header = json.loads(plan_file.readline())
+
+    if header.get("version") != PLAN_VERSION:
+        raise ValueError(f"Unsupported plan version: {header.get('version')}")
+    if header["table"] != TABLE_NAME:
+        raise ValueError(f"The plan was made for {header['table']}, not {TABLE_NAME}")
+
+    return header
+
+
+def apply_plan(client, args: argparse.Namespace):
+    """Write the changes saved by --plan, without scanning the table again"""
+    with gzip.open(args.apply, "rt") as plan_file:
+        header = read_plan_header(plan_file)
+        print(
+            f"Applying the plan created at {header['createdAt']} (snapshot {header['snapshotHash']})"
+        )
+
+        # The catalog version changes whenever the table is synced, so the plan may be outdated
+        if not args.force:
+            catalog_version = get_catalog_version(client)
+
+            if catalog_version != header["catalogVersion"]:
+                print(
+                    f"The table changed since the plan was made (catalog version {header['catalogVersion']} -> {catalog_version}). Make a new plan, or pass --force to apply it anyway."
+                )
+                sys.exit(1)
+
+        if args.verify:
+            # Scan the table again for a stricter check
+            remote_services = get_all_services(client, HASH_PROJECTION, args.segments)
+
+            if remote_services is None:
+                sys.exit(1)
+            if get_snapshot_hash(remote_services) != header["snapshotHash"]:
+                print("The services in the table changed since the plan was made")
+                sys.exit(1)
+
+        counts = {"Put": 0, "Update": 0, "Delete": 0}
+        failed_items = perform_writes(
+            client,
+            iter_counted(read_changes(plan_file), counts),
+            args.bulk,
+            args.workers,
+        )
+
+    finish_sync(client, sum(counts.values()), failed_items)
+
+
+def finish_sync(client, num_changes: int, failed_items: list[Any]):
+    """Update the catalog version after writing changes, and fail if any weren't written"""
+    is_version_updated = True
+
+    # Invalidate the store's cache if anything was written, even if other chunks failed
+    if num_changes > len(failed_items):
+        is_version_updated = update_catalog_version(client)
+    if failed_items or not is_version_updated:
+        sys.exit(1)
+
+
+def create_migration_requests(service: RemoteService) -> list[Transaction]:
+    """Create requests to move a service from a random ID to the ID derived from its name"""
+    new_id = get_service_id(service["Name"]["S"])
+    return [
+        {
+            "Put": {
+                # The content hash doesn't include the ID, so it stays valid
+                "Item": {**service, "Id": {"S": new_id}},
+                "TableName": TABLE_NAME,
+                "ReturnValuesOnConditionCheckFailure": "ALL_OLD",
+            }
+        },
+        create_delete_request(service),
+    ]
+
+
+def migrate_service_ids(client, args: argparse.Namespace):
+    """Re-key the services written with random IDs, so the store can look them up by name"""
+    remote_services = get_all_services(client, HASH_PROJECTION, args.segments)
+
+    # Exit early if the scan fails
+    if remote_services is None:
+        return
+
+    legacy_services = [
+        service
+        for service in remote_services
+        if service["Id"]["S"] != get_service_id(service["Name"]["S"])
+    ]
+    print(f"Migrating {len(legacy_services)} services to IDs derived from their names")
+
+    if not legacy_services:
+        return
+    if not ask_to_continue():
+        print("Ok, won't update the database")
+        return
+
+    # The ID is part of the key, so each service is copied in full and its old item deleted
+    full_index = get_full_services(client, legacy_services)
+    # Chunks hold an even number of items, so each put and delete pair is written in the same
+    # transaction, and a service is never missing or duplicated
+    transactions = [
+        transaction
+        for service in full_index.values()
+        for transaction in create_migration_requests(service)
+    ]
+    failed_items = perform_writes(client, transactions, max_workers=args.workers)
+    finish_sync(client, len(transactions), failed_items)
+
+
+def get_shard(name: str, total_shards: int) -> int:
+    """Assign a service to a shard by its name. Unlike hash(), this is stable across processes."""
+    digest = blake2b(name.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % total_shards
+
+
+def partition_local_services(
+    file_name: str, shard_dir: str, total_shards: int
+) -> list[str]:
+    """
+    Split the JSON file into a JSON Lines file per shard, streaming it so that it doesn't need to
+    fit in memory.
+
+    Returns the name of each shard's file.
+    """
+    shard_file_names = [
+        os.path.join(shard_dir, f"shard-{shard_i}.jsonl")
+        for shard_i in range(total_shards)
+    ]
+
+    with ExitStack() as stack:
+        shard_files = [
+            stack.enter_context(open(shard_file_name, "w"))
+            for shard_file_name in shard_file_names
+        ]
+
+        for service in iter_json_file(file_name):
+            shard_file = shard_files[get_shard(service["Name"], total_shards)]
+            shard_file.write(json.dumps(service) + "\n")
+
+    return shard_file_names
+
+
+def partition_remote_services(
+    remote_services: list[RemoteService], total_shards: int
+) -> list[list[RemoteService]]:
+    """Split the services in DynamoDB into shards, using the same shards as the JSON file"""
+    remote_shards: list[list[RemoteService]] = [[] for _ in range(total_shards)]
+
+    for service in remote_services:
+        remote_shards[get_shard(service["Name"]["S"], total_shards)].append(service)
+
+    return remote_shards
+
+
+def run_shard(
+    shard_i: int,
+    shard_file_name: str,
+    changes_file_name: str,
+    remote_services: list[RemoteService],
+    should_write: bool,
+    bulk: bool,
+    max_workers: int,
+) -> ShardReport:
+    """
+    Compare one shard of the JSON file with the same shard of DynamoDB and save the changes to
+    changes_file_name, or write the saved changes if should_write is True. Runs in its own
+    process, so it creates its own client.
+    """
+    client = boto3.client("dynamodb")
+    counts = {"Put": 0, "Update": 0, "Delete": 0}
+    failed_items = []
+    start = time.perf_counter()
+
+    if should_write:
+        # Write the changes saved while planning, without comparing the shard again
+        with gzip.open(changes_file_name, "rt") as changes_file:
+            failed_items = perform_writes(
+                client,
+                iter_counted(read_changes(changes_file), counts),
+                bulk,
+                max_workers,
+            )
+    else:
+        remote_index = index_remote_services(remote_services)
+
+        with gzip.open(changes_file_name, "wt") as changes_file:
+            counts = save_changes(
+                changes_file,
+                iter_changes(iter_json_file(shard_file_name), remote_index, client),
+            )
+
+    return ShardReport(shard_i, counts, failed_items, time.perf_counter() - start)
+
+
+def sync_shards(
+    dynamodb_client, args: argparse.Namespace, executor_class=ProcessPoolExecutor
+):
+    """
+    Sync the table with the JSON file in parallel processes, each of which compares and writes
+    the services in one shard.
+    """
+    # DynamoDB can't partition a scan by name, so scan once and split the results
+    remote_services = get_all_services(dynamodb_client, HASH_PROJECTION, args.segments)
+
+    # Exit early if the scan fails
+    if remote_services is None:
+        return
+
+    remote_shards = partition_remote_services(remote_services, args.shards)
+    del remote_services
+
+    with TemporaryDirectory() as shard_dir:
+        shard_file_names = partition_local_services(args.file, shard_dir, args.shards)
+        changes_file_names = [
+            os.path.join(shard_dir, f"changes-{shard_i}.jsonl.gz")
+            for shard_i in range(args.shards)
+        ]
+
+        with executor_class(max_workers=args.shards) as executor:
+
+            def run_shards(should_write: bool) -> list[ShardReport]:
+                return list(
+                    executor.map(
+                        run_shard,
+                        range(args.shards),
+                        shard_file_names,
+                        changes_file_names,
+                        # Writing only needs the saved changes
+                        [[] for _ in remote_shards] if should_write else remote_shards,
+                        repeat(should_write),
+                        repeat(args.bulk),
+                        repeat(args.workers),
+                    )
+                )
+
+            # Plan the changes once to show them, then write the changes each shard saved
+            plan_reports = run_shards(False)
+            counts = {
+                change: sum(report.counts[change] for report in plan_reports)
+                for change in ("Put", "Update", "Delete")
+            }
+
+            for report in plan_reports:
+                print(
+                    f"Shard #{report.shard_i + 1}: {report.counts['Put']} to add, {report.counts['Update']} to update, {report.counts['Delete']} to delete"
+                )
+
             print(
-                f"Success! Transaction chunk #{chunk_i + 1} consumed {write_capacity_units} write capacity units (WCU) across the table and all GSIs (Global Secondary Indexes)"
+                f"Adding {counts['Put']} services, updating {counts['Update']} services, and deleting {counts['Delete']} services"
             )
-        except ClientError as error:
-            print(f"transact-write-items client error: {error}")
+
+            if not any(counts.values()):
+                return
+            if not ask_to_continue():
+                print("Ok, won't update the database")
+                return
+
+            write_reports = run_shards(True)
+
+    num_changes = 0
+    failed_items = []
+
+    for report in write_reports:
+        num_shard_changes = sum(report.counts.values())
+        num_changes += num_shard_changes
+        failed_items.extend(report.failed_items)
+        print(
+            f"Shard #{report.shard_i + 1}: wrote {num_shard_changes - len(report.failed_items)}/{num_shard_changes} items in {report.elapsed:.2f}s"
+        )
+
+    print(f"Wrote {num_changes - len(failed_items)}/{num_changes} items in total")
+
+    if failed_items:
+        failed_services = sorted(get_transaction_name(item) for item in failed_items)
+        print(f"Failed to write the following services: {failed_services}")
+
+    finish_sync(dynamodb_client, num_changes, failed_items)
 
 
 def strtobool(val):
@@ -337,29 +1469,92 @@ def strtobool(val):
         raise ValueError("invalid truth value %r" % (val,))
 
 
-def main():
-    # Get all the AWS services present in the JSON file and DynamoDB
-    local_services = get_json_file()
-    dynamodb_client = boto3.client("dynamodb")
-    remote_services = get_all_services(dynamodb_client)
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Sync the DynamoDB table with a JSON file of AWS services"
+    )
+    parser.add_argument(
+        "--file",
+        default=JSON_FILE_NAME,
+        help=f"JSON array or JSON Lines (.jsonl) file of services (default: {JSON_FILE_NAME})",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="parse the file and write the changes incrementally, for catalogs too large to "
+        "fit in memory",
+    )
+    parser.add_argument(
+        "--segments",
+        type=int,
+        default=1,
+        help="number of segments to scan the table with in parallel (default: 1)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=MAX_WORKERS,
+        help=f"number of chunks to write in parallel (default: {MAX_WORKERS})",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="number of processes to compare and write the services with, each handling the "
+        "services whose names hash to it (default: 1)",
+    )
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="write new and deleted services with batch-write-item instead of transactions, "
+        "which is cheaper for large loads (updates still use transactions)",
+    )
+    plan_group = parser.add_mutually_exclusive_group()
+    plan_group.add_argument(
+        "--plan",
+        metavar="PLAN_FILE",
+        help="save the changes to a file instead of asking to apply them",
+    )
+    plan_group.add_argument(
+        "--apply",
+        metavar="PLAN_FILE",
+        help="apply the changes saved by --plan, without comparing the table again",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="with --apply, apply the plan even if the table was synced since it was made",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="with --apply, scan the table to check that no services changed since the plan "
+        "was made",
+    )
+    parser.add_argument(
+        "--migrate-ids",
+        action="store_true",
+        help="move the services written with random IDs to IDs derived from their names, "
+        "so the store can look them up by name",
+    )
+    args = parser.parse_args()
 
-    # Exit early if the scan fails
-    if remote_services is None:
-        return
+    if args.segments < 1:
+        parser.error("--segments must be at least 1")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.shards < 1:
+        parser.error("--shards must be at least 1")
+    if args.shards > 1 and (args.plan or args.apply):
+        parser.error("--shards can't be used with --plan or --apply")
+    if args.migrate_ids and (args.plan or args.apply or args.shards > 1):
+        parser.error("--migrate-ids can't be used with --plan, --apply, or --shards")
 
-    # Create two sets of service names and compare which are only present locally/remotely
-    local_services_set = {service["Name"] for service in local_services}
-    remote_services_set = {service["Name"]["S"] for service in remote_services}
-    services_to_create = local_services_set - remote_services_set
-    services_to_delete = remote_services_set - local_services_set
-    common_services = local_services_set & remote_services_set
+    return args
 
-    # Gather all the create, update, and delete operations
-    put_items = add_services(local_services, services_to_create)
-    update_items = update_services(local_services, remote_services, common_services)
-    delete_items = remove_services(remote_services, services_to_delete)
 
-    # Ask the user if they want to perform the above changes
+def ask_to_continue() -> bool:
+    """Ask the user if they want to perform the planned changes"""
     print("Are these changes ok? [y/n] ", end="")
     should_continue = None
     while should_continue is None:
@@ -368,9 +1563,120 @@ def main():
         except (ValueError, EOFError):
             print("Please respond with 'y' or 'n': ", end="")
 
-    if should_continue:
-        # Perform a single transact-write-items request for CUD operations
-        perform_transaction(dynamodb_client, put_items, update_items, delete_items)
+    return bool(should_continue)
+
+
+def sync_stream(dynamodb_client, args: argparse.Namespace):
+    """Sync the table with the JSON file without loading the file or the changes into memory"""
+    catalog_version = get_catalog_version(dynamodb_client)
+    # Only read the attributes needed to find changed services
+    remote_services = get_all_services(dynamodb_client, HASH_PROJECTION, args.segments)
+
+    # Exit early if the scan fails
+    if remote_services is None:
+        return
+
+    remote_index = index_remote_services(remote_services)
+    del remote_services
+
+    if args.plan:
+        write_plan(
+            args.plan,
+            iter_changes(iter_json_file(args.file), remote_index, dynamodb_client),
+            catalog_version,
+            get_snapshot_hash(remote_index.values()),
+        )
+        return
+
+    with TemporaryDirectory() as changes_dir:
+        # Save the changes while counting them, so the services are only compared (and the
+        # changed ones read in full) once
+        changes_file_name = os.path.join(changes_dir, "changes.jsonl.gz")
+
+        with gzip.open(changes_file_name, "wt") as changes_file:
+            counts = save_changes(
+                changes_file,
+                iter_changes(iter_json_file(args.file), remote_index, dynamodb_client),
+            )
+
+        print(
+            f"Adding {counts['Put']} services, updating {counts['Update']} services, and deleting {counts['Delete']} services"
+        )
+
+        if not any(counts.values()):
+            return
+        if not ask_to_continue():
+            print("Ok, won't update the database")
+            return
+
+        with gzip.open(changes_file_name, "rt") as changes_file:
+            failed_items = perform_writes(
+                dynamodb_client, read_changes(changes_file), args.bulk, args.workers
+            )
+
+    finish_sync(dynamodb_client, sum(counts.values()), failed_items)
+
+
+def main():
+    args = parse_args()
+    dynamodb_client = boto3.client("dynamodb")
+
+    if args.migrate_ids:
+        migrate_service_ids(dynamodb_client, args)
+        return
+    if args.apply:
+        apply_plan(dynamodb_client, args)
+        return
+    if args.shards > 1:
+        sync_shards(dynamodb_client, args)
+        return
+    if args.stream:
+        sync_stream(dynamodb_client, args)
+        return
+
+    # Get all the AWS services present in the JSON file and DynamoDB
+    local_services = get_json_file(args.file)
+    catalog_version = get_catalog_version(dynamodb_client)
+    # Only read the attributes needed to find changed services
+    remote_services = get_all_services(dynamodb_client, HASH_PROJECTION, args.segments)
+
+    # Exit early if the scan fails
+    if remote_services is None:
+        return
+
+    put_items, update_items, delete_items = plan_changes(
+        local_services, remote_services, dynamodb_client
+    )
+
+    if args.plan:
+        write_plan(
+            args.plan,
+            put_items + update_items + delete_items,
+            catalog_version,
+            get_snapshot_hash(remote_services),
+        )
+    elif ask_to_continue():
+        if args.bulk:
+            # Puts and deletes don't need to be atomic, so write them at half the cost
+            failed_items = perform_batch_write(
+                dynamodb_client, put_items, delete_items, args.workers
+            )
+
+            if update_items:
+                failed_items += perform_transaction(
+                    dynamodb_client, [], update_items, [], args.workers
+                )
+        else:
+            # Perform transact-write-items requests for CUD operations
+            failed_items = perform_transaction(
+                dynamodb_client, put_items, update_items, delete_items, args.workers
+            )
+
+        finish_sync(
+            dynamodb_client,
+            len(put_items) + len(update_items) + len(delete_items),
+            failed_items,
+        )
     else:
         print("Ok, won't update the database")
 
@@ -1,16 +1,107 @@
 import boto3
+from collections import OrderedDict
 from datetime import datetime
+from hashlib import blake2b
 import json
 import logging
 import os
+from threading import Lock
+import time
+from uuid import uuid4
 
 pinpoint = boto3.client("pinpoint")
+sqs = boto3.client("sqs")
+# Queue events to be published by queue_handler instead of waiting for Pinpoint
+ASYNC_EVENTS = os.environ.get("AsyncEvents", "false").lower() == "true"
+EVENT_QUEUE_URL = os.environ.get("EventQueueUrl", "")
+# Max number of messages in each SendMessageBatch request
+SEND_MESSAGE_BATCH_LIMIT = 10
+# Max number of events in each PutEvents request
+# https://docs.aws.amazon.com/pinpoint/latest/developerguide/quotas.html#quotas-events
+PUT_EVENTS_LIMIT = 100
+# Ignore events whose ID was already published within this many seconds (in this container)
+DEDUP_WINDOW = float(os.environ.get("DedupWindow", "300"))
+# Max number of event IDs to remember
+DEDUP_SIZE = int(os.environ.get("DedupSize", "10000"))
+
+# Pinpoint's limits for each event:
+# https://docs.aws.amazon.com/pinpoint/latest/developerguide/quotas.html#quotas-events
+MAX_EVENT_TYPE_LENGTH = 50
+MAX_ATTRIBUTES = 40
+MAX_METRICS = 40
+MAX_PROPERTY_NAME_LENGTH = 50
+MAX_ATTRIBUTE_VALUE_LENGTH = 100
+# Max length of the idempotency keys sent by clients
+MAX_EVENT_ID_LENGTH = 128
+# Reject larger request bodies (in bytes) before parsing them
+MAX_BODY_SIZE = 4 * 1024 * 1024
+EVENT_SCHEMA = {
+    "name": {
+        "type": str,
+        "description": "a string",
+        "max_length": MAX_EVENT_TYPE_LENGTH,
+    },
+    "properties": {"type": dict, "description": "an object"},
+    "id": {
+        "type": str,
+        "description": "a non-empty string",
+        "optional": True,
+        "min_length": 1,
+        "max_length": MAX_EVENT_ID_LENGTH,
+    },
+}
+# Strings and booleans become attributes, numbers become metrics
+ATTRIBUTE = "attribute"
+METRIC = "metric"
+PROPERTY_KINDS = {str: ATTRIBUTE, bool: ATTRIBUTE, int: METRIC, float: METRIC}
+
+# Event ID -> (time published, result), oldest first
+published_events = OrderedDict()
+published_events_lock = Lock()
 
 # Enable detailed logging
 LOG = logging.getLogger()
 LOG.setLevel(logging.INFO)
 
 
+class SQSEventQueue:
+    """Buffers events in an SQS queue, which triggers queue_handler"""
+
+    def __init__(self, queue_url, client=sqs):
+        self.queue_url = queue_url
+        self.client = client
+
+    def send(self, messages):
+        """Send each message and return None for each success, or an error message"""
+        errors = [None] * len(messages)
+
+        for chunk_start in range(0, len(messages), SEND_MESSAGE_BATCH_LIMIT):
+            chunk = messages[chunk_start : chunk_start + SEND_MESSAGE_BATCH_LIMIT]
+            # IDs only need to be unique within the request
+            entries = [
+                {"Id": str(chunk_start + i), "MessageBody": message}
+                for i, message in enumerate(chunk)
+            ]
+
+            try:
+                response = self.client.send_message_batch(
+                    QueueUrl=self.queue_url, Entries=entries
+                )
+
+                for failure in response.get("Failed", []):
+                    errors[int(failure["Id"])] = failure.get("Message", failure["Code"])
+            except Exception as e:
+                LOG.error(f"Failed to queue {len(chunk)} events: {e}")
+
+                for i in range(chunk_start, chunk_start + len(chunk)):
+                    errors[i] = str(e)
+
+        return errors
+
+
+event_queue = SQSEventQueue(EVENT_QUEUE_URL)
+
+
 def print_context(context):
     # All properties listed in: https://docs.aws.amazon.com/lambda/latest/dg/python-context.html
     LOG.info(f"{context.get_remaining_time_in_millis()=}")
@@ -40,15 +131,40 @@ def handler(event, context):
     try:
         route_key = event["routeKey"]
         request_body_str = event["body"]
+
+        if request_body_str is not None and is_oversize(request_body_str):
+            raise Exception(f"Request body must be at most {MAX_BODY_SIZE} bytes")
+
         request_body = json.loads(request_body_str)
 
         if route_key == "POST /event":
-            is_valid_event, error_message = validate_event_object(request_body)
+            processed_event = process_event(request_body)
+            error_message = processed_event[0]
 
-            if is_valid_event:
-                status_code, body = publish_event(request_body)
-            else:
+            if error_message is not None:
                 raise Exception(f"Invalid request body: {error_message}")
+            # Reuse the validated properties instead of processing the event again
+            elif ASYNC_EVENTS:
+                result = enqueue_events(
+                    [request_body], event_queue, processed_events=[processed_event]
+                )[0]
+                status_code, body = result["StatusCode"], result["Message"]
+            else:
+                status_code, body = publish_event(
+                    request_body, processed_event=processed_event
+                )
+        elif route_key == "POST /events":
+            if not isinstance(request_body, list):
+                raise Exception("Invalid request body: must be an array of events")
+
+            if ASYNC_EVENTS:
+                body = enqueue_events(request_body, event_queue)
+            else:
+                body = publish_events(request_body)
+            # 207 = some events weren't accepted, check each status code
+            status_code = (
+                202 if all(result["StatusCode"] == 202 for result in body) else 207
+            )
         else:
             raise Exception(f'Unsupported route: "{route_key}"')
     except Exception as e:
@@ -65,89 +181,415 @@ def handler(event, context):
     return response
 
 
-def publish_event(event, pinpoint=pinpoint):
-    app_id = os.environ.get("PinpointAppId", "")
+def publish_event(event, pinpoint=pinpoint, processed_event=None):
+    processed_events = [processed_event] if processed_event is not None else None
+    result = publish_events([event], pinpoint, processed_events=processed_events)[0]
+    # Status code will either be 202 (success) or 400 (failure)
+    return result["StatusCode"], result["Message"]
+
+
+def queue_handler(event, context):
+    """
+    Publish the events queued by handler, merging the whole batch of SQS messages into as few
+    PutEvents requests as possible.
+
+    Returns the messages that failed to publish, so that only those are retried:
+    https://docs.aws.amazon.com/lambda/latest/dg/services-sqs-errorhandling.html#services-sqs-batchfailurereporting
+    """
+    LOG.info(f"Received {len(event['Records'])} messages")
+    message_ids = []
+    events = []
+    timestamps = []
+    processed_events = []
+
+    for record in event["Records"]:
+        try:
+            message = json.loads(record["body"])
+            processed_event = process_event(message["event"])
+            error_message = processed_event[0]
+            timestamp = message["timestamp"]
+        except (ValueError, KeyError, TypeError) as e:
+            error_message = repr(e)
+
+        if error_message is not None:
+            # Retrying won't fix an invalid message, so drop it
+            LOG.error(f"Dropping message {record['messageId']}: {error_message}")
+            continue
+
+        message_ids.append(record["messageId"])
+        events.append(message["event"])
+        timestamps.append(timestamp)
+        processed_events.append(processed_event)
+
+    results = publish_events(
+        events, timestamps=timestamps, processed_events=processed_events
+    )
+    batch_item_failures = [
+        {"itemIdentifier": message_id}
+        for message_id, result in zip(message_ids, results)
+        if result["StatusCode"] != 202
+    ]
+    LOG.info(f"{batch_item_failures=}")
+    return {"batchItemFailures": batch_item_failures}
+
+
+def enqueue_events(events, queue, processed_events=None):
+    """
+    Queue valid events to be published later by queue_handler.
+
+    processed_events can hold the result of process_event for each event, if the caller
+    already validated them. Returns the status code and message of each event, in the same
+    order as the events.
+    """
     timestamp = datetime.now().isoformat()
+    results = [None] * len(events)
+    valid_indexes = []
+    messages = []
+
+    for i, event in enumerate(events):
+        error_message, attributes, metrics = (
+            processed_events[i]
+            if processed_events is not None
+            else process_event(event)
+        )
+
+        if error_message is not None:
+            results[i] = {
+                "StatusCode": 400,
+                "Message": f"Invalid event: {error_message}",
+            }
+            continue
+
+        # Only queue the properties that will be published, so messages stay within SQS's
+        # size limit. Assign the ID now, so that redelivered messages aren't published twice.
+        event = {
+            "name": event["name"],
+            "properties": {**attributes, **metrics},
+            "id": event.get("id", str(uuid4())),
+        }
+        valid_indexes.append(i)
+        # Keep the time the event was received, not when it's published
+        messages.append(json.dumps({"event": event, "timestamp": timestamp}))
+
+    errors = queue.send(messages)
+
+    for i, error in zip(valid_indexes, errors):
+        if error is None:
+            results[i] = {"StatusCode": 202, "Message": "Queued"}
+        else:
+            results[i] = {"StatusCode": 400, "Message": error}
+
+    return results
+
+
+def publish_events(events, pinpoint=pinpoint, timestamps=None, processed_events=None):
+    """
+    Publish a list of events in as few PutEvents requests as possible.
+
+    Events with the same ID (within the batch or the dedup window) are only published once.
+    processed_events can hold the result of process_event for each event, if the caller
+    already validated them. Returns the status code and message of each event, in the same
+    order as the events.
+    """
+    app_id = os.environ.get("PinpointAppId", "")
+
+    if timestamps is None:
+        timestamps = [datetime.now().isoformat()] * len(events)
+
     # anonymous = generic endpoint ID that encompases all users
     endpoint_id = "anonymous"
-    event_id = f"event-{timestamp}"
-    attributes, metrics = categorize_event_properties(event["properties"])
-
-    events_request = {
-        "BatchItem": {
-            f"{endpoint_id}": {
-                "Endpoint": {},
-                "Events": {
-                    f"{event_id}": {
-                        "Attributes": attributes,
-                        "EventType": event["name"],
-                        "Metrics": metrics,
-                        "Timestamp": timestamp,
-                    }
-                },
+    results = [None] * len(events)
+    event_ids = [None] * len(events)
+    # Event ID -> Pinpoint event, keeping the first event with each ID
+    events_to_publish = {}
+    # Event ID -> result
+    id_results = {}
+
+    for i, event in enumerate(events):
+        # Validate and categorize each event only once
+        error_message, attributes, metrics = (
+            processed_events[i]
+            if processed_events is not None
+            else process_event(event)
+        )
+
+        if error_message is not None:
+            results[i] = {
+                "StatusCode": 400,
+                "Message": f"Invalid event: {error_message}",
+            }
+            continue
+
+        event_id = get_event_id(event, app_id, endpoint_id)
+        event_ids[i] = event_id
+        published_result = get_published_result(event_id)
+
+        if published_result is not None:
+            LOG.info(f"Skipping duplicate event {event_id}")
+            id_results[event_id] = published_result
+        elif event_id not in events_to_publish:
+            events_to_publish[event_id] = {
+                "Attributes": attributes,
+                "EventType": event["name"],
+                "Metrics": metrics,
+                "Timestamp": timestamps[i],
+            }
+
+    # Split the events into chunks to satisfy the PutEvents quota
+    events_to_publish = list(events_to_publish.items())
+
+    for chunk_start in range(0, len(events_to_publish), PUT_EVENTS_LIMIT):
+        chunk = events_to_publish[chunk_start : chunk_start + PUT_EVENTS_LIMIT]
+        pinpoint_events = dict(chunk)
+        events_request = {
+            "BatchItem": {
+                f"{endpoint_id}": {
+                    "Endpoint": {},
+                    "Events": pinpoint_events,
+                }
             }
         }
-    }
 
-    response = pinpoint.put_events(
-        ApplicationId=app_id,
-        EventsRequest=events_request,
-    )
-    LOG.info(f"Pinpoint response: {response}")
+        try:
+            response = pinpoint.put_events(
+                ApplicationId=app_id,
+                EventsRequest=events_request,
+            )
+            LOG.info(f"Pinpoint response: {response}")
 
-    """
-    Sample response:
-    {
-        "ResponseMetadata": { ... },
-        "EventsResponse": {
-            "Results": {
-                "anonymous": {
-                    "EndpointItemResponse": {"Message": "Accepted", "StatusCode": 202},
-                    "EventsItemResponse": {
-                        "event-2024-08-11T20:26:22.250176": {
-                            "Message": "Accepted",
-                            "StatusCode": 202,
+            """
+            Sample response:
+            {
+                "ResponseMetadata": { ... },
+                "EventsResponse": {
+                    "Results": {
+                        "anonymous": {
+                            "EndpointItemResponse": {"Message": "Accepted", "StatusCode": 202},
+                            "EventsItemResponse": {
+                                "event-2f2b5cbb-2d6f-4b1a-9a51-3d7c2e0f6a4e": {
+                                    "Message": "Accepted",
+                                    "StatusCode": 202,
+                                }
+                            },
                         }
-                    },
-                }
+                    }
+                },
             }
-        },
-    }
+            """
+            events_response = response["EventsResponse"]["Results"][endpoint_id][
+                "EventsItemResponse"
+            ]
+
+            for event_id, _ in chunk:
+                id_results[event_id] = {
+                    "StatusCode": events_response[event_id]["StatusCode"],
+                    "Message": events_response[event_id]["Message"],
+                }
+                record_published_result(event_id, id_results[event_id])
+        except Exception as e:
+            # Don't fail the other chunks
+            LOG.error(f"Failed to publish {len(chunk)} events: {e}")
+
+            for event_id, _ in chunk:
+                id_results[event_id] = {"StatusCode": 400, "Message": str(e)}
+
+    for i, event_id in enumerate(event_ids):
+        if event_id is not None:
+            results[i] = id_results[event_id]
+
+    return results
+
+
+def get_event_id(event, app_id="", endpoint_id="anonymous"):
+    # Use the client's idempotency key so that retries map to the same event. Hash it with the
+    # app and endpoint, so keys can't collide across them and every ID has the same length.
+    if "id" in event:
+        key = f"{app_id}\n{endpoint_id}\n{event['id']}".encode()
+        return f"event-{blake2b(key, digest_size=16).hexdigest()}"
+
+    # Timestamps can collide, so generate a random ID instead
+    return f"event-{uuid4()}"
+
+
+def get_published_result(event_id):
+    # Returns None if the event wasn't published within the dedup window
+    now = time.monotonic()
+
+    with published_events_lock:
+        # Entries are in the order they were published, so expire them from the front
+        while published_events:
+            oldest_id, (published_at, _) = next(iter(published_events.items()))
+
+            if now - published_at < DEDUP_WINDOW:
+                break
+
+            del published_events[oldest_id]
+
+        published_result = published_events.get(event_id)
+        return published_result[1] if published_result is not None else None
+
+
+def record_published_result(event_id, result):
+    # Only remember accepted events so that failed events can be retried
+    if result["StatusCode"] != 202:
+        return
+
+    with published_events_lock:
+        published_events[event_id] = (time.monotonic(), result)
+
+        while len(published_events) > DEDUP_SIZE:
+            published_events.popitem(last=False)
+
+
+def compile_schema(schema):
     """
-    events_response = response["EventsResponse"]["Results"][endpoint_id][
-        "EventsItemResponse"
-    ][event_id]
-    # Status code will either be 202 (success) or 400 (failure)
-    return events_response["StatusCode"], events_response["Message"]
+    Turn a schema of the form {key: {"type", "description", "optional", "min_length",
+    "max_length"}} into a function that returns the first error in an event, or None if it's
+    valid. The checks and error messages are computed once, instead of on every event.
+    """
+    checks = []
+
+    for key, rules in schema.items():
+        type_message = f'"{key}" must be {rules["description"]}'
+        max_length = rules.get("max_length")
+        checks.append(
+            (
+                key,
+                rules["type"],
+                rules.get("optional", False),
+                rules.get("min_length"),
+                max_length,
+                f'Missing "{key}" key',
+                type_message,
+                f'"{key}" must be at most {max_length} characters',
+            )
+        )
+
+    def validate(event):
+        if not isinstance(event, dict):
+            return "Event must be an object"
+
+        for (
+            key,
+            value_type,
+            is_optional,
+            min_length,
+            max_length,
+            missing_message,
+            type_message,
+            length_message,
+        ) in checks:
+            if key not in event:
+                if is_optional:
+                    continue
+                return missing_message
+
+            value = event[key]
+
+            if not isinstance(value, value_type):
+                return type_message
+            if min_length is not None and len(value) < min_length:
+                return type_message
+            if max_length is not None and len(value) > max_length:
+                return length_message
+
+        return None
+
+    return validate
+
+
+validate_event_fields = compile_schema(EVENT_SCHEMA)
 
 
 def validate_event_object(event):
     # Check that the request body is formatted correctly
-    if "name" not in event:
-        return False, 'Missing "name" key'
-    elif not isinstance(event["name"], str):
-        return False, '"name" must be a string'
-    elif "properties" not in event:
-        return False, 'Missing "properties" key'
-    elif not isinstance(event["properties"], dict):
-        return False, '"properties" must be an object'
+    error_message, _, _ = process_event(event)
+    return error_message is None, error_message
+
 
-    return True, None
+def process_event(event):
+    """
+    Validate an event and split its properties into attributes and metrics in one pass.
+
+    Returns an error message (None if the event is valid), the attributes, and the metrics.
+    """
+    error_message = validate_event_fields(event)
+
+    if error_message is not None:
+        return error_message, None, None
+
+    return split_properties(event["properties"])
 
 
 def categorize_event_properties(properties):
     # If the event value is a string or boolean, add it to attributes
     # If the event value is a number, add it to metrics
     # Matches Amplify's iOS/Android logic: https://stackoverflow.com/a/68231896
+    _, attributes, metrics = split_properties(properties, check_limits=False)
+    return attributes, metrics
+
+
+def get_property_kind(value):
+    # Slow path for subclasses of the JSON types. Check bool first since it's also an int.
+    if isinstance(value, (str, bool)):
+        return ATTRIBUTE
+    elif isinstance(value, (int, float)):
+        return METRIC
+    return None
+
+
+def split_properties(properties, check_limits=True):
     attributes = {}
     metrics = {}
 
     for key, value in properties.items():
-        # Check bool first since it's also an instance of int
-        if isinstance(value, (str, bool)):
-            attributes[key] = str(value)
-        elif isinstance(value, (int, float)):
-            metrics[key] = value
+        kind = PROPERTY_KINDS.get(type(value)) or get_property_kind(value)
+
         # Ignore all other types
+        if kind is None:
+            continue
 
-    return attributes, metrics
+        if check_limits and len(key) > MAX_PROPERTY_NAME_LENGTH:
+            return (
+                f'Property "{key[:MAX_PROPERTY_NAME_LENGTH]}..." must have a name of at most {MAX_PROPERTY_NAME_LENGTH} characters',
+                None,
+                None,
+            )
+
+        if kind is ATTRIBUTE:
+            value = str(value)
+
+            if check_limits:
+                if len(value) > MAX_ATTRIBUTE_VALUE_LENGTH:
+                    return (
+                        f'Property "{key}" must be at most {MAX_ATTRIBUTE_VALUE_LENGTH} characters',
+                        None,
+                        None,
+                    )
+                # Stop as soon as there are too many properties
+                if len(attributes) == MAX_ATTRIBUTES and key not in attributes:
+                    return (
+                        f"Events can have at most {MAX_ATTRIBUTES} string or boolean properties",
+                        None,
+                        None,
+                    )
+
+            attributes[key] = value
+        else:
+            if check_limits and len(metrics) == MAX_METRICS and key not in metrics:
+                return (
+                    f"Events can have at most {MAX_METRICS} numeric properties",
+                    None,
+                    None,
+                )
+
+            metrics[key] = value
+
+    return None, attributes, metrics
+
+
+def is_oversize(body):
+    # Check the number of characters first, so that small bodies don't need to be encoded
+    return len(body) > MAX_BODY_SIZE or (
+        len(body) * 4 > MAX_BODY_SIZE and len(body.encode()) > MAX_BODY_SIZE
+    )
@@ -1,15 +1,212 @@
+import base64
 import boto3
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+import gzip
+import hashlib
+import heapq
 import json
 import logging
 import os
+import random
+from threading import Lock
+import time
+from urllib.parse import unquote
+from uuid import UUID, uuid5
+
+try:
+    import brotli
+except ImportError:
+    # brotli is bundled by sam build (src/requirements.txt), but fall back to gzip without it
+    brotli = None
 
 dynamodb = boto3.client("dynamodb")
+# Split full table scans into parallel segments (1 = sequential scan)
+SCAN_SEGMENTS = int(os.environ.get("ScanSegments", "1"))
+# How long (in seconds) cached results are trusted before checking the catalog version again
+CACHE_TTL = float(os.environ.get("CacheTTL", "60"))
+# Max age (in seconds) of cached results, in case a sync didn't update the catalog version
+CACHE_MAX_AGE = float(os.environ.get("CacheMaxAge", str(CACHE_TTL * 10)))
+# Max number of distinct queries to keep in the cache
+CACHE_SIZE = int(os.environ.get("CacheSize", "128"))
+# Answer filtered queries from an in-memory snapshot of the catalog instead of DynamoDB
+LOCAL_QUERIES = os.environ.get("LocalQueries", "false").lower() == "true"
+# Item stamped by populate-dynamodb-table.py whenever the catalog changes
+CATALOG_VERSION_ID = "CatalogVersion"
+CATALOG_VERSION_KEY = {
+    "Id": {"S": CATALOG_VERSION_ID},
+    "Name": {"S": CATALOG_VERSION_ID},
+}
+# Namespace of the IDs derived from service names (must match populate-dynamodb-table.py)
+SERVICE_ID_NAMESPACE = UUID("aeb00cd9-0918-4805-931a-b982fba0689b")
+# Don't return the lowercase columns to the frontend. They're only for querying.
+# Name and Unit are reserved words
+PROJECTION = "Id, #name, Description, Price, #unit, Category, FreeTier"
+PROJECTION_NAMES = {"#name": "Name", "#unit": "Unit"}
+# Max number of services returned per page
+MAX_PAGE_SIZE = 1000
+# dynamodb = items as returned by DynamoDB, plain = attribute values converted to JSON
+RESPONSE_FORMATS = ["dynamodb", "plain"]
+# How long CloudFront keeps responses (defaults to the cache policy's DefaultTTL)
+SHARED_CACHE_MAX_AGE = int(os.environ.get("SharedCacheMaxAge", "86400"))
+# Let browsers reuse responses for as long as the Lambda caches them, without overriding
+# CloudFront's TTL
+CACHE_CONTROL = f"public, max-age={int(CACHE_TTL)}, s-maxage={SHARED_CACHE_MAX_AGE}"
+# Content encodings in order of preference (brotli compresses JSON better than gzip)
+CONTENT_ENCODINGS = ["br", "gzip"] if brotli is not None else ["gzip"]
+# Responses smaller than this (in bytes) aren't worth compressing
+MIN_COMPRESSION_SIZE = 1024
+# Max number of services that can be fetched by name in one request
+MAX_BATCH_NAMES = 500
+# Max number of keys per BatchGetItem request
+BATCH_GET_LIMIT = 100
+# Keys that DynamoDB didn't read (usually due to throttling) are retried with backoff
+MAX_BATCH_GET_ATTEMPTS = 5
+BASE_BACKOFF_DELAY = 0.05
+MAX_BACKOFF_DELAY = 1.0
+# Max number of filter sets in a POST /query request, and how many run at the same time
+MAX_QUERIES = 20
+MAX_QUERY_WORKERS = 8
 
 # Enable detailed logging
 LOG = logging.getLogger()
 LOG.setLevel(logging.INFO)
 
 
+class CatalogCache:
+    """
+    LRU cache of query results that survives across warm invocations.
+
+    Entries stay valid for as long as the catalog version is unchanged, up to max_age seconds.
+    The version is only re-read once every TTL seconds, so cache hits don't consume any read
+    capacity. If no version has been stamped yet, entries expire after the TTL instead.
+    """
+
+    def __init__(self, max_size, ttl, max_age=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        # Bounds staleness if the table changes without a new version (e.g. a failed sync)
+        self.max_age = max_age if max_age is not None else ttl * 10
+        self.entries = OrderedDict()  # key -> (time stored, value)
+        self.version = None
+        self.version_checked_at = None
+        self.lock = Lock()
+
+    def refresh_version(self, fetch_version):
+        """Call fetch_version() if the TTL has passed and invalidate all entries if it changed"""
+        now = time.monotonic()
+
+        with self.lock:
+            if (
+                self.version_checked_at is not None
+                and now - self.version_checked_at < self.ttl
+            ):
+                return self.version
+
+        version = fetch_version()
+
+        with self.lock:
+            if version != self.version:
+                LOG.info(f"Catalog version changed from {self.version} to {version}")
+                self.entries.clear()
+
+            self.version = version
+            self.version_checked_at = now
+            return version
+
+    def get(self, key):
+        """Return the cached value for key, or None if it's missing or expired"""
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None:
+                return None
+
+            stored_at, value = entry
+            age = time.monotonic() - stored_at
+
+            if age >= self.max_age or (self.version is None and age >= self.ttl):
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+
+            # Evict the least recently used entries
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.version = None
+            self.version_checked_at = None
+
+
+class TrigramIndex:
+    """
+    Inverted index from every 3-character substring of the lowercase name and description to the
+    positions of the services that contain it.
+
+    A substring search only needs to intersect the posting sets of the query's trigrams, so its
+    cost depends on the number of matches rather than the size of the catalog.
+    """
+
+    N = 3
+
+    def __init__(self, services):
+        self.services = services
+        self.postings = defaultdict(set)
+
+        for position, service in enumerate(services):
+            for key in ("Name", "Description"):
+                text = service.get(key, {}).get("S", "").lower()
+
+                for trigram in self.get_trigrams(text):
+                    self.postings[trigram].add(position)
+
+    @classmethod
+    def get_trigrams(cls, text):
+        return {text[i : i + cls.N] for i in range(len(text) - cls.N + 1)}
+
+    def search(self, query):
+        """
+        Return the positions of all services that may contain the lowercase query, in catalog
+        order, or None if the query is too short to use the index.
+        """
+        trigrams = self.get_trigrams(query)
+
+        if not trigrams:
+            return None
+
+        # Start from the rarest trigram so every intersection stays small
+        posting_sets = sorted(
+            (self.postings.get(trigram, set()) for trigram in trigrams), key=len
+        )
+        candidates = set(posting_sets[0])
+
+        for posting_set in posting_sets[1:]:
+            if not candidates:
+                break
+
+            candidates &= posting_set
+
+        # Trigrams can match in a different order or field, so the caller must still verify them
+        return sorted(candidates)
+
+
+catalog_cache = CatalogCache(CACHE_SIZE, CACHE_TTL, CACHE_MAX_AGE)
+search_index = None
+# (snapshot, service name -> service)
+name_index = None
+
+
 def print_context(context):
     # All properties listed in: https://docs.aws.amazon.com/lambda/latest/dg/python-context.html
     LOG.info(f"{context.get_remaining_time_in_millis()=}")
@@ -31,6 +228,9 @@ def handler(event, context):
     # print_context(context)
 
     body = ""
+    # Bodies that were already stringified (and cached)
+    serialized_body = None
+    is_base64_encoded = False
     status_code = 200
     headers = {
         "Content-Type": "application/json",
@@ -41,7 +241,55 @@ def handler(event, context):
         query_parameters = event.get("queryStringParameters")
 
         if route_key == "GET /":
-            body = get_aws_services(query_parameters)
+            serialized_body, etag = get_services_response(query_parameters)
+            encoding = choose_content_encoding(get_header(event, "Accept-Encoding"))
+
+            if encoding is not None and len(serialized_body) >= MIN_COMPRESSION_SIZE:
+                serialized_body, etag = get_compressed_response(
+                    query_parameters, encoding
+                )
+                headers["Content-Encoding"] = encoding
+                is_base64_encoded = True
+
+            headers["ETag"] = etag
+            headers["Cache-Control"] = CACHE_CONTROL
+            headers["Vary"] = "Accept-Encoding"
+
+            if etag_matches(get_header(event, "If-None-Match"), etag):
+                # The client's copy is still up to date
+                status_code = 304
+                serialized_body = ""
+                is_base64_encoded = False
+                # There's no body to decode
+                headers.pop("Content-Encoding", None)
+        elif route_key == "GET /services/{name}":
+            # HTTP API passes path parameters without decoding them
+            name = unquote(event["pathParameters"]["name"])
+            response = get_service_response(name, query_parameters)
+
+            if response is None:
+                status_code = 404
+                body = f'Service "{name}" not found'
+            else:
+                serialized_body, etag = response
+                headers["ETag"] = etag
+                headers["Cache-Control"] = CACHE_CONTROL
+
+                if etag_matches(get_header(event, "If-None-Match"), etag):
+                    status_code = 304
+                    serialized_body = ""
+        elif route_key == "GET /services":
+            serialized_body, etag = get_batch_response(query_parameters)
+            headers["ETag"] = etag
+            headers["Cache-Control"] = CACHE_CONTROL
+
+            if etag_matches(get_header(event, "If-None-Match"), etag):
+                status_code = 304
+                serialized_body = ""
+        elif route_key == "POST /query":
+            body = run_queries(parse_queries(event.get("body")))
+            # 207 = some queries failed, check each result for an error
+            status_code = 200 if all("error" not in result for result in body) else 207
         elif route_key == "GET /health":
             body = ""
         else:
@@ -51,31 +299,605 @@ def handler(event, context):
         status_code = 400
         body = str(e)
     finally:
+        if serialized_body is not None:
+            body = serialized_body
         # Don't stringify empty bodies (but do so for empty arrays)
-        if body != "":
+        elif body != "":
             body = json.dumps(body)
 
-    response = {"statusCode": status_code, "headers": headers, "body": body}
+    response = {
+        "statusCode": status_code,
+        "headers": headers,
+        "body": body,
+        "isBase64Encoded": is_base64_encoded,
+    }
     LOG.info(f"{response=}")
     return response
 
 
-def scan_table(table_name):
-    # Don't return the lowercase columns to the frontend. They're only for querying.
-    # Name and Unit are reserved words
-    projection = "Id, #name, Description, Price, #unit, Category, FreeTier"
-    attribute_names = {"#name": "Name", "#unit": "Unit"}
+def get_header(event, name):
+    # HTTP API lowercases header names, but other event sources may not
+    headers = event.get("headers") or {}
+    name = name.lower()
+    return next((value for key, value in headers.items() if key.lower() == name), None)
+
+
+def etag_matches(if_none_match, etag):
+    # If-None-Match can contain "*" or a list of (possibly weak) ETags
+    if if_none_match is None:
+        return False
+
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+
+    return False
+
+
+def get_services_response(query_parameters):
+    """
+    Return the stringified body of a GET / request and its ETag.
+
+    Both are cached alongside the query results, so repeated requests and revalidations don't
+    query DynamoDB or serialize the body again.
+    """
+    table_name = os.environ.get("TableName", "")
+    catalog_cache.refresh_version(lambda: get_catalog_version(table_name))
+    cache_key = ("response",) + get_cache_key(query_parameters)
+    response = catalog_cache.get(cache_key)
+
+    if response is not None:
+        return response
+
+    serialized_body = json.dumps(get_services_body(query_parameters))
+    response = (serialized_body, get_etag(serialized_body))
+    catalog_cache.put(cache_key, response)
+    return response
+
+
+def get_services_body(query_parameters):
+    # Return the services (or page of services) matching the GET / query parameters
+    query_parameters = {**(query_parameters or {})}
+    response_format = query_parameters.pop("format", "dynamodb")
+
+    if response_format not in RESPONSE_FORMATS:
+        raise Exception(f'format "{response_format}" must be one of {RESPONSE_FORMATS}')
+
+    body = get_aws_services_page(query_parameters or None)
+
+    if response_format == "plain":
+        body = deserialize_services(body)
+
+    return body
+
+
+def parse_queries(request_body):
+    # The body of POST /query is an array of GET / query parameters (as strings)
+    try:
+        queries = json.loads(request_body or "")
+    except ValueError:
+        raise Exception("Invalid request body: must be a JSON array of queries")
+
+    if not isinstance(queries, list) or not 1 <= len(queries) <= MAX_QUERIES:
+        raise Exception(
+            f"Invalid request body: must be an array of 1 to {MAX_QUERIES} queries"
+        )
+
+    for query_parameters in queries:
+        if not isinstance(query_parameters, dict) or not all(
+            isinstance(value, str) for value in query_parameters.values()
+        ):
+            raise Exception(
+                f"Invalid query {json.dumps(query_parameters)}: must be an object of strings"
+            )
+
+    return queries
+
+
+def run_queries(queries):
+    """
+    Answer several GET / queries at once, in the same order. Queries with the same cache key are
+    only run once, and the rest run concurrently so the slowest query bounds the latency.
+    """
+    # Cache key -> query parameters
+    unique_queries = {}
+
+    for query_parameters in queries:
+        unique_queries.setdefault(get_cache_key(query_parameters), query_parameters)
+
+    def run_query(query_parameters):
+        start = time.perf_counter()
+        services = get_services_body(query_parameters or None)
+        return services, (time.perf_counter() - start) * 1000
+
+    # Queries mostly wait on DynamoDB, so threads overlap their latency
+    with ThreadPoolExecutor(
+        max_workers=min(len(unique_queries), MAX_QUERY_WORKERS)
+    ) as executor:
+        futures = {
+            cache_key: executor.submit(run_query, query_parameters)
+            for cache_key, query_parameters in unique_queries.items()
+        }
+
+    LOG.info(f"Ran {len(unique_queries)} unique queries out of {len(queries)}")
+    # Cache key -> result
+    results = {}
+
+    for cache_key, future in futures.items():
+        try:
+            services, duration_ms = future.result()
+            results[cache_key] = {
+                "services": services,
+                "durationMs": round(duration_ms, 3),
+            }
+        except Exception as e:
+            # Only fail this query, so the others' results aren't lost
+            results[cache_key] = {"error": str(e)}
+
+    return [results[get_cache_key(query_parameters)] for query_parameters in queries]
+
+
+def get_service_response(name, query_parameters):
+    """
+    Return the stringified body of a GET /services/{name} request and its ETag, or None if the
+    service doesn't exist.
+    """
+    table_name = os.environ.get("TableName", "")
+    response_format = (query_parameters or {}).get("format", "dynamodb")
+
+    if response_format not in RESPONSE_FORMATS:
+        raise Exception(f'format "{response_format}" must be one of {RESPONSE_FORMATS}')
+
+    catalog_cache.refresh_version(lambda: get_catalog_version(table_name))
+    # Other query parameters don't apply to a single service
+    cache_key = ("service", name, response_format)
+    response = catalog_cache.get(cache_key)
+
+    if response is not None:
+        return response
+
+    service = get_service(table_name, name)
+
+    if service is None:
+        return None
+    if response_format == "plain":
+        service = deserialize_services([service])[0]
+
+    serialized_body = json.dumps(service)
+    response = (serialized_body, get_etag(serialized_body))
+    catalog_cache.put(cache_key, response)
+    return response
+
+
+def get_batch_response(query_parameters):
+    """
+    Return the stringified body of a GET /services request and its ETag. The body has the
+    requested services in the same order, with null for the names that don't exist.
+    """
+    table_name = os.environ.get("TableName", "")
+    query_parameters = query_parameters or {}
+    response_format = query_parameters.get("format", "dynamodb")
+
+    if response_format not in RESPONSE_FORMATS:
+        raise Exception(f'format "{response_format}" must be one of {RESPONSE_FORMATS}')
+
+    names = [
+        name.strip()
+        for name in query_parameters.get("names", "").split(",")
+        if name.strip()
+    ]
+
+    if not 1 <= len(names) <= MAX_BATCH_NAMES:
+        raise Exception(
+            f"names must be a comma-separated list of 1 to {MAX_BATCH_NAMES} service names"
+        )
+
+    catalog_cache.refresh_version(lambda: get_catalog_version(table_name))
+    cache_key = ("services", tuple(names), response_format)
+    response = catalog_cache.get(cache_key)
+
+    if response is not None:
+        return response
+
+    services = get_services_by_name(table_name, names)
+
+    if response_format == "plain":
+        services = [
+            deserialize_services([service])[0] if service is not None else None
+            for service in services
+        ]
+
+    serialized_body = json.dumps(services)
+    response = (serialized_body, get_etag(serialized_body))
+    catalog_cache.put(cache_key, response)
+    return response
+
+
+def get_etag(serialized_body):
+    # Strong ETag based on the body's content, so it's the same across containers
+    return f'"{hashlib.blake2b(serialized_body.encode(), digest_size=16).hexdigest()}"'
+
+
+def choose_content_encoding(accept_encoding):
+    # Returns None if the client doesn't accept any supported encoding
+    # Syntax: https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Accept-Encoding
+    if not accept_encoding:
+        return None
+
+    weights = {}
+
+    for value in accept_encoding.split(","):
+        coding, _, parameters = value.partition(";")
+        weight = 1.0
+        parameter_name, _, parameter_value = parameters.strip().partition("=")
+
+        if parameter_name.strip().lower() == "q":
+            try:
+                weight = float(parameter_value)
+            except ValueError:
+                weight = 0.0
+
+        weights[coding.strip().lower()] = weight
+
+    # Pick the client's most preferred encoding, breaking ties with our preference
+    encoding_weights = [
+        (weights.get(encoding, weights.get("*", 0.0)), encoding)
+        for encoding in CONTENT_ENCODINGS
+    ]
+    weight, encoding = max(
+        encoding_weights, key=lambda encoding_weight: encoding_weight[0]
+    )
+    return encoding if weight > 0 else None
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=5)
+
+    # Don't store the current time in the header, so the output is the same across containers
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+
+def get_compressed_response(query_parameters, encoding):
+    """Return the base64-encoded compressed body of a GET / request and its ETag"""
+    cache_key = ("response", encoding) + get_cache_key(query_parameters)
+    response = catalog_cache.get(cache_key)
+
+    if response is not None:
+        return response
+
+    serialized_body, etag = get_services_response(query_parameters)
+    compressed_body = compress(serialized_body.encode(), encoding)
+    # Each encoding is a different representation, so it needs a different strong ETag
+    response = (
+        base64.b64encode(compressed_body).decode(),
+        f'{etag[:-1]}-{encoding}"',
+    )
+    catalog_cache.put(cache_key, response)
+    return response
+
+
+def scan_table(table_name, total_segments=SCAN_SEGMENTS):
+    if total_segments <= 1:
+        return scan_segment(table_name)
+
+    # Each segment is scanned in its own thread, sharing the same (thread-safe) client
+    # https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/Scan.html#Scan.ParallelScan
+    with ThreadPoolExecutor(max_workers=total_segments) as executor:
+        segments = executor.map(
+            lambda segment: scan_segment(table_name, segment, total_segments),
+            range(total_segments),
+        )
+        return [item for segment_items in segments for item in segment_items]
+
+
+def get_scan_parameters(table_name):
+    return {
+        "TableName": table_name,
+        "ProjectionExpression": PROJECTION,
+        "ExpressionAttributeNames": PROJECTION_NAMES,
+        # Skip the catalog version item
+        "FilterExpression": "Id <> :version_id",
+        "ExpressionAttributeValues": {":version_id": {"S": CATALOG_VERSION_ID}},
+    }
+
+
+def scan_segment(table_name, segment=None, total_segments=None):
+    scan_kwargs = get_scan_parameters(table_name)
+
+    if segment is not None:
+        scan_kwargs["Segment"] = segment
+        scan_kwargs["TotalSegments"] = total_segments
+
+    items = []
+
+    # Each page is capped at 1 MB, so keep scanning until there's no LastEvaluatedKey
+    while True:
+        response = dynamodb.scan(**scan_kwargs)
+        items.extend(response["Items"])
+
+        if "LastEvaluatedKey" not in response:
+            return items
+
+        scan_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def scan_page(table_name, limit, exclusive_start_key=None):
+    """
+    Only read one page from DynamoDB. Returns the items and the key to continue from, or None
+    if no items are left.
+
+    DynamoDB returns a LastEvaluatedKey whenever it reads Limit items, even if none are left,
+    and Limit is applied before filtering out the catalog version. So read 1 item past the
+    page, until the page is full or the table ends, to never return an empty last page.
+    """
+    scan_kwargs = get_scan_parameters(table_name)
+    items = []
+
+    while True:
+        page_kwargs = {**scan_kwargs, "Limit": limit + 1 - len(items)}
 
-    response = dynamodb.scan(
+        if exclusive_start_key is not None:
+            page_kwargs["ExclusiveStartKey"] = exclusive_start_key
+
+        response = dynamodb.scan(**page_kwargs)
+        items.extend(response["Items"])
+        exclusive_start_key = response.get("LastEvaluatedKey")
+
+        if len(items) > limit or exclusive_start_key is None:
+            break
+
+    if len(items) <= limit:
+        return items, None
+
+    # Continue after the last item of this page (Id and Name are the table's key)
+    items = items[:limit]
+    return items, {"Id": items[-1]["Id"], "Name": items[-1]["Name"]}
+
+
+def get_service_id(name):
+    # Same ID as populate-dynamodb-table.py assigns, so the full key is known from the name
+    return str(uuid5(SERVICE_ID_NAMESPACE, name))
+
+
+def get_service(table_name, name):
+    # Returns None if the service doesn't exist. Reads at most 1 item instead of scanning.
+    response = dynamodb.get_item(
+        TableName=table_name,
+        Key={"Id": {"S": get_service_id(name)}, "Name": {"S": name}},
+        ProjectionExpression=PROJECTION,
+        ExpressionAttributeNames=PROJECTION_NAMES,
+        ReturnConsumedCapacity="TOTAL",
+    )
+    capacity_units = response.get("ConsumedCapacity", {}).get("CapacityUnits", 0)
+    LOG.info(f"GetItem consumed {capacity_units} read capacity units (RCU)")
+    return response.get("Item")
+
+
+def get_services_by_name(table_name, names):
+    # Returns the service for each name (or None if it doesn't exist), in the same order
+    snapshot = catalog_cache.get(())
+
+    if snapshot is not None:
+        # The whole catalog is already in memory, so don't read from DynamoDB
+        LOG.info("Query plan: snapshot for services by name")
+        services = get_name_index(snapshot)
+    else:
+        services = batch_get_services(table_name, list(dict.fromkeys(names)))
+
+    return [services.get(name) for name in names]
+
+
+def batch_get_services(table_name, names):
+    """
+    Read the services with the given (unique) names with BatchGetItem, keyed by name. Each
+    request is capped at 100 keys, so the chunks are read in parallel.
+    """
+    chunks = [
+        names[chunk_start : chunk_start + BATCH_GET_LIMIT]
+        for chunk_start in range(0, len(names), BATCH_GET_LIMIT)
+    ]
+
+    if len(chunks) == 1:
+        chunk_items = [batch_get_chunk(table_name, chunks[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+            chunk_items = list(
+                executor.map(lambda chunk: batch_get_chunk(table_name, chunk), chunks)
+            )
+
+    return {item["Name"]["S"]: item for items in chunk_items for item in items}
+
+
+def batch_get_chunk(table_name, names):
+    keys = [{"Id": {"S": get_service_id(name)}, "Name": {"S": name}} for name in names]
+    items = []
+    capacity_units = 0
+
+    for attempt in range(MAX_BATCH_GET_ATTEMPTS):
+        response = dynamodb.batch_get_item(
+            RequestItems={
+                table_name: {
+                    "Keys": keys,
+                    "ProjectionExpression": PROJECTION,
+                    "ExpressionAttributeNames": PROJECTION_NAMES,
+                }
+            },
+            ReturnConsumedCapacity="TOTAL",
+        )
+        items.extend(response["Responses"].get(table_name, []))
+        capacity_units += sum(
+            capacity["CapacityUnits"]
+            for capacity in response.get("ConsumedCapacity", [])
+        )
+        # Keys that weren't read must be sent again
+        keys = response.get("UnprocessedKeys", {}).get(table_name, {}).get("Keys", [])
+
+        if not keys:
+            LOG.info(
+                f"BatchGetItem consumed {capacity_units} read capacity units (RCU)"
+            )
+            return items
+
+        # Full jitter: https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+        time.sleep(
+            random.uniform(0, min(MAX_BACKOFF_DELAY, BASE_BACKOFF_DELAY * 2**attempt))
+        )
+
+    raise Exception(
+        f"Couldn't read {len(keys)} services after {MAX_BATCH_GET_ATTEMPTS} attempts"
+    )
+
+
+def get_name_index(snapshot):
+    # Build the index lazily, once per catalog snapshot
+    global name_index
+
+    if name_index is None or name_index[0] is not snapshot:
+        # Only index the services that BatchGetItem can find, so both paths agree on items
+        # that haven't been migrated to the derived IDs yet
+        name_index = (
+            snapshot,
+            {
+                service["Name"]["S"]: service
+                for service in snapshot
+                if service["Id"]["S"] == get_service_id(service["Name"]["S"])
+            },
+        )
+
+    return name_index[1]
+
+
+def get_catalog_version(table_name):
+    # Returns None if the catalog was never stamped with a version
+    response = dynamodb.get_item(
         TableName=table_name,
-        ProjectionExpression=projection,
-        ExpressionAttributeNames=attribute_names,
+        Key=CATALOG_VERSION_KEY,
+        ProjectionExpression="Version",
     )
-    return response["Items"]
+    return response.get("Item", {}).get("Version", {}).get("S")
 
 
-def get_aws_services(query_parameters, use_index=True):
+def get_cache_key(query_parameters):
+    # Normalize the query parameters so equivalent requests share the same entry
+    if not query_parameters:
+        return ()
+
+    normalized_parameters = {**query_parameters}
+
+    if "query" in normalized_parameters:
+        # Searching is case insensitive
+        normalized_parameters["query"] = normalized_parameters["query"].lower()
+    if "category" in normalized_parameters:
+        # Categories can be listed in any order
+        normalized_parameters["category"] = ",".join(
+            get_categories(normalized_parameters["category"])
+        )
+    if "free-tier" in normalized_parameters:
+        # Only the presence of free-tier matters
+        normalized_parameters["free-tier"] = ""
+
+    return tuple(sorted(normalized_parameters.items()))
+
+
+def encode_cursor(position):
+    # Cursors are opaque to clients: base64-encoded JSON containing an offset or DynamoDB key
+    position_json = json.dumps(position, separators=(",", ":"))
+    return base64.urlsafe_b64encode(position_json.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise Exception(f'Invalid cursor "{cursor}"')
+
+    if not (
+        isinstance(position, dict)
+        and (
+            (isinstance(position.get("offset"), int) and position["offset"] >= 0)
+            or isinstance(position.get("key"), dict)
+        )
+    ):
+        raise Exception(f'Invalid cursor "{cursor}"')
+
+    return position
+
+
+def get_aws_services_page(query_parameters):
+    # Without limit or cursor, return the whole list like before
+    if not query_parameters or (
+        "limit" not in query_parameters and "cursor" not in query_parameters
+    ):
+        return get_aws_services(query_parameters)
+
+    query_parameters = {**query_parameters}
+    limit = query_parameters.pop("limit", str(MAX_PAGE_SIZE))
+    cursor = query_parameters.pop("cursor", None)
+
+    if not (limit.isdigit() and 1 <= int(limit) <= MAX_PAGE_SIZE):
+        raise Exception(f'limit "{limit}" must be between 1 and {MAX_PAGE_SIZE}')
+
+    limit = int(limit)
+    position = decode_cursor(cursor) if cursor else {"offset": 0}
     table_name = os.environ.get("TableName", "")
+
+    # Page through the table directly if the whole catalog isn't already in memory
+    if not query_parameters and (
+        "key" in position
+        or (position["offset"] == 0 and get_cached_services(None) is None)
+    ):
+        items, last_evaluated_key = scan_page(table_name, limit, position.get("key"))
+        next_position = (
+            {"key": last_evaluated_key} if last_evaluated_key is not None else None
+        )
+    else:
+        if "key" in position:
+            raise Exception(f'Invalid cursor "{cursor}"')
+
+        # Page through the (cached) results of the query
+        services = get_aws_services(query_parameters or None)
+        offset = position["offset"]
+        items = services[offset : offset + limit]
+        next_position = (
+            {"offset": offset + limit} if offset + limit < len(services) else None
+        )
+
+    next_cursor = encode_cursor(next_position) if next_position is not None else None
+    return {"items": items, "nextCursor": next_cursor}
+
+
+def get_cached_services(query_parameters):
+    # Returns None if the query hasn't been cached yet
+    table_name = os.environ.get("TableName", "")
+    catalog_cache.refresh_version(lambda: get_catalog_version(table_name))
+    return catalog_cache.get(get_cache_key(query_parameters))
+
+
+def get_aws_services(query_parameters, use_index=True, use_cache=True):
+    table_name = os.environ.get("TableName", "")
+
+    if not use_cache:
+        return query_aws_services(table_name, query_parameters, use_index)
+
+    catalog_cache.refresh_version(lambda: get_catalog_version(table_name))
+    cache_key = get_cache_key(query_parameters)
+    items = catalog_cache.get(cache_key)
+
+    if items is not None:
+        LOG.info(f"Query plan: cache hit for {cache_key}")
+        return items
+
+    items = query_aws_services(table_name, query_parameters, use_index)
+    catalog_cache.put(cache_key, items)
+    return items
+
+
+def query_aws_services(
+    table_name, query_parameters, use_index=True, use_local=LOCAL_QUERIES
+):
     if not query_parameters:
         return scan_table(table_name)
 
@@ -91,6 +913,41 @@ def get_aws_services(query_parameters, use_index=True):
     if max_price is not None and not is_number(max_price):
         raise Exception(f'max-price "{max_price}" is not numeric')
 
+    if query == category == min_price == max_price == free_tier == None:
+        raise Exception(f"Invalid query parameters passed")
+
+    # category can be a comma-separated list of categories to match any of
+    categories = get_categories(category) if category is not None else None
+
+    if categories == []:
+        raise Exception(f'category "{category}" must list at least one category')
+
+    plan = plan_query(category, use_index, use_local)
+    LOG.info(f"Query plan: {plan}")
+
+    if plan == "snapshot":
+        snapshot = get_catalog_snapshot(table_name)
+        services = filter_services(
+            snapshot,
+            query,
+            categories,
+            min_price,
+            max_price,
+            free_tier,
+            get_search_index(snapshot),
+        )
+
+        if use_index and categories is not None:
+            # Match the order of the price index
+            services.sort(key=lambda service: Decimal(service["Price"]["N"]))
+
+        return services
+
+    if plan == "index":
+        # Category and price are handled by the key condition, the rest is filtered afterwards
+        services = query_price_indexes(table_name, categories, min_price, max_price)
+        return filter_services(services, query=query, free_tier=free_tier)
+
     # ProjectionExpression = columns, KeyConditionExpression = rows, FilterExpression = less rows
     # Expression functions: https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/Expressions.OperatorsAndFunctions.html
     # PartiQL syntax: https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/ql-reference.select.html
@@ -103,8 +960,9 @@ def get_aws_services(query_parameters, use_index=True):
         conditions.append(
             f"(contains(\"NameLower\", '{query.lower()}') OR contains(\"DescriptionLower\", '{query.lower()}'))"
         )
-    if category is not None:
-        conditions.append(f"Category = '{category}'")
+    if categories is not None:
+        category_conditions = [f"Category = '{category}'" for category in categories]
+        conditions.append(f"({' OR '.join(category_conditions)})")
     if min_price is not None:
         conditions.append(f"Price >= {min_price}")
     if max_price is not None:
@@ -114,19 +972,236 @@ def get_aws_services(query_parameters, use_index=True):
             "FreeTier IS NOT MISSING AND attribute_type(\"FreeTier\", 'N')"
         )
 
-    if not conditions:
-        raise Exception(f"Invalid query parameters passed")
-
-    if use_index and query == free_tier == None and category is not None:
-        # Utilize the index created to perform a query instead of a scan
-        table += '."PriceIndex"'
-
     condition_expression = " AND ".join(conditions)
     projection = "Id, Name, Description, Price, Unit, Category, FreeTier"
     partiql_statement = f"SELECT {projection} FROM {table} WHERE {condition_expression}"
     LOG.info(f"{partiql_statement=}")
-    response = dynamodb.execute_statement(Statement=partiql_statement)
-    return response["Items"]
+    statement_kwargs = {
+        "Statement": partiql_statement,
+        "ReturnConsumedCapacity": "TOTAL",
+    }
+    items = []
+    capacity_units = 0
+
+    # Each page is capped at 1 MB, so keep reading until there's no NextToken
+    while True:
+        response = dynamodb.execute_statement(**statement_kwargs)
+        items.extend(response["Items"])
+        capacity_units += response.get("ConsumedCapacity", {}).get("CapacityUnits", 0)
+
+        if "NextToken" not in response:
+            break
+
+        statement_kwargs["NextToken"] = response["NextToken"]
+
+    LOG.info(f"Scan consumed {capacity_units} read capacity units (RCU)")
+    return items
+
+
+def plan_query(category, use_index=True, use_local=LOCAL_QUERIES):
+    """
+    Pick how to answer a filtered query (cache hits are handled by get_aws_services):
+    - snapshot: filter the in-memory catalog without reading from DynamoDB
+    - index: query the category's partition in PriceIndex, with price as the sort key
+    - scan: filter the whole table with PartiQL
+    """
+    if use_local:
+        return "snapshot"
+    if use_index and category is not None:
+        return "index"
+    return "scan"
+
+
+def get_categories(category):
+    # Split a comma-separated list of categories, in a stable order without duplicates
+    return sorted({value.strip() for value in category.split(",")} - {""})
+
+
+def query_price_indexes(table_name, categories, min_price=None, max_price=None):
+    """
+    Query the price index partition of each category in parallel, then merge the partitions
+    (each already sorted by price) into one list sorted by price.
+    """
+    if len(categories) == 1:
+        return query_price_index(table_name, categories[0], min_price, max_price)
+
+    with ThreadPoolExecutor(max_workers=len(categories)) as executor:
+        partitions = list(
+            executor.map(
+                lambda category: query_price_index(
+                    table_name, category, min_price, max_price
+                ),
+                categories,
+            )
+        )
+
+    # k-way merge in O(n log k) instead of sorting all n services again. Ties keep the order of
+    # the categories, so the result is stable.
+    return list(
+        heapq.merge(*partitions, key=lambda service: Decimal(service["Price"]["N"]))
+    )
+
+
+def query_price_index(table_name, category, min_price=None, max_price=None):
+    # Key condition syntax:
+    # https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/Query.KeyConditionExpressions.html
+    key_condition = "Category = :category"
+    attribute_values = {":category": {"S": category}}
+
+    if min_price is not None and max_price is not None:
+        # BETWEEN requires the lower bound to be <= the upper bound
+        if Decimal(min_price) > Decimal(max_price):
+            return []
+
+        key_condition += " AND Price BETWEEN :min_price AND :max_price"
+    elif min_price is not None:
+        key_condition += " AND Price >= :min_price"
+    elif max_price is not None:
+        key_condition += " AND Price <= :max_price"
+
+    if min_price is not None:
+        attribute_values[":min_price"] = {"N": min_price}
+    if max_price is not None:
+        attribute_values[":max_price"] = {"N": max_price}
+
+    query_kwargs = {
+        "TableName": table_name,
+        "IndexName": "PriceIndex",
+        "KeyConditionExpression": key_condition,
+        "ExpressionAttributeValues": attribute_values,
+        "ProjectionExpression": PROJECTION,
+        "ExpressionAttributeNames": PROJECTION_NAMES,
+        "ReturnConsumedCapacity": "TOTAL",
+    }
+    LOG.info(f"{key_condition=}")
+    items = []
+    capacity_units = 0
+
+    while True:
+        response = dynamodb.query(**query_kwargs)
+        items.extend(response["Items"])
+        capacity_units += response.get("ConsumedCapacity", {}).get("CapacityUnits", 0)
+
+        if "LastEvaluatedKey" not in response:
+            break
+
+        query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    LOG.info(f"PriceIndex query consumed {capacity_units} read capacity units (RCU)")
+    return items
+
+
+def get_catalog_snapshot(table_name):
+    # Load the whole catalog once per catalog version and share it with the unfiltered GET /
+    catalog_cache.refresh_version(lambda: get_catalog_version(table_name))
+    snapshot = catalog_cache.get(())
+
+    if snapshot is None:
+        # The snapshot is missing or stale, so reload it from DynamoDB
+        LOG.info("Loading the catalog snapshot")
+        snapshot = scan_table(table_name)
+        catalog_cache.put((), snapshot)
+
+    return snapshot
+
+
+def get_search_index(snapshot):
+    # Build the index lazily, once per catalog snapshot
+    global search_index
+
+    if search_index is None or search_index.services is not snapshot:
+        LOG.info("Building the search index")
+        search_index = TrigramIndex(snapshot)
+
+    return search_index
+
+
+def filter_services(
+    services,
+    query=None,
+    categories=None,
+    min_price=None,
+    max_price=None,
+    free_tier=None,
+    index=None,
+):
+    # Evaluate the same conditions as the PartiQL statement in query_aws_services
+    query_lower = query.lower() if query is not None else None
+
+    if query_lower is not None and index is not None:
+        # Narrow down the services to check using the index (built from the same services)
+        positions = index.search(query_lower)
+
+        if positions is not None:
+            services = [services[position] for position in positions]
+
+    min_price_number = Decimal(min_price) if min_price is not None else None
+    max_price_number = Decimal(max_price) if max_price is not None else None
+
+    def matches(service):
+        if query_lower is not None and not (
+            query_lower in service.get("Name", {}).get("S", "").lower()
+            or query_lower in service.get("Description", {}).get("S", "").lower()
+        ):
+            return False
+        if (
+            categories is not None
+            and service.get("Category", {}).get("S") not in categories
+        ):
+            return False
+
+        # Items without a numeric price never match a price condition
+        price = service.get("Price", {}).get("N")
+
+        if min_price_number is not None and (
+            price is None or Decimal(price) < min_price_number
+        ):
+            return False
+        if max_price_number is not None and (
+            price is None or Decimal(price) > max_price_number
+        ):
+            return False
+        if free_tier is not None and "N" not in service.get("FreeTier", {}):
+            return False
+
+        return True
+
+    return [service for service in services if matches(service)]
+
+
+def deserialize_services(services):
+    # Convert a list of items (or a page of items) from DynamoDB JSON to plain JSON
+    if isinstance(services, dict):
+        return {**services, "items": deserialize_services(services["items"])}
+
+    return [
+        {key: deserialize_value(value) for key, value in service.items()}
+        for service in services
+    ]
+
+
+def deserialize_value(value):
+    # Lighter alternative to boto3's TypeDeserializer, which creates a Decimal for each number.
+    # Attribute value types: https://docs.aws.amazon.com/amazondynamodb/latest/APIReference/API_AttributeValue.html
+    for data_type, data in value.items():
+        # Check the most common types first
+        if data_type == "S":
+            return data
+        if data_type == "N":
+            # Avoid raising an exception for every non-integer
+            if "." in data or "E" in data or "e" in data:
+                return float(data)
+            return int(data)
+        if data_type == "NULL":
+            return None
+        if data_type == "BOOL":
+            return data
+        if data_type == "L":
+            return [deserialize_value(element) for element in data]
+        if data_type == "M":
+            return {key: deserialize_value(element) for key, element in data.items()}
+
+        raise Exception(f'Unsupported attribute type "{data_type}"')
 
 
 def is_number(s):
@@ -4,6 +4,26 @@ from moto import mock_aws
 import os
 import pytest
 from unittest.mock import MagicMock
+from uuid import uuid4
+
+
+class LocalEventQueue:
+    """In-memory stand-in for analytics.SQSEventQueue"""
+
+    def __init__(self):
+        self.messages = []
+
+    def send(self, messages):
+        self.messages.extend(messages)
+        return [None] * len(messages)
+
+    def drain(self):
+        """Remove all the messages as an SQS event, to pass to queue_handler"""
+        records = [
+            {"messageId": str(uuid4()), "body": message} for message in self.messages
+        ]
+        self.messages = []
+        return {"Records": records}
 
 
 @pytest.fixture
@@ -28,6 +48,12 @@ def pinpoint_client(aws_credentials):
         yield boto3.client("pinpoint")
 
 
+@pytest.fixture
+def sqs_client(aws_credentials):
+    with mock_aws():
+        yield boto3.client("sqs")
+
+
 @pytest.fixture
 def table_name():
     return "test-table"
@@ -35,11 +61,29 @@ def table_name():
 
 @pytest.fixture
 def dynamodb_table(dynamodb_client, table_name):
-    # Create a mock DynamoDB table with items
+    # Create a mock DynamoDB table with items (matching the schema in template.yaml)
     response = dynamodb_client.create_table(
         TableName=table_name,
-        KeySchema=[{"AttributeName": "Id", "KeyType": "HASH"}],
-        AttributeDefinitions=[{"AttributeName": "Id", "AttributeType": "S"}],
+        KeySchema=[
+            {"AttributeName": "Id", "KeyType": "HASH"},
+            {"AttributeName": "Name", "KeyType": "RANGE"},
+        ],
+        AttributeDefinitions=[
+            {"AttributeName": "Id", "AttributeType": "S"},
+            {"AttributeName": "Name", "AttributeType": "S"},
+            {"AttributeName": "Price", "AttributeType": "N"},
+            {"AttributeName": "Category", "AttributeType": "S"},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                "IndexName": "PriceIndex",
+                "KeySchema": [
+                    {"AttributeName": "Category", "KeyType": "HASH"},
+                    {"AttributeName": "Price", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "ALL"},
+            }
+        ],
         BillingMode="PAY_PER_REQUEST",  # don't specify RCUs or WCUs
     )
     os.environ["TableName"] = response["TableDescription"]["TableName"]
@@ -151,6 +195,33 @@ def dynamodb_table(dynamodb_client, table_name):
     return items
 
 
+@pytest.fixture(autouse=True)
+def catalog_cache():
+    # Don't let cached query results leak between tests
+    from src import app
+
+    app.catalog_cache.clear()
+    yield app.catalog_cache
+    app.catalog_cache.clear()
+    app.catalog_cache.ttl = app.CACHE_TTL
+    app.catalog_cache.max_age = app.CACHE_MAX_AGE
+
+
+@pytest.fixture(autouse=True)
+def published_events():
+    # Don't let published event IDs leak between tests
+    from src import analytics
+
+    analytics.published_events.clear()
+    yield analytics.published_events
+    analytics.published_events.clear()
+
+
+@pytest.fixture
+def event_queue():
+    return LocalEventQueue()
+
+
 @pytest.fixture
 def pinpoint_app_name():
     return "test-app"
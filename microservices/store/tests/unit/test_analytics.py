@@ -4,6 +4,8 @@ import json
 import os
 import pytest
 import sys
+import time
+from unittest.mock import patch
 
 sys.path.append("..")
 
@@ -22,6 +24,10 @@ VALID_METRICS = {"a": 1.3}
         {"name": None},
         {"name": "test"},
         {"name": "test", "properties": 3},
+        {"name": "test", "properties": {}, "id": ""},
+        {"name": "test", "properties": {}, "id": 1},
+        {"name": "test", "properties": {}, "id": "a" * 129},
+        "test",
     ],
 )
 def test_invalid_event_object(event):
@@ -53,10 +59,113 @@ def test_event_properties(properties, expected_attributes, expected_metrics):
     assert actual_metrics == expected_metrics
 
 
+@pytest.mark.parametrize(
+    "event,error_message",
+    [
+        ({"name": "x" * 51, "properties": {}}, '"name" must be at most 50 characters'),
+        (
+            {"name": "test", "properties": {"x" * 51: 1}},
+            f'Property "{"x" * 50}..." must have a name of at most 50 characters',
+        ),
+        (
+            {"name": "test", "properties": {"a": "x" * 101}},
+            'Property "a" must be at most 100 characters',
+        ),
+        (
+            {"name": "test", "properties": {str(i): str(i) for i in range(41)}},
+            "Events can have at most 40 string or boolean properties",
+        ),
+        (
+            {"name": "test", "properties": {str(i): i for i in range(41)}},
+            "Events can have at most 40 numeric properties",
+        ),
+    ],
+)
+def test_event_limits(event, error_message):
+    # Events that Pinpoint would reject should fail validation
+    assert analytics.validate_event_object(event) == (False, error_message)
+
+
+def test_event_limits_ignore_other_types():
+    # Properties that aren't published don't count towards the limits
+    properties = {str(i): None for i in range(100)}
+    properties.update({f"a{i}": "x" for i in range(40)})
+    properties.update({f"m{i}": i for i in range(40)})
+
+    error_message, attributes, metrics = analytics.process_event(
+        {"name": "test", "properties": properties}
+    )
+    assert error_message is None
+    assert len(attributes) == 40
+    assert len(metrics) == 40
+
+
+def test_event_property_subclasses():
+    class Name(str):
+        pass
+
+    attributes, metrics = analytics.categorize_event_properties(
+        {"a": Name("b"), "c": False}
+    )
+    assert attributes == {"a": "b", "c": "False"}
+    assert metrics == {}
+
+
+@pytest.mark.parametrize("apigw_event", ["pinpoint-batch-event.json"], indirect=True)
+def test_analytics_handler_with_oversize_body(apigw_event, monkeypatch):
+    monkeypatch.setattr(analytics, "MAX_BODY_SIZE", 10)
+
+    with patch.object(analytics.pinpoint, "put_events") as put_events:
+        lambda_response = analytics.handler(apigw_event, "")
+
+    assert lambda_response["statusCode"] == 400
+    assert (
+        json.loads(lambda_response["body"]) == "Request body must be at most 10 bytes"
+    )
+    put_events.assert_not_called()
+
+
+def test_oversize_body_counts_bytes(monkeypatch):
+    monkeypatch.setattr(analytics, "MAX_BODY_SIZE", 10)
+
+    assert not analytics.is_oversize("x" * 10)
+    # 4 characters, but 12 bytes in UTF-8
+    assert analytics.is_oversize("€" * 4)
+
+
+@pytest.mark.parametrize("num_ignored_properties", [0, 500])
+def test_event_validation_benchmark(num_ignored_properties):
+    # A valid event at Pinpoint's limits, plus properties that aren't attributes or metrics
+    properties = {
+        **{f"attribute{i}": f"value{i}" for i in range(analytics.MAX_ATTRIBUTES)},
+        **{f"metric{i}": i for i in range(analytics.MAX_METRICS)},
+    }
+    ignored_values = [None, ["a", "b", "c"], {"nested": {"key": "value"}}]
+
+    for i in range(num_ignored_properties):
+        properties[f"ignored{i}"] = ignored_values[i % len(ignored_values)]
+
+    event = {"name": "benchmark", "properties": properties}
+    num_events = 1000
+
+    start = time.perf_counter()
+    for _ in range(num_events):
+        error_message, attributes, metrics = analytics.process_event(event)
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{len(properties)} properties: {num_events / elapsed:.0f} events/s ({error_message=})"
+    )
+    # Ignored properties don't count towards the limits
+    assert error_message is None
+    assert len(attributes) == analytics.MAX_ATTRIBUTES
+    assert len(metrics) == analytics.MAX_METRICS
+
+
 def test_publish_event(pinpoint_client, pinpoint_app):
     timestamp = datetime.now().isoformat()
 
-    with freeze_time(timestamp):
+    with freeze_time(timestamp), patch.object(analytics, "uuid4", return_value="id"):
         analytics.publish_event(VALID_EVENT, pinpoint_client)
         pinpoint_client.put_events.assert_called_once_with(
             ApplicationId=os.environ["PinpointAppId"],
@@ -65,7 +174,7 @@ def test_publish_event(pinpoint_client, pinpoint_app):
                     "anonymous": {
                         "Endpoint": {},
                         "Events": {
-                            f"event-{timestamp}": {
+                            "event-id": {
                                 "Attributes": VALID_ATTRIBUTES,
                                 "EventType": VALID_EVENT["name"],
                                 "Metrics": VALID_METRICS,
@@ -90,3 +199,335 @@ def test_analytics_handler_with_invalid_app_id(apigw_event):
     }
     # Ex: "An error occurred (NotFoundException) when calling the PutEvents operation: Resource not found"
     assert "PutEvents" in body
+
+
+def accept_events(ApplicationId, EventsRequest):
+    # Mock PutEvents response that accepts every event
+    return {
+        "EventsResponse": {
+            "Results": {
+                endpoint_id: {
+                    "EndpointItemResponse": {"Message": "Accepted", "StatusCode": 202},
+                    "EventsItemResponse": {
+                        event_id: {"Message": "Accepted", "StatusCode": 202}
+                        for event_id in batch_item["Events"]
+                    },
+                }
+                for endpoint_id, batch_item in EventsRequest["BatchItem"].items()
+            }
+        }
+    }
+
+
+def test_publish_events(pinpoint_client, pinpoint_app):
+    # Given a batch of valid and invalid events
+    pinpoint_client.put_events.side_effect = accept_events
+    events = [VALID_EVENT, {"name": "test"}, VALID_EVENT, "event"]
+
+    # When the events are published
+    results = analytics.publish_events(events, pinpoint_client)
+
+    # Then the valid events are sent in one request and each event has a status
+    pinpoint_client.put_events.assert_called_once()
+    events_request = pinpoint_client.put_events.call_args.kwargs["EventsRequest"]
+    assert len(events_request["BatchItem"]["anonymous"]["Events"]) == 2
+    assert [result["StatusCode"] for result in results] == [202, 400, 202, 400]
+
+
+def test_publish_events_in_chunks(pinpoint_client, pinpoint_app):
+    # Given more events than fit in one PutEvents request
+    pinpoint_client.put_events.side_effect = accept_events
+    events = [VALID_EVENT] * (analytics.PUT_EVENTS_LIMIT * 2 + 1)
+
+    # When the events are published
+    results = analytics.publish_events(events, pinpoint_client)
+
+    # Then the events are split into chunks
+    assert pinpoint_client.put_events.call_count == 3
+    assert len(results) == len(events)
+    assert all(result["StatusCode"] == 202 for result in results)
+
+
+def test_publish_events_with_failed_chunk(pinpoint_client, pinpoint_app):
+    # Given a PutEvents request that fails
+    pinpoint_client.put_events.side_effect = Exception("Throttled")
+    # When the events are published
+    results = analytics.publish_events([VALID_EVENT], pinpoint_client)
+    # Then the events in that chunk report the error
+    assert results == [{"StatusCode": 400, "Message": "Throttled"}]
+
+
+@pytest.mark.parametrize("apigw_event", ["pinpoint-test-event.json"], indirect=True)
+@pytest.mark.parametrize("is_async", [False, True])
+def test_analytics_handler_processes_event_once(
+    apigw_event, is_async, event_queue, monkeypatch
+):
+    # Given a valid event
+    monkeypatch.setattr(analytics, "ASYNC_EVENTS", is_async)
+    monkeypatch.setattr(analytics, "event_queue", event_queue)
+
+    # When it's published or queued with POST /event
+    with patch.object(
+        analytics.pinpoint, "put_events", side_effect=accept_events
+    ), patch.object(
+        analytics, "process_event", wraps=analytics.process_event
+    ) as process_event:
+        lambda_response = analytics.handler(apigw_event, "")
+
+    # Then it's only validated and categorized once
+    assert lambda_response["statusCode"] == 202
+    assert len(event_queue.messages) == int(is_async)
+    assert process_event.call_count == 1
+
+
+@pytest.mark.parametrize("apigw_event", ["pinpoint-batch-event.json"], indirect=True)
+def test_analytics_handler_with_batch(apigw_event):
+    with patch.object(analytics.pinpoint, "put_events", side_effect=accept_events):
+        lambda_response = analytics.handler(apigw_event, "")
+
+    body = json.loads(lambda_response["body"])
+
+    # Response should be 202 since all the events were accepted
+    assert lambda_response["statusCode"] == 202
+    assert body == [{"StatusCode": 202, "Message": "Accepted"}] * 2
+
+
+@pytest.mark.parametrize("apigw_event", ["pinpoint-batch-event.json"], indirect=True)
+def test_analytics_handler_with_invalid_batch(apigw_event):
+    apigw_event["body"] = json.dumps(VALID_EVENT)
+    lambda_response = analytics.handler(apigw_event, "")
+
+    # Response should be 400 since the body isn't an array
+    assert lambda_response["statusCode"] == 400
+
+
+def test_publish_events_with_idempotency_keys(pinpoint_client, pinpoint_app):
+    # Given a batch with repeated idempotency keys
+    pinpoint_client.put_events.side_effect = accept_events
+    events = [
+        {**VALID_EVENT, "id": "a"},
+        {**VALID_EVENT, "id": "b"},
+        {**VALID_EVENT, "id": "a"},
+    ]
+
+    # When the batch is published and then retried
+    results = analytics.publish_events(events, pinpoint_client)
+    retry_results = analytics.publish_events(events, pinpoint_client)
+
+    # Then each key is only sent to Pinpoint once
+    pinpoint_client.put_events.assert_called_once()
+    events_request = pinpoint_client.put_events.call_args.kwargs["EventsRequest"]
+    assert list(events_request["BatchItem"]["anonymous"]["Events"]) == [
+        analytics.get_event_id({"id": "a"}, os.environ["PinpointAppId"]),
+        analytics.get_event_id({"id": "b"}, os.environ["PinpointAppId"]),
+    ]
+    assert results == retry_results == [{"StatusCode": 202, "Message": "Accepted"}] * 3
+
+
+def test_publish_events_without_idempotency_keys(pinpoint_client, pinpoint_app):
+    # Given identical events without idempotency keys
+    pinpoint_client.put_events.side_effect = accept_events
+    timestamp = datetime.now().isoformat()
+
+    # When they're published at the same time
+    with freeze_time(timestamp):
+        analytics.publish_events([VALID_EVENT] * 3, pinpoint_client)
+
+    # Then every event gets a unique ID
+    events_request = pinpoint_client.put_events.call_args.kwargs["EventsRequest"]
+    assert len(events_request["BatchItem"]["anonymous"]["Events"]) == 3
+
+
+def test_event_ids_are_scoped_to_the_app():
+    # Given the same idempotency key sent to different apps
+    event = {**VALID_EVENT, "id": "a" * analytics.MAX_EVENT_ID_LENGTH}
+    # When their event IDs are computed
+    event_ids = {
+        analytics.get_event_id(event, "app1"),
+        analytics.get_event_id(event, "app2"),
+        analytics.get_event_id(event, "app1", "endpoint"),
+    }
+    # Then they don't collide, and are shorter than the key
+    assert len(event_ids) == 3
+    assert all(len(event_id) < analytics.MAX_EVENT_ID_LENGTH for event_id in event_ids)
+
+
+def test_failed_events_can_be_retried(pinpoint_client, pinpoint_app):
+    # Given an event that failed to publish
+    event = {**VALID_EVENT, "id": "retry"}
+    pinpoint_client.put_events.side_effect = Exception("Throttled")
+    analytics.publish_events([event], pinpoint_client)
+
+    # When the event is retried
+    pinpoint_client.put_events.side_effect = accept_events
+    results = analytics.publish_events([event], pinpoint_client)
+
+    # Then it's sent to Pinpoint again
+    assert pinpoint_client.put_events.call_count == 2
+    assert results == [{"StatusCode": 202, "Message": "Accepted"}]
+
+
+def test_dedup_window_expires(monkeypatch):
+    # Given a published event
+    result = {"StatusCode": 202, "Message": "Accepted"}
+    analytics.record_published_result("event-a", result)
+    assert analytics.get_published_result("event-a") == result
+    # When the dedup window passes
+    monkeypatch.setattr(analytics, "DEDUP_WINDOW", 0)
+    # Then the event is forgotten
+    assert analytics.get_published_result("event-a") is None
+    assert not analytics.published_events
+
+
+def test_dedup_window_is_bounded(monkeypatch):
+    # Given a dedup window with a max size
+    monkeypatch.setattr(analytics, "DEDUP_SIZE", 2)
+    result = {"StatusCode": 202, "Message": "Accepted"}
+    # When more events are published
+    for event_id in ["a", "b", "c"]:
+        analytics.record_published_result(event_id, result)
+    # Then the oldest events are forgotten
+    assert list(analytics.published_events) == ["b", "c"]
+
+
+@pytest.mark.parametrize("apigw_event", ["pinpoint-batch-event.json"], indirect=True)
+def test_async_events(apigw_event, event_queue, monkeypatch):
+    # Given the analytics Lambda in async mode
+    monkeypatch.setattr(analytics, "ASYNC_EVENTS", True)
+    monkeypatch.setattr(analytics, "event_queue", event_queue)
+    timestamp = datetime.now().isoformat()
+
+    # When a batch of events is posted
+    with freeze_time(timestamp), patch.object(
+        analytics.pinpoint, "put_events"
+    ) as put_events:
+        lambda_response = analytics.handler(apigw_event, "")
+
+    # Then the events are queued without calling Pinpoint
+    assert lambda_response["statusCode"] == 202
+    assert (
+        json.loads(lambda_response["body"])
+        == [{"StatusCode": 202, "Message": "Queued"}] * 2
+    )
+    put_events.assert_not_called()
+    assert len(event_queue.messages) == 2
+
+    # And when the queue is drained
+    with patch.object(
+        analytics.pinpoint, "put_events", side_effect=accept_events
+    ) as put_events:
+        response = analytics.queue_handler(event_queue.drain(), "")
+
+    # Then all the events are published in one request with their original timestamp
+    assert response == {"batchItemFailures": []}
+    put_events.assert_called_once()
+    events_request = put_events.call_args.kwargs["EventsRequest"]
+    pinpoint_events = events_request["BatchItem"]["anonymous"]["Events"]
+    assert len(pinpoint_events) == 2
+    assert all(event["Timestamp"] == timestamp for event in pinpoint_events.values())
+    assert not event_queue.messages
+
+
+@pytest.mark.parametrize("apigw_event", ["pinpoint-test-event.json"], indirect=True)
+def test_async_event(apigw_event, event_queue, monkeypatch):
+    # Given the analytics Lambda in async mode
+    monkeypatch.setattr(analytics, "ASYNC_EVENTS", True)
+    monkeypatch.setattr(analytics, "event_queue", event_queue)
+    # When a single event is posted
+    lambda_response = analytics.handler(apigw_event, "")
+    # Then it's queued
+    assert lambda_response["statusCode"] == 202
+    assert json.loads(lambda_response["body"]) == "Queued"
+
+
+def test_enqueue_events_keeps_ids(event_queue):
+    # Given events with and without IDs
+    events = [{**VALID_EVENT, "id": "a"}, VALID_EVENT, {"name": "invalid"}]
+
+    # When they're queued
+    results = analytics.enqueue_events(events, event_queue)
+
+    # Then only the valid events are queued, each with an ID
+    assert [result["StatusCode"] for result in results] == [202, 202, 400]
+    queued_events = [json.loads(message)["event"] for message in event_queue.messages]
+    assert queued_events[0]["id"] == "a"
+    assert queued_events[1]["id"]
+
+
+def test_enqueue_events_drops_ignored_properties(event_queue):
+    # Given an event with properties that aren't attributes or metrics
+    event = {
+        "name": "event",
+        "properties": {"flag": True, "count": 1, "list": [1] * 1000, "null": None},
+    }
+
+    # When it's queued
+    analytics.enqueue_events([event], event_queue)
+
+    # Then only its attributes and metrics are queued
+    queued_event = json.loads(event_queue.messages[0])["event"]
+    assert queued_event["properties"] == {"flag": "True", "count": 1}
+    assert analytics.process_event(queued_event) == analytics.process_event(event)
+
+
+def test_queue_handler_reports_failures(event_queue):
+    # Given queued events and a message that isn't valid
+    analytics.enqueue_events([VALID_EVENT, VALID_EVENT], event_queue)
+    sqs_event = event_queue.drain()
+    sqs_event["Records"].append({"messageId": "invalid", "body": "{"})
+
+    # When Pinpoint fails
+    with patch.object(
+        analytics.pinpoint, "put_events", side_effect=Exception("Throttled")
+    ):
+        response = analytics.queue_handler(sqs_event, "")
+
+    # Then only the valid messages are retried
+    assert response == {
+        "batchItemFailures": [
+            {"itemIdentifier": record["messageId"]}
+            for record in sqs_event["Records"][:2]
+        ]
+    }
+
+
+def test_sqs_event_queue(sqs_client):
+    # Given an SQS queue
+    queue_url = sqs_client.create_queue(QueueName="events")["QueueUrl"]
+    event_queue = analytics.SQSEventQueue(queue_url, sqs_client)
+    # When more messages are sent than fit in one batch
+    messages = [json.dumps({"i": i}) for i in range(25)]
+    errors = event_queue.send(messages)
+    # Then every message is queued
+    assert errors == [None] * 25
+    attributes = sqs_client.get_queue_attributes(
+        QueueUrl=queue_url, AttributeNames=["ApproximateNumberOfMessages"]
+    )
+    assert attributes["Attributes"]["ApproximateNumberOfMessages"] == "25"
+
+
+def test_sqs_event_queue_with_missing_queue(sqs_client):
+    # Given a queue that doesn't exist
+    event_queue = analytics.SQSEventQueue("missing", sqs_client)
+    # When messages are sent
+    errors = event_queue.send(["{}"])
+    # Then the error is returned for each message
+    assert len(errors) == 1 and errors[0]
+
+
+@pytest.mark.parametrize("apigw_event", ["pinpoint-queue-event.json"], indirect=True)
+def test_queue_handler(apigw_event):
+    with patch.object(
+        analytics.pinpoint, "put_events", side_effect=accept_events
+    ) as put_events:
+        response = analytics.queue_handler(apigw_event, "")
+
+    # The queued event should be published with the ID assigned when it was queued
+    assert response == {"batchItemFailures": []}
+    events_request = put_events.call_args.kwargs["EventsRequest"]
+    assert list(events_request["BatchItem"]["anonymous"]["Events"]) == [
+        analytics.get_event_id(
+            {"id": "8d6f1f9e-2f55-4c1e-9a53-0a1c6b8e3c51"},
+            os.environ.get("PinpointAppId", ""),
+        )
+    ]
@@ -1,3 +1,5 @@
+import base64
+import gzip
 import json
 import pytest
 import sys
@@ -7,6 +9,21 @@ sys.path.append("..")
 from src import app
 
 
+def get_body(lambda_response):
+    # Decompress the body if the response was compressed
+    body = lambda_response["body"]
+
+    if lambda_response["isBase64Encoded"]:
+        compressed_body = base64.b64decode(body)
+
+        if lambda_response["headers"]["Content-Encoding"] == "br":
+            body = app.brotli.decompress(compressed_body)
+        else:
+            body = gzip.decompress(compressed_body)
+
+    return json.loads(body)
+
+
 # Tests related to the main handler function
 @pytest.mark.parametrize(
     "apigw_event", ["dev.json", "prod.json", "query-params.json"], indirect=True
@@ -15,14 +32,22 @@ def test_lambda_handler(apigw_event, dynamodb_table):
     # Given an API Gateway event
     # When the Lambda function is called with GET /
     lambda_response = app.handler(apigw_event, "")
-    body = json.loads(lambda_response["body"])
+    body = get_body(lambda_response)
 
     # Then a 200 response is returned with the DynamoDB table in the body
     assert lambda_response["statusCode"] == 200
-    assert lambda_response["headers"] == {
-        "Content-Type": "application/json",
-    }
+    assert (
+        lambda_response["headers"].items()
+        >= {
+            "Content-Type": "application/json",
+            "ETag": lambda_response["headers"]["ETag"],
+            "Cache-Control": app.CACHE_CONTROL,
+            "Vary": "Accept-Encoding",
+        }.items()
+    )
     assert type(body) is list and len(body) > 0
+    # And browsers revalidate it after the Lambda's TTL, while CloudFront keeps its own TTL
+    assert app.CACHE_CONTROL == "public, max-age=60, s-maxage=86400"
 
 
 @pytest.mark.parametrize("apigw_event", ["health.json"], indirect=True)
@@ -38,3 +63,235 @@ def test_health_check(apigw_event):
     }
     # The body isn't an empty string, but a string containing the empty string
     assert not lambda_response["body"]
+
+
+@pytest.mark.parametrize("apigw_event", ["dev.json"], indirect=True)
+def test_lambda_handler_with_limit(apigw_event, dynamodb_table):
+    # Given an API Gateway event with a limit
+    apigw_event["queryStringParameters"] = {"limit": "2"}
+    # When the Lambda function is called with GET /
+    lambda_response = app.handler(apigw_event, "")
+    body = get_body(lambda_response)
+
+    # Then a 200 response is returned with the first page and a cursor to the next
+    assert lambda_response["statusCode"] == 200
+    assert len(body["items"]) == 2
+    assert type(body["nextCursor"]) is str
+
+
+@pytest.mark.parametrize("apigw_event", ["query-params.json"], indirect=True)
+def test_lambda_handler_with_plain_format(apigw_event, dynamodb_table):
+    # Given an API Gateway event requesting plain JSON
+    apigw_event["queryStringParameters"]["format"] = "plain"
+    # When the Lambda function is called with GET /
+    lambda_response = app.handler(apigw_event, "")
+    body = json.loads(lambda_response["body"])
+
+    # Then the services don't contain DynamoDB types
+    assert lambda_response["statusCode"] == 200
+    assert body[0]["Name"] == "Lambda"
+    assert body[0]["Price"] == 2e-7
+
+
+@pytest.mark.parametrize("apigw_event", ["dev.json"], indirect=True)
+def test_lambda_handler_with_invalid_format(apigw_event, dynamodb_table):
+    # Given an API Gateway event with an unknown format
+    apigw_event["queryStringParameters"] = {"format": "xml"}
+    # When the Lambda function is called with GET /
+    lambda_response = app.handler(apigw_event, "")
+    # Then a 400 response is returned
+    assert lambda_response["statusCode"] == 400
+
+
+@pytest.mark.parametrize("apigw_event", ["query-params.json"], indirect=True)
+def test_lambda_handler_with_matching_etag(apigw_event, dynamodb_table):
+    # Given the ETag of a previous response
+    etag = app.handler(apigw_event, "")["headers"]["ETag"]
+
+    for if_none_match in [etag, f"W/{etag}", f'"other", {etag}', "*"]:
+        # When the Lambda function is called with If-None-Match
+        apigw_event["headers"]["if-none-match"] = if_none_match
+        lambda_response = app.handler(apigw_event, "")
+
+        # Then a 304 response is returned with an empty body
+        assert lambda_response["statusCode"] == 304
+        assert lambda_response["headers"]["ETag"] == etag
+        assert lambda_response["body"] == ""
+
+
+@pytest.mark.parametrize("apigw_event", ["query-params.json"], indirect=True)
+def test_lambda_handler_with_stale_etag(apigw_event, dynamodb_table):
+    # Given an ETag that doesn't match the current response
+    apigw_event["headers"]["if-none-match"] = '"stale"'
+    # When the Lambda function is called with If-None-Match
+    lambda_response = app.handler(apigw_event, "")
+    # Then a 200 response is returned with the full body
+    assert lambda_response["statusCode"] == 200
+    assert len(json.loads(lambda_response["body"])) > 0
+
+
+@pytest.mark.parametrize("apigw_event", ["dev.json"], indirect=True)
+def test_lambda_handler_with_compression(apigw_event, dynamodb_table):
+    # Given an API Gateway event that accepts gzip and a large response
+    apigw_event["headers"]["Accept-Encoding"] = "gzip;q=0.8, identity"
+    app.MIN_COMPRESSION_SIZE, min_compression_size = 0, app.MIN_COMPRESSION_SIZE
+
+    try:
+        # When the Lambda function is called with GET /
+        lambda_response = app.handler(apigw_event, "")
+    finally:
+        app.MIN_COMPRESSION_SIZE = min_compression_size
+
+    # Then a base64-encoded gzip body is returned
+    assert lambda_response["statusCode"] == 200
+    assert lambda_response["isBase64Encoded"]
+    assert lambda_response["headers"]["Content-Encoding"] == "gzip"
+    assert lambda_response["headers"]["ETag"].endswith('-gzip"')
+    assert len(get_body(lambda_response)) == len(dynamodb_table)
+
+    # And a revalidated response has no body to decode
+    apigw_event["headers"]["if-none-match"] = lambda_response["headers"]["ETag"]
+    app.MIN_COMPRESSION_SIZE = 0
+
+    try:
+        lambda_response = app.handler(apigw_event, "")
+    finally:
+        app.MIN_COMPRESSION_SIZE = min_compression_size
+
+    assert lambda_response["statusCode"] == 304
+    assert not lambda_response["isBase64Encoded"]
+    assert "Content-Encoding" not in lambda_response["headers"]
+    assert lambda_response["body"] == ""
+
+
+@pytest.mark.parametrize("apigw_event", ["dev.json"], indirect=True)
+def test_lambda_handler_without_compression(apigw_event, dynamodb_table):
+    # Given an API Gateway event that doesn't accept any supported encoding
+    apigw_event["headers"]["Accept-Encoding"] = "gzip;q=0, deflate"
+    # When the Lambda function is called with GET /
+    lambda_response = app.handler(apigw_event, "")
+    # Then the body isn't compressed
+    assert not lambda_response["isBase64Encoded"]
+    assert "Content-Encoding" not in lambda_response["headers"]
+    assert len(json.loads(lambda_response["body"])) == len(dynamodb_table)
+
+
+@pytest.mark.parametrize("apigw_event", ["service.json"], indirect=True)
+def test_lambda_handler_with_service(apigw_event, dynamodb_client, dynamodb_table):
+    # Given a service stored under the ID derived from its name
+    service = {**dynamodb_table[1], "Id": {"S": app.get_service_id("Auto Scaling")}}
+    dynamodb_client.put_item(TableName="test-table", Item=service)
+    # When the Lambda function is called with GET /services/{name}
+    lambda_response = app.handler(apigw_event, "")
+    body = json.loads(lambda_response["body"])
+
+    # Then a 200 response is returned with only the public attributes of the service
+    assert lambda_response["statusCode"] == 200
+    assert lambda_response["headers"]["Cache-Control"] == app.CACHE_CONTROL
+    assert body["Name"] == {"S": "Auto Scaling"}
+    assert "NameLower" not in body
+
+    # And the response is revalidated with its ETag
+    apigw_event["headers"]["if-none-match"] = lambda_response["headers"]["ETag"]
+    lambda_response = app.handler(apigw_event, "")
+    assert lambda_response["statusCode"] == 304
+    assert lambda_response["body"] == ""
+
+
+@pytest.mark.parametrize("apigw_event", ["service.json"], indirect=True)
+def test_lambda_handler_with_service_plain_format(
+    apigw_event, dynamodb_client, dynamodb_table
+):
+    # Given a service stored under the ID derived from its name
+    service = {**dynamodb_table[1], "Id": {"S": app.get_service_id("Auto Scaling")}}
+    dynamodb_client.put_item(TableName="test-table", Item=service)
+    # When the Lambda function is called with format=plain
+    apigw_event["queryStringParameters"] = {"format": "plain"}
+    lambda_response = app.handler(apigw_event, "")
+    # Then the service's attributes are plain JSON values
+    assert lambda_response["statusCode"] == 200
+    assert json.loads(lambda_response["body"])["Price"] == 0
+
+
+@pytest.mark.parametrize("apigw_event", ["service.json"], indirect=True)
+def test_lambda_handler_with_missing_service(apigw_event, dynamodb_table):
+    # Given a service that isn't in the table (or still has a random ID)
+    apigw_event["pathParameters"]["name"] = "Lambda"
+    # When the Lambda function is called with GET /services/{name}
+    lambda_response = app.handler(apigw_event, "")
+    # Then a 404 response is returned
+    assert lambda_response["statusCode"] == 404
+    assert json.loads(lambda_response["body"]) == 'Service "Lambda" not found'
+
+
+@pytest.mark.parametrize("apigw_event", ["services.json"], indirect=True)
+def test_lambda_handler_with_services(apigw_event, dynamodb_client, dynamodb_table):
+    # Given services stored under the IDs derived from their names
+    for item in dynamodb_table:
+        service = {**item, "Id": {"S": app.get_service_id(item["Name"]["S"])}}
+        dynamodb_client.put_item(TableName="test-table", Item=service)
+
+    # When the Lambda function is called with GET /services
+    lambda_response = app.handler(apigw_event, "")
+    body = json.loads(lambda_response["body"])
+
+    # Then a 200 response is returned with the services in the requested order
+    assert lambda_response["statusCode"] == 200
+    assert lambda_response["headers"]["Cache-Control"] == app.CACHE_CONTROL
+    assert [service["Name"]["S"] for service in body] == ["EC2", "Lambda"]
+
+    # And the response is revalidated with its ETag
+    apigw_event["headers"]["if-none-match"] = lambda_response["headers"]["ETag"]
+    lambda_response = app.handler(apigw_event, "")
+    assert lambda_response["statusCode"] == 304
+    assert lambda_response["body"] == ""
+
+
+@pytest.mark.parametrize("apigw_event", ["services.json"], indirect=True)
+def test_lambda_handler_with_services_without_names(apigw_event, dynamodb_table):
+    # Given an API Gateway event without names
+    apigw_event["queryStringParameters"] = None
+    # When the Lambda function is called with GET /services
+    lambda_response = app.handler(apigw_event, "")
+    # Then a 400 response is returned
+    assert lambda_response["statusCode"] == 400
+
+
+@pytest.mark.parametrize("apigw_event", ["query.json"], indirect=True)
+def test_lambda_handler_with_queries(apigw_event, dynamodb_table):
+    # Given an API Gateway event with several queries
+    # When the Lambda function is called with POST /query
+    lambda_response = app.handler(apigw_event, "")
+    body = json.loads(lambda_response["body"])
+
+    # Then a 200 response is returned with the results of each query in order
+    assert lambda_response["statusCode"] == 200
+    assert [len(result["services"]) for result in body] == [2, 1, 2]
+    assert body[1]["services"][0]["Name"] == "Lambda"
+
+
+@pytest.mark.parametrize("apigw_event", ["query.json"], indirect=True)
+def test_lambda_handler_with_some_invalid_queries(apigw_event, dynamodb_table):
+    # Given an API Gateway event with valid and invalid queries
+    apigw_event["body"] = json.dumps(
+        [{"category": "free"}, {"min-price": "free"}, {"free-tier": ""}]
+    )
+    # When the Lambda function is called with POST /query
+    lambda_response = app.handler(apigw_event, "")
+    body = json.loads(lambda_response["body"])
+
+    # Then a 207 response is returned with an error in place of the invalid query
+    assert lambda_response["statusCode"] == 207
+    assert len(body[0]["services"]) == 2
+    assert body[1] == {"error": 'min-price "free" is not numeric'}
+    assert len(body[2]["services"]) == 1
+
+
+@pytest.mark.parametrize("apigw_event", ["query.json"], indirect=True)
+def test_lambda_handler_with_invalid_queries(apigw_event, dynamodb_table):
+    # Given an API Gateway event whose body isn't an array of queries
+    apigw_event["body"] = '{"category": "free"}'
+    # When the Lambda function is called with POST /query
+    lambda_response = app.handler(apigw_event, "")
+    # Then a 400 response is returned
+    assert lambda_response["statusCode"] == 400
@@ -1,10 +1,22 @@
+import base64
+from boto3.dynamodb.types import TypeDeserializer
+import brotli
+from decimal import Decimal
+import gzip
+import json
+import os
 import pytest
 import sys
+import time
+from unittest.mock import patch
 
 sys.path.append("..")
 
 from src import app
 
+# Timing comparisons depend on the machine, so only run them when requested
+RUN_BENCHMARKS = os.environ.get("RUN_BENCHMARKS") is not None
+
 
 def filter_item(item):
     # Only return the columns projected in each DynamoDB query
@@ -15,6 +27,18 @@ def filter_item(item):
     }
 
 
+def put_services_by_name(dynamodb_client, table_name, items):
+    # Store the items under the IDs derived from their names, like populate-dynamodb-table.py
+    services = [
+        {**item, "Id": {"S": app.get_service_id(item["Name"]["S"])}} for item in items
+    ]
+
+    for service in services:
+        dynamodb_client.put_item(TableName=table_name, Item=service)
+
+    return services
+
+
 # Tests related to helper methods within the Lambda function
 def test_scan_table(dynamodb_table, table_name):
     # Given a DynamoDB table
@@ -26,6 +50,36 @@ def test_scan_table(dynamodb_table, table_name):
     assert items == projected_items
 
 
+def test_scan_table_with_segments(dynamodb_table, table_name):
+    # Given a DynamoDB table
+    # When scanned in parallel segments
+    items = app.scan_table(table_name, total_segments=3)
+    # Then every item is returned exactly once
+    projected_items = [filter_item(item) for item in dynamodb_table]
+    assert len(items) == len(projected_items)
+    assert sorted(items, key=lambda item: item["Id"]["S"]) == projected_items
+
+
+def test_scan_table_across_pages(dynamodb_client, dynamodb_table, table_name):
+    # Given a DynamoDB table larger than 1 MB
+    large_items = [
+        {
+            "Id": {"S": f"large-{i}"},
+            "Name": {"S": f"Large {i}"},
+            "Description": {"S": "x" * 300_000},
+        }
+        for i in range(5)
+    ]
+
+    for item in large_items:
+        dynamodb_client.put_item(TableName=table_name, Item=item)
+
+    # When scanned
+    items = app.scan_table(table_name)
+    # Then all the pages are returned instead of only the first 1 MB
+    assert len(items) == len(dynamodb_table) + len(large_items)
+
+
 def test_query_all_services(dynamodb_table, table_name):
     # Given a DynamoDB table
     # When a GET / request is called
@@ -89,6 +143,90 @@ def test_query_services_by_category(dynamodb_table):
     ]
 
 
+def test_query_services_by_category_with_index(dynamodb_table):
+    # Given a DynamoDB table and query parameters
+    query_params = {
+        "category": "free",
+    }
+
+    # When a GET / request is called with those query parameters
+    items = app.get_aws_services(query_params)
+
+    # Then the category's partition in the price index is returned, sorted by price
+    assert (
+        items
+        == [
+            filter_item(item)
+            for item in dynamodb_table
+            if item["Name"]["S"] in ["Auto Scaling", "Lambda"]
+        ][::-1]
+    )
+
+
+def test_query_services_by_categories_with_index(dynamodb_table, table_name):
+    # Given query parameters with several categories
+    query_params = {"category": "trial,free"}
+
+    # When a GET / request is called with those query parameters
+    with patch.object(
+        app, "query_price_index", wraps=app.query_price_index
+    ) as query_price_index:
+        items = app.query_aws_services(table_name, query_params, use_local=False)
+
+    # Then each category's partition is queried and merged in order of price
+    assert sorted(call.args[1] for call in query_price_index.call_args_list) == [
+        "free",
+        "trial",
+    ]
+    assert [item["Name"]["S"] for item in items] == ["Auto Scaling", "Lambda", "EC2"]
+
+
+@pytest.mark.parametrize("category", ["", " , "])
+def test_query_services_without_categories(dynamodb_table, table_name, category):
+    with pytest.raises(Exception):
+        app.query_aws_services(table_name, {"category": category})
+
+
+@pytest.mark.parametrize(
+    "query_params,expected_names",
+    [
+        ({"category": "free", "min-price": "1e-7"}, ["Lambda"]),
+        ({"category": "free", "max-price": "0"}, ["Auto Scaling"]),
+        (
+            {"category": "free", "min-price": "0", "max-price": "1"},
+            ["Auto Scaling", "Lambda"],
+        ),
+        ({"category": "free", "min-price": "1", "max-price": "0"}, []),
+        ({"category": "free", "query": "code"}, ["Lambda"]),
+        ({"category": "free", "free-tier": ""}, ["Lambda"]),
+        ({"category": "paid", "query": "code"}, []),
+    ],
+)
+def test_query_price_index_with_residual_filters(
+    dynamodb_table, table_name, query_params, expected_names
+):
+    # Given a DynamoDB table and query parameters with a category
+    # When the query is planned
+    # Then the price index is used and the remaining filters are applied afterwards
+    assert app.plan_query(query_params["category"], use_local=False) == "index"
+    items = app.query_aws_services(table_name, query_params, use_local=False)
+    assert [item["Name"]["S"] for item in items] == expected_names
+
+
+@pytest.mark.parametrize(
+    "category,use_index,use_local,expected_plan",
+    [
+        ("free", True, False, "index"),
+        ("free", False, False, "scan"),
+        (None, True, False, "scan"),
+        ("free", True, True, "snapshot"),
+        (None, True, True, "snapshot"),
+    ],
+)
+def test_plan_query(category, use_index, use_local, expected_plan):
+    assert app.plan_query(category, use_index, use_local) == expected_plan
+
+
 def test_query_services_by_min_price(dynamodb_table):
     # Given a DynamoDB table and query parameters
     query_params = {
@@ -150,6 +288,360 @@ def test_query_services_by_free_tier(dynamodb_table):
     ]
 
 
+def test_cached_query(dynamodb_client, dynamodb_table, table_name):
+    # Given a query that was already called
+    query_params = {"query": "code"}
+    items = app.get_aws_services(query_params)
+
+    # When the table changes without a new catalog version
+    for item in dynamodb_table:
+        dynamodb_client.delete_item(
+            TableName=table_name, Key={"Id": item["Id"], "Name": item["Name"]}
+        )
+
+    # Then the same query is answered from the cache
+    assert app.get_aws_services({"query": "CODE"}) is items
+    assert app.get_aws_services(query_params, use_cache=False) == []
+
+
+def test_cache_invalidated_by_catalog_version(
+    dynamodb_client, dynamodb_table, table_name, catalog_cache
+):
+    # Given a cached query and a stamped catalog version
+    dynamodb_client.put_item(
+        TableName=table_name,
+        Item={**app.CATALOG_VERSION_KEY, "Version": {"S": "1"}},
+    )
+    items = app.get_aws_services(None)
+    assert len(items) == len(dynamodb_table)
+
+    # When the catalog version changes after the TTL
+    dynamodb_client.delete_item(
+        TableName=table_name,
+        Key={"Id": dynamodb_table[0]["Id"], "Name": dynamodb_table[0]["Name"]},
+    )
+    dynamodb_client.put_item(
+        TableName=table_name,
+        Item={**app.CATALOG_VERSION_KEY, "Version": {"S": "2"}},
+    )
+    catalog_cache.ttl = 0
+
+    # Then the query is read from DynamoDB again
+    assert len(app.get_aws_services(None)) == len(dynamodb_table) - 1
+    assert catalog_cache.version == "2"
+
+
+def test_cache_expires_after_max_age():
+    # Given a cache with a catalog version that never changes
+    cache = app.CatalogCache(max_size=2, ttl=60, max_age=0)
+    cache.version = "1"
+    # When an entry is older than the max age
+    cache.put("a", [1])
+    # Then it's no longer returned
+    assert cache.get("a") is None
+
+
+def test_cache_evicts_least_recently_used():
+    # Given a full cache
+    cache = app.CatalogCache(max_size=2, ttl=60)
+    cache.put("a", [1])
+    cache.put("b", [2])
+
+    # When an entry is read and then another entry is added
+    assert cache.get("a") == [1]
+    cache.put("c", [3])
+
+    # Then the least recently used entry is evicted
+    assert cache.get("b") is None
+    assert cache.get("a") == [1]
+    assert cache.get("c") == [3]
+
+
+def test_cache_expires_without_version():
+    # Given a cache without a catalog version
+    cache = app.CatalogCache(max_size=2, ttl=0)
+    # When an entry is older than the TTL
+    cache.put("a", [1])
+    # Then it's no longer returned
+    assert cache.get("a") is None
+
+
+@pytest.mark.parametrize(
+    "query_params,expected_key",
+    [
+        (None, ()),
+        ({}, ()),
+        (
+            {"query": "Code", "free-tier": "true", "category": "free"},
+            (("category", "free"), ("free-tier", ""), ("query", "code")),
+        ),
+        ({"category": "trial, free,trial"}, (("category", "free,trial"),)),
+    ],
+)
+def test_cache_key(query_params, expected_key):
+    assert app.get_cache_key(query_params) == expected_key
+
+
+def get_all_pages(query_params):
+    # Follow nextCursor until the last page
+    pages = []
+    cursor = None
+
+    while True:
+        page_params = {**query_params}
+
+        if cursor is not None:
+            page_params["cursor"] = cursor
+
+        page = app.get_aws_services_page(page_params)
+        pages.append(page["items"])
+        cursor = page["nextCursor"]
+
+        if cursor is None:
+            return pages
+
+
+def test_paginate_table(dynamodb_table, table_name):
+    # Given a DynamoDB table that isn't cached
+    # When paging through GET / one item at a time
+    pages = get_all_pages({"limit": "1"})
+    # Then every item is returned across the pages
+    items = [item for page in pages for item in page]
+    assert all(len(page) <= 1 for page in pages)
+    assert items == app.scan_table(table_name)
+    # And the catalog isn't loaded into memory
+    assert app.get_cached_services(None) is None
+
+
+@pytest.mark.parametrize("is_cached", [False, True])
+@pytest.mark.parametrize("limit", [1, 2, 3, 4, 5])
+def test_paginate_without_empty_pages(
+    dynamodb_client, dynamodb_table, table_name, is_cached, limit
+):
+    # Given a table with a catalog version, which is filtered out of the pages
+    dynamodb_client.put_item(
+        TableName=table_name,
+        Item={**app.CATALOG_VERSION_KEY, "Version": {"S": "1"}},
+    )
+
+    if is_cached:
+        app.get_aws_services(None)
+
+    # When paging through GET /
+    pages = get_all_pages({"limit": str(limit)})
+
+    # Then every page is full except the last one, which is never empty
+    assert [len(page) for page in pages[:-1]] == [limit] * (len(pages) - 1)
+    assert 0 < len(pages[-1]) <= limit
+    assert [item for page in pages for item in page] == app.scan_table(table_name)
+
+
+def test_paginate_cached_table(dynamodb_table):
+    # Given a DynamoDB table that's already cached
+    services = app.get_aws_services(None)
+    # When paging through GET /
+    pages = get_all_pages({"limit": "3"})
+    # Then the cached list is split into pages
+    assert pages == [services[:3], services[3:]]
+
+
+def test_paginate_query(dynamodb_table):
+    # Given query parameters
+    query_params = {"max-price": "1"}
+    # When paging through GET / with those query parameters
+    pages = get_all_pages({**query_params, "limit": "2"})
+    # Then the filtered items are split into pages
+    assert pages == [
+        app.get_aws_services(query_params)[:2],
+        app.get_aws_services(query_params)[2:],
+    ]
+
+
+def test_page_without_limit(dynamodb_table):
+    # Given a cursor without a limit
+    cursor = app.encode_cursor({"offset": 1})
+    # When a GET / request is called with that cursor
+    page = app.get_aws_services_page({"min-price": "0", "cursor": cursor})
+    # Then the rest of the items are returned on one page
+    assert len(page["items"]) == len(dynamodb_table) - 1
+    assert page["nextCursor"] is None
+
+
+@pytest.mark.parametrize(
+    "query_params",
+    [
+        {"limit": "0"},
+        {"limit": "-1"},
+        {"limit": "1.5"},
+        {"limit": str(app.MAX_PAGE_SIZE + 1)},
+        {"cursor": "not a cursor"},
+        {"cursor": app.encode_cursor({"offset": -1})},
+        {"cursor": app.encode_cursor([1, 2])},
+        {"query": "code", "cursor": app.encode_cursor({"key": {}})},
+    ],
+)
+def test_invalid_page(dynamodb_table, query_params):
+    with pytest.raises(Exception):
+        app.get_aws_services_page(query_params)
+
+
+def test_deserialize_services(dynamodb_table):
+    # Given items from DynamoDB
+    items = app.get_aws_services({"category": "free"})
+    # When they're deserialized
+    services = app.deserialize_services(items)
+    # Then the attribute values are converted to plain JSON
+    assert services == [
+        {
+            "Id": "1",
+            "Name": "Auto Scaling",
+            "Description": "Automatically scale the number of EC2 instances with demand",
+            "Price": 0,
+            "Unit": "group",
+            "Category": "free",
+            "FreeTier": None,
+        },
+        {
+            "Id": "0",
+            "Name": "Lambda",
+            "Description": "Run code in under 15 minutes",
+            "Price": 2e-7,
+            "Unit": "invocation",
+            "Category": "free",
+            "FreeTier": 1000000,
+        },
+    ]
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        ({"S": "text"}, "text"),
+        ({"N": "-3"}, -3),
+        ({"N": "3.14"}, 3.14),
+        ({"N": "1E+6"}, 1000000.0),
+        ({"NULL": True}, None),
+        ({"BOOL": False}, False),
+        ({"L": [{"N": "1"}, {"S": "2"}]}, [1, "2"]),
+        ({"M": {"a": {"M": {"b": {"NULL": True}}}}}, {"a": {"b": None}}),
+    ],
+)
+def test_deserialize_value(value, expected):
+    assert app.deserialize_value(value) == expected
+
+
+def deserialize_with_boto3(items):
+    # Convert boto3's Decimals to floats to compare with deserialize_services
+    type_deserializer = TypeDeserializer()
+    return [
+        {
+            key: float(value) if isinstance(value, Decimal) else value
+            for key, value in (
+                (key, type_deserializer.deserialize(value))
+                for key, value in item.items()
+            )
+        }
+        for item in items
+    ]
+
+
+def test_deserializer_matches_boto3(dynamodb_table):
+    # Given items from DynamoDB
+    items = [filter_item(item) for item in dynamodb_table]
+    # When they're deserialized with boto3 and deserialize_services
+    # Then both produce the same values
+    assert app.deserialize_services(items) == deserialize_with_boto3(items)
+
+
+@pytest.mark.skipif(not RUN_BENCHMARKS, reason="set RUN_BENCHMARKS to run")
+def test_benchmark_deserializer(dynamodb_table):
+    # Given a large list of items
+    items = [filter_item(item) for item in dynamodb_table] * 5_000
+    type_deserializer = TypeDeserializer()
+
+    # When they're deserialized with boto3 and deserialize_services (best of 3 runs, so that
+    # garbage collection pauses don't skew the results)
+    boto3_time = app_time = float("inf")
+
+    for _ in range(3):
+        start = time.perf_counter()
+        [
+            {key: type_deserializer.deserialize(value) for key, value in item.items()}
+            for item in items
+        ]
+        boto3_time = min(boto3_time, time.perf_counter() - start)
+        start = time.perf_counter()
+        app.deserialize_services(items)
+        app_time = min(app_time, time.perf_counter() - start)
+
+    # Then deserialize_services is faster
+    print(f"{len(items)=} boto3={boto3_time * 1000:.1f}ms app={app_time * 1000:.1f}ms")
+    assert app_time < boto3_time
+
+
+def test_services_response_cached(dynamodb_client, dynamodb_table, table_name):
+    # Given a GET / response
+    body, etag = app.get_services_response({"category": "free"})
+
+    # When the table is changed without a new catalog version
+    for item in dynamodb_table:
+        dynamodb_client.delete_item(
+            TableName=table_name, Key={"Id": item["Id"], "Name": item["Name"]}
+        )
+
+    # Then the same body and ETag are returned without querying DynamoDB
+    assert app.get_services_response({"category": "free"}) == (body, etag)
+
+
+def test_services_response_etag_is_stable(dynamodb_table, catalog_cache):
+    # Given a GET / response
+    body, etag = app.get_services_response({"format": "plain"})
+    # When the response is built again in a new container
+    catalog_cache.clear()
+    # Then the ETag is the same and differs from other responses
+    assert app.get_services_response({"format": "plain"}) == (body, etag)
+    assert app.get_services_response(None)[1] != etag
+
+
+@pytest.mark.parametrize(
+    "accept_encoding,expected_encoding",
+    [
+        (None, None),
+        ("", None),
+        ("identity", None),
+        ("deflate, gzip", "gzip"),
+        ("GZIP;q=0.5", "gzip"),
+        ("gzip;q=0", None),
+        ("*", app.CONTENT_ENCODINGS[0]),
+        ("gzip;q=1, br;q=0.1", "gzip"),
+        ("gzip, deflate, br", app.CONTENT_ENCODINGS[0]),
+    ],
+)
+def test_choose_content_encoding(accept_encoding, expected_encoding):
+    assert app.choose_content_encoding(accept_encoding) == expected_encoding
+
+
+def test_compressed_response_cached(dynamodb_table):
+    # Given a compressed GET / response
+    body, etag = app.get_compressed_response(None, "gzip")
+    # When the same response is requested again
+    # Then the cached compressed bytes are returned
+    assert app.get_compressed_response(None, "gzip") == (body, etag)
+    assert gzip.decompress(base64.b64decode(body)).decode() == (
+        app.get_services_response(None)[0]
+    )
+
+
+def test_brotli_response(dynamodb_table):
+    # Given a brotli-compressed GET / response
+    body, etag = app.get_compressed_response(None, "br")
+    # Then it decompresses to the uncompressed response
+    assert etag.endswith('-br"')
+    assert brotli.decompress(base64.b64decode(body)).decode() == (
+        app.get_services_response(None)[0]
+    )
+
+
 @pytest.mark.parametrize(
     "num_str", ["0", "-0", "1", "3.14", "-2e-3", "6.8e1", "infinity", "nan"]
 )
@@ -168,3 +660,176 @@ def test_invalid_numbers(num_str):
     is_num = app.is_number(num_str)
     # Then it should return false
     assert not is_num
+
+
+def test_get_services_by_name(dynamodb_client, dynamodb_table, table_name):
+    # Given services stored under the IDs derived from their names
+    services = put_services_by_name(dynamodb_client, table_name, dynamodb_table)
+    names = ["EC2", "Missing", "Lambda", "EC2"]
+    # When they're fetched by name
+    items = app.get_services_by_name(table_name, names)
+    # Then they're returned in the requested order, with None for missing services
+    assert items == [
+        filter_item(services[2]),
+        None,
+        filter_item(services[0]),
+        filter_item(services[2]),
+    ]
+
+
+def test_get_services_by_name_in_chunks(dynamodb_client, dynamodb_table, table_name):
+    # Given more services than fit in one BatchGetItem request
+    services = put_services_by_name(
+        dynamodb_client,
+        table_name,
+        [
+            {**dynamodb_table[0], "Name": {"S": f"Service {i}"}}
+            for i in range(app.BATCH_GET_LIMIT * 2 + 1)
+        ],
+    )
+    names = [service["Name"]["S"] for service in reversed(services)]
+    batch_get_item = app.dynamodb.batch_get_item
+    num_keys = []
+
+    def unprocess_half(**kwargs):
+        # Only read half of the keys the first time, like a throttled request
+        request = kwargs["RequestItems"][table_name]
+        keys = request["Keys"]
+        num_keys.append(len(keys))
+
+        if len(keys) < app.BATCH_GET_LIMIT:
+            return batch_get_item(**kwargs)
+
+        response = batch_get_item(
+            **{**kwargs, "RequestItems": {table_name: {**request, "Keys": keys[::2]}}}
+        )
+        response["UnprocessedKeys"] = {table_name: {**request, "Keys": keys[1::2]}}
+        return response
+
+    # When they're fetched by name and DynamoDB leaves some keys unprocessed
+    with patch.object(app.dynamodb, "batch_get_item", side_effect=unprocess_half):
+        with patch.object(app, "BASE_BACKOFF_DELAY", 0):
+            items = app.get_services_by_name(table_name, names)
+
+    # Then every chunk is capped and retried until all the services are read, in order
+    assert max(num_keys) == app.BATCH_GET_LIMIT
+    assert num_keys.count(app.BATCH_GET_LIMIT // 2) == 2
+    assert [item["Name"]["S"] for item in items] == names
+
+
+def test_get_services_by_name_from_snapshot(
+    dynamodb_client, dynamodb_table, table_name
+):
+    # Given a catalog snapshot that's already in memory
+    services = put_services_by_name(dynamodb_client, table_name, dynamodb_table[:2])
+    app.get_catalog_snapshot(table_name)
+
+    # When services are fetched by name
+    with patch.object(app.dynamodb, "batch_get_item") as batch_get_item:
+        items = app.get_services_by_name(table_name, ["Auto Scaling", "Lambda"])
+
+    # Then they're read from the snapshot instead of DynamoDB
+    batch_get_item.assert_not_called()
+    assert items == [filter_item(services[1]), filter_item(services[0])]
+
+
+@pytest.mark.parametrize("has_snapshot", [False, True])
+def test_get_services_by_name_before_migration(
+    dynamodb_table, table_name, has_snapshot
+):
+    # Given services that are still stored under their legacy IDs
+    if has_snapshot:
+        app.get_catalog_snapshot(table_name)
+
+    # When they're fetched by name, with or without a catalog snapshot
+    items = app.get_services_by_name(table_name, ["Config", "Lambda"])
+
+    # Then neither path finds them, like GET /services/{name}
+    assert items == [None, None]
+
+
+def test_batch_response_cached(dynamodb_client, dynamodb_table, table_name):
+    # Given a GET /services response
+    put_services_by_name(dynamodb_client, table_name, dynamodb_table)
+    body, etag = app.get_batch_response({"names": "EC2, Lambda", "format": "plain"})
+    assert [service["Name"] for service in json.loads(body)] == ["EC2", "Lambda"]
+
+    # When it's requested again
+    with patch.object(app.dynamodb, "batch_get_item") as batch_get_item:
+        response = app.get_batch_response({"names": "EC2, Lambda", "format": "plain"})
+
+    # Then the same body and ETag are returned without querying DynamoDB
+    batch_get_item.assert_not_called()
+    assert response == (body, etag)
+
+
+@pytest.mark.parametrize(
+    "query_params",
+    [
+        None,
+        {"names": ""},
+        {"names": " , "},
+        {"names": ",".join(["EC2"] * (app.MAX_BATCH_NAMES + 1))},
+        {"names": "EC2", "format": "xml"},
+    ],
+)
+def test_invalid_batch_request(dynamodb_table, query_params):
+    with pytest.raises(Exception):
+        app.get_batch_response(query_params)
+
+
+def test_run_queries(dynamodb_table):
+    # Given several queries, including equivalent ones
+    queries = [
+        {"category": "free"},
+        {"query": "CODE", "free-tier": "true"},
+        {"category": "free"},
+        {"query": "code", "free-tier": ""},
+    ]
+
+    # When they're run together
+    with patch.object(
+        app, "get_services_body", wraps=app.get_services_body
+    ) as get_services_body:
+        results = app.run_queries(queries)
+
+    # Then each unique query runs once, and the results are in the same order
+    assert get_services_body.call_count == 2
+    assert [result["services"] for result in results] == [
+        app.get_aws_services(query_parameters) for query_parameters in queries
+    ]
+    assert all(result["durationMs"] >= 0 for result in results)
+
+
+def test_run_queries_concurrently(dynamodb_table):
+    # Given queries that each take a while
+    def get_slow_services_body(query_parameters):
+        time.sleep(0.2)
+        return []
+
+    # When they're run together
+    start = time.perf_counter()
+
+    with patch.object(app, "get_services_body", side_effect=get_slow_services_body):
+        results = app.run_queries([{"category": category} for category in "abcd"])
+
+    # Then they take about as long as the slowest one
+    assert time.perf_counter() - start < 0.6
+    assert all(result["durationMs"] >= 200 for result in results)
+
+
+@pytest.mark.parametrize(
+    "request_body",
+    [
+        None,
+        "{",
+        '{"category": "free"}',
+        "[]",
+        json.dumps([{}] * (app.MAX_QUERIES + 1)),
+        '["free"]',
+        '[{"min-price": 1}]',
+    ],
+)
+def test_invalid_queries(request_body):
+    with pytest.raises(Exception):
+        app.parse_queries(request_body)
@@ -0,0 +1,124 @@
+from decimal import Decimal
+import pytest
+import sys
+
+sys.path.append("..")
+
+from src import app
+
+# Every combination of filters should match the PartiQL results exactly
+QUERY_PARAMS = [
+    {"query": "code"},
+    {"query": "CODE"},
+    {"query": "ec2"},
+    {"query": "in"},
+    {"query": "nothing matches this"},
+    {"category": "free"},
+    {"category": "trial"},
+    {"category": "paid"},
+    {"category": "unknown"},
+    {"category": "free,trial"},
+    {"category": "trial, paid ,trial"},
+    {"category": "paid,unknown"},
+    {"min-price": "0"},
+    {"min-price": "0.003"},
+    {"min-price": "10"},
+    {"min-price": "-1e3"},
+    {"max-price": "0"},
+    {"max-price": "2e-7"},
+    {"max-price": "1"},
+    {"free-tier": ""},
+    {"free-tier": "false"},
+    {"min-price": "0", "max-price": "1"},
+    {"min-price": "1", "max-price": "0"},
+    {"query": "the", "category": "free"},
+    {"query": "code", "free-tier": ""},
+    {"category": "free", "min-price": "0", "max-price": "1e-6"},
+    {"category": "free,paid,trial", "min-price": "1e-7", "max-price": "1"},
+    {"query": "code", "category": "free", "min-price": "0", "max-price": "1"},
+    {
+        "query": "code",
+        "category": "free",
+        "min-price": "0",
+        "max-price": "1",
+        "free-tier": "",
+    },
+]
+
+
+@pytest.mark.parametrize("use_index", [False, True])
+@pytest.mark.parametrize("query_params", QUERY_PARAMS)
+def test_local_query_matches_dynamodb(
+    dynamodb_table, table_name, query_params, use_index
+):
+    # Given a DynamoDB table and query parameters
+    # When the query is evaluated locally and by DynamoDB
+    local_items = app.query_aws_services(
+        table_name, query_params, use_index=use_index, use_local=True
+    )
+    remote_items = app.query_aws_services(
+        table_name, query_params, use_index=use_index, use_local=False
+    )
+    # Then both return the same items in the same order
+    assert local_items == remote_items
+
+
+def test_local_query_sorts_index_queries(dynamodb_table, table_name):
+    # Given a query that DynamoDB would answer using the price index
+    query_params = {"category": "free"}
+    # When the query is evaluated locally
+    items = app.query_aws_services(table_name, query_params, use_local=True)
+    # Then the items are sorted by price like the index
+    prices = [Decimal(item["Price"]["N"]) for item in items]
+    assert len(items) == 2
+    assert prices == sorted(prices)
+
+
+@pytest.mark.parametrize(
+    "query_params", [{"min-price": "abc"}, {"max-price": ""}, {"unknown": "param"}]
+)
+def test_local_query_with_invalid_params(dynamodb_table, table_name, query_params):
+    # Given invalid query parameters
+    # When the query is evaluated locally
+    # Then the same errors are raised as with DynamoDB
+    with pytest.raises(Exception):
+        app.query_aws_services(table_name, query_params, use_local=True)
+
+
+def test_catalog_snapshot_loaded_once(dynamodb_client, dynamodb_table, table_name):
+    # Given a catalog snapshot that was already loaded
+    snapshot = app.get_catalog_snapshot(table_name)
+
+    # When the table is changed without a new catalog version
+    dynamodb_client.delete_item(
+        TableName=table_name,
+        Key={"Id": dynamodb_table[0]["Id"], "Name": dynamodb_table[0]["Name"]},
+    )
+
+    # Then the same snapshot is reused
+    assert app.get_catalog_snapshot(table_name) is snapshot
+    assert len(
+        app.query_aws_services(table_name, {"min-price": "0"}, use_local=True)
+    ) == len(dynamodb_table)
+
+
+def test_stale_catalog_snapshot_reloaded(
+    dynamodb_client, dynamodb_table, table_name, catalog_cache
+):
+    # Given a catalog snapshot that was already loaded
+    app.get_catalog_snapshot(table_name)
+
+    # When the catalog version changes
+    dynamodb_client.delete_item(
+        TableName=table_name,
+        Key={"Id": dynamodb_table[0]["Id"], "Name": dynamodb_table[0]["Name"]},
+    )
+    dynamodb_client.put_item(
+        TableName=table_name,
+        Item={**app.CATALOG_VERSION_KEY, "Version": {"S": "2"}},
+    )
+    catalog_cache.ttl = 0
+
+    # Then the snapshot is reloaded from DynamoDB
+    items = app.query_aws_services(table_name, {"min-price": "0"}, use_local=True)
+    assert len(items) == len(dynamodb_table) - 1
@@ -0,0 +1,996 @@
+import argparse
+from botocore.exceptions import ClientError, EndpointConnectionError
+from concurrent.futures import ThreadPoolExecutor
+from importlib.util import module_from_spec, spec_from_file_location
+import json
+import os
+import pytest
+import sys
+from threading import Lock
+import time
+import tracemalloc
+from unittest.mock import patch
+
+# The script's name has hyphens, so it can't be imported normally
+SCRIPT_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "..", "populate-dynamodb-table.py"
+)
+spec = spec_from_file_location("populate_dynamodb_table", SCRIPT_PATH)
+populate = module_from_spec(spec)
+# Dataclasses look up their module while being created
+sys.modules[spec.name] = populate
+spec.loader.exec_module(populate)
+
+# Larger catalogs take a while to write to moto, so only benchmark them when requested
+RUN_BENCHMARKS = os.environ.get("RUN_BENCHMARKS") is not None
+
+
+@pytest.fixture(autouse=True)
+def populate_table_name(monkeypatch, table_name):
+    monkeypatch.setattr(populate, "TABLE_NAME", table_name)
+
+
+def make_local_services(num_services, start=0):
+    # Generate a synthetic catalog with the same shape as aws-services.json
+    return [
+        {
+            "Name": f"Service {i}",
+            "Description": f"Description {i}",
+            "Price": i % 100,
+            "Unit": "request",
+            "Category": ["free", "trial", "paid"][i % 3],
+        }
+        for i in range(start, start + num_services)
+    ]
+
+
+def to_remote_service(service, service_id):
+    return {
+        "Id": {"S": str(service_id)},
+        "Name": {"S": service["Name"]},
+        "NameLower": {"S": service["Name"].lower()},
+        "Description": {"S": service["Description"]},
+        "DescriptionLower": {"S": service["Description"].lower()},
+        "Price": {"N": str(service["Price"])},
+        "Unit": {"S": service["Unit"]},
+        "Category": {"S": service["Category"]},
+        "ContentHash": {"S": populate.get_content_hash(service)},
+    }
+
+
+def put_remote_services(dynamodb_client, table_name, services):
+    for chunk_start in range(0, len(services), populate.BATCH_WRITE_LIMIT):
+        chunk = services[chunk_start : chunk_start + populate.BATCH_WRITE_LIMIT]
+        dynamodb_client.batch_write_item(
+            RequestItems={
+                table_name: [{"PutRequest": {"Item": item}} for item in chunk]
+            }
+        )
+
+
+def scan_remote_services(dynamodb_client, table_name):
+    paginator = dynamodb_client.get_paginator("scan")
+    return [
+        item
+        for page in paginator.paginate(TableName=table_name)
+        for item in page["Items"]
+    ]
+
+
+def test_plan_changes(dynamodb_client, dynamodb_table):
+    # Given a JSON file that adds, updates, and removes services
+    local_services = [
+        {
+            "Name": "Lambda",
+            "Description": "Run code in under 15 minutes",
+            "Price": 2e-7,
+            "Unit": "invocation",
+            "Category": "free",
+            "FreeTier": 1e6,
+        },
+        {
+            "Name": "EC2",
+            "Description": "Servers in the cloud",
+            "Price": 7.5,
+            "Unit": "instance",
+            "Category": "trial",
+        },
+        {
+            "Name": "S3",
+            "Description": "Object-based cloud storage",
+            "Price": 0.02,
+            "Unit": "GB",
+            "Category": "trial",
+        },
+    ]
+    remote_services = populate.get_all_services(dynamodb_client)
+
+    # When the changes are planned
+    put_items, update_items, delete_items = populate.plan_changes(
+        local_services, remote_services
+    )
+
+    # Then only the differences are written, along with the missing content hashes
+    assert [item["Put"]["Item"]["Name"]["S"] for item in put_items] == ["S3"]
+    update_expressions = {
+        item["Update"]["Key"]["Name"]["S"]: item["Update"]["UpdateExpression"]
+        for item in update_items
+    }
+    assert update_expressions == {
+        "EC2": "SET Price = :price, ContentHash = :contenthash",
+        "Lambda": "SET ContentHash = :contenthash",
+    }
+    assert sorted(item["Delete"]["Key"]["Name"]["S"] for item in delete_items) == [
+        "Auto Scaling",
+        "Config",
+    ]
+
+
+def sync_catalog(dynamodb_client, table_name, num_services):
+    # Given a table with num_services services and a JSON file where 10% of the services
+    # changed, 5% are new, and 5% were removed
+    remote_services = [
+        to_remote_service(service, i)
+        for i, service in enumerate(make_local_services(num_services))
+    ]
+    put_remote_services(dynamodb_client, table_name, remote_services)
+    num_removed = num_services // 20
+    local_services = make_local_services(num_services, num_removed)
+
+    for service in local_services[: num_services // 10]:
+        service["Price"] += 0.5
+
+    # When the changes are planned
+    remote_services = scan_remote_services(dynamodb_client, table_name)
+    start = time.perf_counter()
+    put_items, update_items, delete_items = populate.plan_changes(
+        local_services, remote_services
+    )
+    elapsed = time.perf_counter() - start
+
+    # Then every change is found
+    assert len(put_items) == num_removed
+    assert len(update_items) == num_services // 10
+    assert len(delete_items) == num_removed
+    return elapsed
+
+
+def create_benchmark_table(dynamodb_client, monkeypatch, table_name):
+    dynamodb_client.create_table(
+        TableName=table_name,
+        KeySchema=[
+            {"AttributeName": "Id", "KeyType": "HASH"},
+            {"AttributeName": "Name", "KeyType": "RANGE"},
+        ],
+        AttributeDefinitions=[
+            {"AttributeName": "Id", "AttributeType": "S"},
+            {"AttributeName": "Name", "AttributeType": "S"},
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    monkeypatch.setattr(populate, "TABLE_NAME", table_name)
+
+
+def test_plan_changes_for_large_catalog(dynamodb_client, monkeypatch):
+    # Given a catalog with more services than fit in one scan page or chunk
+    create_benchmark_table(dynamodb_client, monkeypatch, "large-table")
+    # When the changes are planned
+    # Then every change is found
+    sync_catalog(dynamodb_client, "large-table", 400)
+
+
+@pytest.mark.skipif(not RUN_BENCHMARKS, reason="set RUN_BENCHMARKS to run")
+@pytest.mark.parametrize("num_services", [10_000, 100_000])
+def test_benchmark_plan_changes(dynamodb_client, monkeypatch, num_services, capsys):
+    # Compare against a catalog 10x smaller to show that planning scales linearly
+    elapsed_times = []
+
+    for i, size in enumerate([num_services // 10, num_services]):
+        table_name = f"benchmark-table-{i}"
+        create_benchmark_table(dynamodb_client, monkeypatch, table_name)
+        elapsed_times.append(sync_catalog(dynamodb_client, table_name, size))
+
+    small_elapsed, elapsed = elapsed_times
+
+    with capsys.disabled():
+        print(
+            f"\n{num_services // 10} services: {small_elapsed * 1000:.1f}ms, {num_services} services: {elapsed * 1000:.1f}ms"
+        )
+
+    # A quadratic diff would take ~100x longer
+    assert elapsed < small_elapsed * 30
+
+
+@pytest.mark.parametrize("total_segments", [1, 4])
+def test_get_all_services_reads_every_page(
+    dynamodb_client, dynamodb_table, table_name, total_segments, capsys
+):
+    # Given a table larger than a single 1 MB scan page
+    services = make_local_services(1_500)
+
+    for service in services:
+        service["Description"] = "x" * 1_000
+
+    put_remote_services(
+        dynamodb_client,
+        table_name,
+        [to_remote_service(service, f"big-{i}") for i, service in enumerate(services)],
+    )
+    dynamodb_client.put_item(
+        TableName=table_name,
+        Item={
+            "Id": {"S": populate.CATALOG_VERSION_ID},
+            "Name": {"S": populate.CATALOG_VERSION_ID},
+            "Version": {"S": "1"},
+        },
+    )
+
+    # When all the services are scanned
+    remote_services = populate.get_all_services(
+        dynamodb_client,
+        populate.HASH_PROJECTION,
+        total_segments,
+    )
+
+    # Then every service is returned once, without the catalog version or lowercase attributes
+    assert len(remote_services) == len(services) + len(dynamodb_table)
+    assert len({service["Name"]["S"] for service in remote_services}) == len(
+        remote_services
+    )
+    assert all("NameLower" not in service for service in remote_services)
+    assert f"Scanned {len(remote_services) + 1} items" in capsys.readouterr().out
+
+
+def test_get_all_services_with_missing_table(dynamodb_client, capsys):
+    assert populate.get_all_services(dynamodb_client, total_segments=2) is None
+    assert "scan client error" in capsys.readouterr().out
+
+
+def make_put_items(num_services):
+    services = make_local_services(num_services)
+    return populate.add_services(
+        populate.index_local_services(services), {s["Name"] for s in services}
+    )
+
+
+def transaction_canceled(reason_code):
+    return ClientError(
+        {
+            "Error": {"Code": "TransactionCanceledException", "Message": "Canceled"},
+            "CancellationReasons": [{"Code": "None"}, {"Code": reason_code}],
+        },
+        "TransactWriteItems",
+    )
+
+
+def test_perform_transaction_in_parallel(dynamodb_client, dynamodb_table, capsys):
+    # Given more items than fit in one transaction
+    put_items = make_put_items(250)
+    # moto's transactions aren't thread-safe (DynamoDB's are)
+    transact_write_items = dynamodb_client.transact_write_items
+    lock = Lock()
+
+    def locked_transact_write_items(**kwargs):
+        with lock:
+            return transact_write_items(**kwargs)
+
+    # When they're written with multiple workers
+    with patch.object(
+        dynamodb_client,
+        "transact_write_items",
+        side_effect=locked_transact_write_items,
+    ):
+        failed_items = populate.perform_transaction(
+            dynamodb_client, put_items, [], [], 4
+        )
+
+    # Then every chunk is written
+    assert failed_items == []
+    assert len(populate.get_all_services(dynamodb_client)) == 250 + len(dynamodb_table)
+    assert "Wrote 250/250 items" in capsys.readouterr().out
+
+
+def test_perform_transaction_retries_conflicts(dynamodb_client, dynamodb_table):
+    # Given a transaction that conflicts with another write the first time
+    put_items = make_put_items(10)
+    transact_write_items = dynamodb_client.transact_write_items
+    calls = []
+
+    def conflict_once(**kwargs):
+        calls.append(kwargs["ClientRequestToken"])
+
+        if len(calls) == 1:
+            raise transaction_canceled("TransactionConflict")
+        return transact_write_items(**kwargs)
+
+    # When the transaction is performed
+    with patch.object(
+        dynamodb_client, "transact_write_items", side_effect=conflict_once
+    ), patch.object(populate, "get_backoff_delay", return_value=0):
+        failed_items = populate.perform_transaction(dynamodb_client, put_items, [], [])
+
+    # Then it's retried with the same token until it succeeds
+    assert failed_items == []
+    assert len(calls) == 2
+    assert calls[0] == calls[1]
+
+
+@pytest.mark.parametrize(
+    "error,expected_attempts",
+    [
+        (transaction_canceled("ValidationError"), 1),
+        (
+            ClientError(
+                {"Error": {"Code": "ThrottlingException", "Message": "Slow down"}},
+                "TransactWriteItems",
+            ),
+            populate.MAX_ATTEMPTS,
+        ),
+        (
+            EndpointConnectionError(endpoint_url="https://dynamodb"),
+            populate.MAX_ATTEMPTS,
+        ),
+    ],
+)
+def test_perform_transaction_reports_failures(
+    dynamodb_client, error, expected_attempts, capsys
+):
+    # Given a transaction that can't succeed
+    put_items = make_put_items(150)
+
+    # When the transaction is performed
+    with patch.object(
+        dynamodb_client, "transact_write_items", side_effect=error
+    ) as transact_write_items, patch.object(
+        populate, "get_backoff_delay", return_value=0
+    ):
+        failed_items = populate.perform_transaction(dynamodb_client, put_items, [], [])
+
+    # Then every failed item is returned and summarized
+    assert failed_items == put_items
+    assert transact_write_items.call_count == 2 * expected_attempts
+    output = capsys.readouterr().out
+    assert "Wrote 0/150 items" in output
+    assert "Failed to write the following services" in output
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+def test_network_error_fails_one_chunk(dynamodb_client, dynamodb_table, bulk, capsys):
+    # Given a chunk that can't reach DynamoDB, and another chunk that can
+    put_items = make_put_items(populate.TRANSACT_WRITE_LIMIT + 10)
+    failing_name = populate.get_transaction_name(put_items[0])
+    operation = "batch_write_item" if bulk else "transact_write_items"
+    write_items = getattr(dynamodb_client, operation)
+
+    def fail_first_chunk(**kwargs):
+        if failing_name in json.dumps(kwargs):
+            raise EndpointConnectionError(endpoint_url="https://dynamodb")
+        return write_items(**kwargs)
+
+    # When the items are written
+    with patch.object(
+        dynamodb_client, operation, side_effect=fail_first_chunk
+    ), patch.object(populate, "get_backoff_delay", return_value=0):
+        failed_items = populate.perform_writes(
+            dynamodb_client, put_items, bulk, max_workers=1
+        )
+
+    # Then only that chunk fails, after being retried, and the others are still written
+    chunk_size = populate.BATCH_WRITE_LIMIT if bulk else populate.TRANSACT_WRITE_LIMIT
+    assert len(failed_items) == chunk_size
+    output = capsys.readouterr().out
+    assert "EndpointConnectionError" in output
+    assert f"Wrote {len(put_items) - chunk_size}/{len(put_items)} items" in output
+
+
+def test_finish_sync_fails_without_catalog_version(dynamodb_client, capsys):
+    # Given a sync whose changes were written, but whose catalog version can't be stamped
+    error = ClientError(
+        {"Error": {"Code": "ResourceNotFoundException", "Message": "Not found"}},
+        "PutItem",
+    )
+
+    # When the sync finishes
+    with patch.object(dynamodb_client, "put_item", side_effect=error), pytest.raises(
+        SystemExit
+    ) as exit_info:
+        populate.finish_sync(dynamodb_client, 1, [])
+
+    # Then it exits with an error, so the sync is run again
+    assert exit_info.value.code == 1
+    assert "run the sync again" in capsys.readouterr().out
+
+
+def test_backoff_delay_is_capped():
+    for attempt in range(20):
+        delay = populate.get_backoff_delay(attempt)
+        assert 0 <= delay <= populate.MAX_BACKOFF_DELAY
+
+
+def test_perform_batch_write(dynamodb_client, dynamodb_table, capsys):
+    # Given new services and services to delete
+    put_items = make_put_items(60)
+    remote_index = populate.index_remote_services(
+        populate.get_all_services(dynamodb_client)
+    )
+    delete_items = populate.remove_services(remote_index, {"EC2", "Config"})
+
+    # When they're written in bulk
+    failed_items = populate.perform_batch_write(
+        dynamodb_client, put_items, delete_items, 4
+    )
+
+    # Then every batch is written
+    assert failed_items == []
+    remote_names = {
+        service["Name"]["S"] for service in populate.get_all_services(dynamodb_client)
+    }
+    assert len(remote_names) == 60 + 2
+    assert {"Lambda", "Auto Scaling"} <= remote_names
+    output = capsys.readouterr().out
+    assert "Splitting batch-write-item into 3 batch(es)" in output
+    assert "Wrote 62/62 items" in output
+
+
+def test_perform_batch_write_redrives_unprocessed_items(
+    dynamodb_client, dynamodb_table
+):
+    # Given a batch where some items are throttled the first time
+    put_items = make_put_items(10)
+    batch_write_item = dynamodb_client.batch_write_item
+    requests = []
+
+    def throttle_once(RequestItems, **kwargs):
+        write_requests = RequestItems[populate.TABLE_NAME]
+        requests.append(write_requests)
+
+        if len(requests) == 1:
+            batch_write_item(
+                RequestItems={populate.TABLE_NAME: write_requests[:6]}, **kwargs
+            )
+            return {"UnprocessedItems": {populate.TABLE_NAME: write_requests[6:]}}
+        return batch_write_item(RequestItems=RequestItems, **kwargs)
+
+    # When the batch is written
+    with patch.object(
+        dynamodb_client, "batch_write_item", side_effect=throttle_once
+    ), patch.object(populate, "get_backoff_delay", return_value=0):
+        failed_items = populate.perform_batch_write(dynamodb_client, put_items, [])
+
+    # Then only the unprocessed items are sent again
+    assert failed_items == []
+    assert [len(write_requests) for write_requests in requests] == [10, 4]
+    assert len(populate.get_all_services(dynamodb_client)) == 10 + len(dynamodb_table)
+
+
+def test_perform_batch_write_reports_unprocessed_items(dynamodb_client, capsys):
+    # Given items that are always throttled
+    put_items = make_put_items(30)
+
+    def throttle(RequestItems, **kwargs):
+        return {"UnprocessedItems": RequestItems}
+
+    # When they're written in bulk
+    with patch.object(
+        dynamodb_client, "batch_write_item", side_effect=throttle
+    ), patch.object(populate, "get_backoff_delay", return_value=0):
+        failed_items = populate.perform_batch_write(dynamodb_client, put_items, [])
+
+    # Then they're reported as failed after every attempt
+    assert failed_items == [populate.to_write_request(item) for item in put_items]
+    output = capsys.readouterr().out
+    assert "Wrote 0/30 items" in output
+    assert f"after {populate.MAX_ATTEMPTS} attempt(s): 25 unprocessed item(s)" in output
+
+
+JSON_FILE_PATH = os.path.join(os.path.dirname(SCRIPT_PATH), populate.JSON_FILE_NAME)
+
+
+@pytest.mark.parametrize("read_size", [1, 7, 64 * 1024])
+def test_iter_json_array(monkeypatch, read_size):
+    # Given the JSON file read a few characters at a time
+    monkeypatch.setattr(populate, "JSON_READ_SIZE", read_size)
+
+    # When it's streamed
+    services = list(populate.iter_json_file(JSON_FILE_PATH))
+
+    # Then it matches parsing the whole file
+    assert services == populate.get_json_file(JSON_FILE_PATH)
+
+
+@pytest.mark.parametrize(
+    "contents,expected_items",
+    [
+        ("[]", []),
+        (' [ 1, "a", {"b": [2, 3]} ]', [1, "a", {"b": [2, 3]}]),
+        ("[12345]", [12345]),
+        ("[1,2]\n", [1, 2]),
+    ],
+)
+def test_iter_json_array_values(monkeypatch, tmp_path, contents, expected_items):
+    monkeypatch.setattr(populate, "JSON_READ_SIZE", 2)
+    file_path = tmp_path / "services.json"
+    file_path.write_text(contents)
+
+    assert list(populate.iter_json_file(str(file_path))) == expected_items
+
+
+@pytest.mark.parametrize(
+    "contents",
+    [
+        "",
+        "{}",
+        "[1, 2",
+        '[{"a": 1',
+        "[1 2]",
+        "[,,1]",
+        "[,]",
+        "[1,]",
+        "[1,,2]",
+        "[1] 2",
+        "[1]]",
+        "[] []",
+    ],
+)
+@pytest.mark.parametrize("read_size", [1, 64 * 1024])
+def test_iter_json_array_invalid(monkeypatch, tmp_path, contents, read_size):
+    monkeypatch.setattr(populate, "JSON_READ_SIZE", read_size)
+    file_path = tmp_path / "services.json"
+    file_path.write_text(contents)
+
+    with pytest.raises(ValueError):
+        list(populate.iter_json_file(str(file_path)))
+
+
+def test_iter_json_lines(tmp_path):
+    services = make_local_services(3)
+    file_path = tmp_path / "services.jsonl"
+    file_path.write_text(
+        "\n".join(json.dumps(service) for service in services) + "\n\n"
+    )
+
+    assert list(populate.iter_json_file(str(file_path))) == services
+    assert populate.get_json_file(str(file_path)) == services
+
+
+def test_iter_changes_matches_plan_changes(dynamodb_client, dynamodb_table):
+    # Given the JSON file and the table fixture
+    local_services = populate.get_json_file(JSON_FILE_PATH)
+    remote_services = populate.get_all_services(dynamodb_client)
+
+    # When the changes are planned all at once and streamed
+    put_items, update_items, delete_items = populate.plan_changes(
+        json.loads(json.dumps(local_services)), remote_services
+    )
+    streamed_items = list(
+        populate.iter_changes(
+            local_services + local_services[:2],
+            populate.index_remote_services(remote_services),
+        )
+    )
+
+    # Then the same changes are made (ignoring the random IDs of new services)
+    def summarize(items):
+        return sorted(
+            (next(iter(item)), populate.get_transaction_name(item)) for item in items
+        )
+
+    assert summarize(streamed_items) == summarize(
+        put_items + update_items + delete_items
+    )
+    assert sorted(
+        (item for item in streamed_items if "Update" in item),
+        key=populate.get_transaction_name,
+    ) == sorted(update_items, key=populate.get_transaction_name)
+
+
+def test_duplicate_services_keep_the_first(dynamodb_client, dynamodb_table):
+    # Given a JSON file where a service is listed twice with different prices
+    local_services = make_local_services(1) * 2
+    local_services[1] = {**local_services[1], "Price": 99}
+    remote_services = populate.get_all_services(dynamodb_client)
+
+    # When the changes are planned all at once and streamed
+    put_items, _, _ = populate.plan_changes(
+        json.loads(json.dumps(local_services)), remote_services
+    )
+    streamed_items = list(
+        populate.iter_changes(
+            local_services, populate.index_remote_services(remote_services)
+        )
+    )
+
+    # Then both keep the first service with that name
+    streamed_puts = [item for item in streamed_items if "Put" in item]
+    assert put_items == streamed_puts
+    assert [item["Put"]["Item"]["Price"] for item in put_items] == [{"N": "0"}]
+
+
+def test_sync_stream(dynamodb_client, dynamodb_table, tmp_path, capsys):
+    # Given a JSON Lines file that changes the table
+    services = make_local_services(150) + [
+        {
+            "Name": "Lambda",
+            "Description": "Run code in under 15 minutes",
+            "Price": 2e-7,
+            "Unit": "invocation",
+            "Category": "free",
+            "FreeTier": 1e6,
+        }
+    ]
+    file_path = tmp_path / "services.jsonl"
+    file_path.write_text("\n".join(json.dumps(service) for service in services))
+    args = argparse.Namespace(
+        file=str(file_path), segments=1, workers=1, bulk=True, plan=None
+    )
+
+    # When it's synced as a stream
+    with patch("builtins.input", return_value="y"), patch.object(
+        dynamodb_client, "batch_get_item", wraps=dynamodb_client.batch_get_item
+    ) as batch_get_item:
+        populate.sync_stream(dynamodb_client, args)
+
+    # Then the table matches the file, and the changed service was only read once
+    assert batch_get_item.call_count == 1
+    output = capsys.readouterr().out
+    assert "Adding 150 services, updating 1 services, and deleting 3 services" in output
+    assert "Wrote 154/154 items" in output
+    remote_names = {
+        service["Name"]["S"] for service in populate.get_all_services(dynamodb_client)
+    }
+    assert remote_names == {service["Name"] for service in services}
+
+
+def test_stream_memory_is_flat(tmp_path):
+    # Given a large JSON array of services
+    file_path = tmp_path / "services.json"
+    file_path.write_text(json.dumps(make_local_services(50_000)))
+
+    # When it's parsed all at once and streamed
+    tracemalloc.start()
+    populate.get_json_file(str(file_path))
+    _, load_peak = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    num_services = sum(1 for _ in populate.iter_json_file(str(file_path)))
+    _, stream_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Then streaming only keeps a small buffer in memory
+    print(f"{load_peak=} {stream_peak=}")
+    assert num_services == 50_000
+    assert stream_peak < load_peak / 10
+
+
+def test_content_hash():
+    service = {"Name": "EC2", "Price": 3, "FreeTier": None}
+
+    # Key order, number formatting, and DynamoDB-only attributes don't change the hash
+    assert populate.get_content_hash(service) == populate.get_content_hash(
+        {"FreeTier": None, "Price": 3e0, "Name": "EC2", "Id": "1", "NameLower": "ec2"}
+    )
+    assert populate.get_content_hash(service) != populate.get_content_hash(
+        {**service, "Price": 3.5}
+    )
+
+
+def test_unchanged_services_are_skipped(dynamodb_client, dynamodb_table):
+    # Given a table that was synced with the JSON file
+    local_services = make_local_services(250)
+    populate.perform_transaction(
+        dynamodb_client,
+        populate.add_services(
+            populate.index_local_services(json.loads(json.dumps(local_services))),
+            {service["Name"] for service in local_services},
+        ),
+        [],
+        [],
+        1,
+    )
+    local_services.extend(
+        service
+        for service in populate.get_json_file(JSON_FILE_PATH)
+        if service["Name"] in {"Lambda", "EC2"}
+    )
+    local_services[0]["Price"] += 1
+
+    # When the table is synced again with a projected scan
+    remote_services = populate.get_all_services(
+        dynamodb_client, populate.HASH_PROJECTION
+    )
+    batch_get_item = dynamodb_client.batch_get_item
+
+    with patch.object(
+        dynamodb_client, "batch_get_item", side_effect=batch_get_item
+    ) as mock_batch_get_item:
+        put_items, update_items, delete_items = populate.plan_changes(
+            local_services, remote_services, dynamodb_client
+        )
+
+    # Then only the changed service and the services without a hash are read in full
+    requested_names = sorted(
+        key["Name"]["S"]
+        for call in mock_batch_get_item.call_args_list
+        for key in call.kwargs["RequestItems"][populate.TABLE_NAME]["Keys"]
+    )
+    assert requested_names == ["EC2", "Lambda", "Service 0"]
+    update_expressions = {
+        item["Update"]["Key"]["Name"]["S"]: item["Update"]["UpdateExpression"]
+        for item in update_items
+    }
+    assert update_expressions == {
+        "Service 0": "SET Price = :price, ContentHash = :contenthash",
+        "EC2": "SET ContentHash = :contenthash",
+        "Lambda": "SET ContentHash = :contenthash",
+    }
+    assert put_items == []
+    assert len(delete_items) == 2
+
+
+def run_script(monkeypatch, *args):
+    monkeypatch.setattr(sys, "argv", ["populate-dynamodb-table.py", *args])
+    populate.main()
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_plan_with_truncated_file(dynamodb_table, monkeypatch, tmp_path, stream):
+    # Given a JSON file that was cut off in the middle
+    with open(JSON_FILE_PATH) as json_file:
+        contents = json_file.read()
+
+    truncated_path = tmp_path / "truncated.json"
+    truncated_path.write_text(contents[: len(contents) // 2])
+    plan_path = tmp_path / "plan.jsonl.gz"
+    stream_args = ["--stream"] if stream else []
+
+    # When a plan is saved from it
+    with pytest.raises((ValueError, SystemExit)):
+        run_script(
+            monkeypatch,
+            "--file",
+            str(truncated_path),
+            "--plan",
+            str(plan_path),
+            *stream_args,
+        )
+
+    # Then no plan file is left behind
+    assert list(tmp_path.iterdir()) == [truncated_path]
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_plan_and_apply(dynamodb_client, dynamodb_table, monkeypatch, tmp_path, stream):
+    # Given a plan to sync the table with the JSON file
+    plan_path = str(tmp_path / "plan.jsonl.gz")
+    stream_args = ["--stream"] if stream else []
+
+    with patch("builtins.input") as mock_input:
+        run_script(
+            monkeypatch, "--file", JSON_FILE_PATH, "--plan", plan_path, *stream_args
+        )
+
+    # The plan doesn't need confirmation or change the table
+    mock_input.assert_not_called()
+    assert len(populate.get_all_services(dynamodb_client)) == len(dynamodb_table)
+
+    # When the plan is applied
+    with patch.object(
+        dynamodb_client, "scan", side_effect=AssertionError("Shouldn't scan")
+    ), patch("boto3.client", return_value=dynamodb_client):
+        run_script(monkeypatch, "--apply", plan_path, "--workers", "1")
+
+    # Then the table matches the JSON file, without any changes left to plan
+    local_services = populate.get_json_file(JSON_FILE_PATH)
+    remote_services = populate.get_all_services(
+        dynamodb_client, populate.HASH_PROJECTION
+    )
+    assert {service["Name"]["S"] for service in remote_services} == {
+        service["Name"] for service in local_services
+    }
+    assert populate.plan_changes(local_services, remote_services, dynamodb_client) == (
+        [],
+        [],
+        [],
+    )
+    assert populate.get_catalog_version(dynamodb_client) is not None
+
+
+def test_apply_stale_plan(
+    dynamodb_client, dynamodb_table, monkeypatch, tmp_path, capsys
+):
+    # Given a plan made before the table was synced again
+    plan_path = str(tmp_path / "plan.jsonl.gz")
+    run_script(monkeypatch, "--file", JSON_FILE_PATH, "--plan", plan_path)
+    populate.update_catalog_version(dynamodb_client)
+
+    # When the plan is applied, it's rejected
+    with pytest.raises(SystemExit) as exit_info:
+        run_script(monkeypatch, "--apply", plan_path)
+
+    assert exit_info.value.code == 1
+    assert "The table changed since the plan was made" in capsys.readouterr().out
+    assert len(populate.get_all_services(dynamodb_client)) == len(dynamodb_table)
+
+    # Unless it's forced
+    run_script(monkeypatch, "--apply", plan_path, "--force", "--workers", "1")
+    assert len(populate.get_all_services(dynamodb_client)) == len(
+        populate.get_json_file(JSON_FILE_PATH)
+    )
+
+
+def test_apply_verifies_snapshot(
+    dynamodb_client, dynamodb_table, monkeypatch, tmp_path, capsys
+):
+    # Given a plan made before a service was edited outside the script
+    plan_path = str(tmp_path / "plan.jsonl.gz")
+    run_script(monkeypatch, "--file", JSON_FILE_PATH, "--plan", plan_path)
+    dynamodb_client.put_item(
+        TableName=populate.TABLE_NAME,
+        Item={**dynamodb_table[0], "ContentHash": {"S": "edited"}},
+    )
+
+    # When the plan is applied with --verify, it's rejected
+    with pytest.raises(SystemExit):
+        run_script(monkeypatch, "--apply", plan_path, "--verify")
+
+    assert "The services in the table changed" in capsys.readouterr().out
+
+
+def test_apply_plan_for_another_table(dynamodb_client, monkeypatch, tmp_path):
+    plan_path = str(tmp_path / "plan.jsonl.gz")
+    populate.write_plan(plan_path, [], None, populate.get_snapshot_hash([]))
+    monkeypatch.setattr(populate, "TABLE_NAME", "other-table")
+
+    with pytest.raises(ValueError, match="The plan was made for test-table"):
+        run_script(monkeypatch, "--apply", plan_path)
+
+
+def test_get_shard():
+    names = [service["Name"] for service in make_local_services(1_000)]
+    shards = [populate.get_shard(name, 4) for name in names]
+
+    # Shards are stable across runs and cover every shard
+    assert populate.get_shard("EC2", 4) == populate.get_shard("EC2", 4)
+    assert set(shards) == {0, 1, 2, 3}
+    assert max(shards.count(shard) for shard in range(4)) < 2 * len(names) / 4
+
+
+def write_services_file(tmp_path, services):
+    file_path = tmp_path / "services.jsonl"
+    file_path.write_text("\n".join(json.dumps(service) for service in services))
+    return str(file_path)
+
+
+def test_bulk_sync_without_updates(
+    dynamodb_client, dynamodb_table, monkeypatch, tmp_path, capsys
+):
+    # Given a file that only adds and removes services
+    file_name = write_services_file(tmp_path, make_local_services(30))
+
+    # When it's synced in bulk
+    with patch("builtins.input", return_value="y"):
+        run_script(monkeypatch, "--file", file_name, "--bulk", "--workers", "1")
+
+    # Then no empty transactions are written
+    output = capsys.readouterr().out
+    assert "Splitting batch-write-item into 2 batch(es)" in output
+    assert "transact-write-items" not in output
+    assert "Wrote 0/0 items" not in output
+    assert len(populate.get_all_services(dynamodb_client)) == 30
+
+
+def test_partition_services(dynamodb_client, dynamodb_table, tmp_path):
+    # Given the local and remote services
+    services = make_local_services(100)
+    file_name = write_services_file(tmp_path, services)
+    remote_services = populate.get_all_services(dynamodb_client)
+
+    # When they're partitioned into shards
+    shard_file_names = populate.partition_local_services(file_name, str(tmp_path), 3)
+    remote_shards = populate.partition_remote_services(remote_services, 3)
+
+    # Then every service is in the shard for its name
+    for shard_i, shard_file_name in enumerate(shard_file_names):
+        for service in populate.iter_json_file(shard_file_name):
+            assert populate.get_shard(service["Name"], 3) == shard_i
+        for service in remote_shards[shard_i]:
+            assert populate.get_shard(service["Name"]["S"], 3) == shard_i
+
+    assert sum(
+        len(list(populate.iter_json_file(shard_file_name)))
+        for shard_file_name in shard_file_names
+    ) == len(services)
+    assert sum(len(remote_shard) for remote_shard in remote_shards) == len(
+        remote_services
+    )
+
+
+def test_sync_shards(dynamodb_client, dynamodb_table, tmp_path, capsys):
+    # Given a file that adds and removes services
+    services = make_local_services(200)
+    args = argparse.Namespace(
+        file=write_services_file(tmp_path, services),
+        segments=1,
+        shards=4,
+        workers=1,
+        bulk=True,
+    )
+
+    # When it's synced with multiple shards (threads, since moto's state isn't shared
+    # between processes)
+    with patch("builtins.input", return_value="y"), patch.object(
+        populate, "iter_changes", wraps=populate.iter_changes
+    ) as iter_changes:
+        populate.sync_shards(dynamodb_client, args, ThreadPoolExecutor)
+
+    # Then each shard is only compared once, and the per-shard reports are merged
+    assert iter_changes.call_count == args.shards
+    output = capsys.readouterr().out
+    assert "Adding 200 services, updating 0 services, and deleting 4 services" in output
+    assert output.count("Shard #") == 8
+    assert "Wrote 204/204 items in total" in output
+    assert {
+        service["Name"]["S"] for service in populate.get_all_services(dynamodb_client)
+    } == {service["Name"] for service in services}
+
+
+def test_sync_shards_in_processes(dynamodb_client, dynamodb_table, tmp_path, capsys):
+    # Given a file that adds services
+    args = argparse.Namespace(
+        file=write_services_file(tmp_path, make_local_services(50)),
+        segments=1,
+        shards=2,
+        workers=1,
+        bulk=False,
+    )
+
+    # When the changes are planned in separate processes and declined
+    with patch("builtins.input", return_value="n"):
+        populate.sync_shards(dynamodb_client, args)
+
+    # Then the plans from each process are merged, without writing anything
+    output = capsys.readouterr().out
+    assert "Adding 50 services, updating 0 services, and deleting 4 services" in output
+    assert "Ok, won't update the database" in output
+    assert len(populate.get_all_services(dynamodb_client)) == len(dynamodb_table)
+
+
+def test_service_id_is_derived_from_name():
+    # Given the same service written twice
+    service = make_local_services(1)[0]
+    # When the put requests are created
+    first_put = populate.create_put_request({**service})
+    second_put = populate.create_put_request({**service})
+    # Then both use the same ID, which the store can derive from the name
+    service_id = first_put["Put"]["Item"]["Id"]["S"]
+    assert service_id == second_put["Put"]["Item"]["Id"]["S"]
+    assert service_id == populate.get_service_id(service["Name"])
+    assert service_id != populate.get_service_id(service["Name"] + " ")
+
+
+def test_migrate_service_ids(dynamodb_client, dynamodb_table, capsys):
+    # Given a table with random IDs and a service that's already migrated
+    service = {**dynamodb_table[0], "Id": {"S": populate.get_service_id("Lambda")}}
+    dynamodb_client.delete_item(
+        TableName="test-table",
+        Key={"Id": dynamodb_table[0]["Id"], "Name": dynamodb_table[0]["Name"]},
+    )
+    dynamodb_client.put_item(TableName="test-table", Item=service)
+    args = argparse.Namespace(segments=1, workers=1)
+
+    # When the IDs are migrated
+    with patch("builtins.input", return_value="y"):
+        populate.migrate_service_ids(dynamodb_client, args)
+
+    # Then only the other services are moved, keeping all of their attributes
+    output = capsys.readouterr().out
+    assert "Migrating 3 services to IDs derived from their names" in output
+    assert "Wrote 6/6 items" in output
+    remote_services = populate.get_all_services(dynamodb_client)
+    assert sorted(remote_services, key=lambda service: service["Name"]["S"]) == sorted(
+        (
+            {**item, "Id": {"S": populate.get_service_id(item["Name"]["S"])}}
+            for item in dynamodb_table
+        ),
+        key=lambda service: service["Name"]["S"],
+    )
+    assert populate.get_catalog_version(dynamodb_client) is not None
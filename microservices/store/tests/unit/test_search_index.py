@@ -0,0 +1,138 @@
+import os
+import pytest
+import random
+import sys
+import time
+
+sys.path.append("..")
+
+from src import app
+
+# Larger catalogs take a while to build, so only benchmark them when requested
+RUN_BENCHMARKS = os.environ.get("RUN_BENCHMARKS") is not None
+WORDS = [
+    "compute",
+    "storage",
+    "database",
+    "serverless",
+    "analytics",
+    "machine",
+    "learning",
+    "network",
+    "security",
+    "managed",
+    "scalable",
+    "cloud",
+    "queue",
+    "stream",
+    "cache",
+]
+
+
+def make_services(num_services, seed=0):
+    # Generate a synthetic catalog with the same shape as the DynamoDB items
+    rng = random.Random(seed)
+    return [
+        {
+            "Id": {"S": str(i)},
+            "Name": {"S": f"Service {i:x}"},
+            "Description": {"S": " ".join(rng.choices(WORDS, k=6))},
+            "Price": {"N": str(rng.randint(0, 100))},
+            "Category": {"S": rng.choice(["free", "trial", "paid"])},
+        }
+        for i in range(num_services)
+    ]
+
+
+def test_trigrams():
+    assert app.TrigramIndex.get_trigrams("lambda") == {"lam", "amb", "mbd", "bda"}
+    assert app.TrigramIndex.get_trigrams("ec") == set()
+
+
+@pytest.mark.parametrize(
+    "query", ["code", "run", "in", "e", "ec2 ", "the configuration", "zzz", "scale"]
+)
+def test_index_matches_linear_scan(dynamodb_table, query):
+    # Given a search index over the catalog
+    services = app.scan_table(os.environ["TableName"])
+    index = app.TrigramIndex(services)
+    # When a query is filtered with and without the index
+    indexed_services = app.filter_services(services, query, index=index)
+    scanned_services = app.filter_services(services, query)
+    # Then both return the same services in the same order
+    assert indexed_services == scanned_services
+
+
+def test_index_returns_candidates_in_catalog_order():
+    # Given a search index over a synthetic catalog
+    services = make_services(500)
+    index = app.TrigramIndex(services)
+    # When searching for a common word
+    positions = index.search("cache")
+    # Then the candidate positions are sorted
+    assert positions == sorted(positions)
+    assert all(
+        "cache" in services[position]["Description"]["S"] for position in positions
+    )
+
+
+def test_short_query_skips_index():
+    index = app.TrigramIndex(make_services(10))
+    assert index.search("ab") is None
+
+
+def test_search_index_rebuilt_per_snapshot():
+    # Given a search index built for a snapshot
+    snapshot = make_services(10)
+    index = app.get_search_index(snapshot)
+    # When the snapshot is the same or changes
+    # Then the index is only rebuilt for the new snapshot
+    assert app.get_search_index(snapshot) is index
+    assert app.get_search_index(make_services(10)) is not index
+
+
+@pytest.mark.parametrize(
+    "num_services",
+    [
+        100,
+        1_000,
+        pytest.param(
+            10_000,
+            marks=pytest.mark.skipif(not RUN_BENCHMARKS, reason="RUN_BENCHMARKS"),
+        ),
+        pytest.param(
+            100_000,
+            marks=pytest.mark.skipif(not RUN_BENCHMARKS, reason="RUN_BENCHMARKS"),
+        ),
+        pytest.param(
+            1_000_000,
+            marks=pytest.mark.skipif(not RUN_BENCHMARKS, reason="RUN_BENCHMARKS"),
+        ),
+    ],
+)
+def test_benchmark_index_lookup(num_services):
+    # Given a synthetic catalog and its search index
+    services = make_services(num_services)
+    start = time.perf_counter()
+    index = app.TrigramIndex(services)
+    build_time = time.perf_counter() - start
+
+    # When a rare term is searched with and without the index
+    query = f"service {num_services // 2:x}"
+    start = time.perf_counter()
+    indexed_services = app.filter_services(services, query, index=index)
+    index_time = time.perf_counter() - start
+    start = time.perf_counter()
+    scanned_services = app.filter_services(services, query)
+    scan_time = time.perf_counter() - start
+
+    # Then the results are identical and the lookup avoids checking every service
+    print(
+        f"{num_services=} build={build_time:.3f}s index={index_time * 1000:.3f}ms scan={scan_time * 1000:.3f}ms"
+    )
+    assert indexed_services == scanned_services
+    assert len(indexed_services) >= 1
+
+    # Timings depend on the machine, so only compare them when benchmarking
+    if RUN_BENCHMARKS and num_services >= 10_000:
+        assert index_time < scan_time